@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: benchmark_meta_analysis
+    :synopsis: script timing the meta-analyses, the sensitivity analyses and the imports on simulated studies
+
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+
+Each optimized path is timed next to the computation it replaces (one meta-analysis per group, one refit per subset of
+studies, a new parse of the csv file), on studies simulated with a fixed seed. Run from the root of the repository::
+
+    python benchmarks/benchmark_meta_analysis.py [--studies 20000] [--repeats 3]
+
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import warnings
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from source_assess_treatment_efficacy.meta_analysis.import_csv_for_meta_analysis import import_csv
+from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import (run_meta_analysis,
+                                                                                  run_batched_meta_analysis)
+from source_assess_treatment_efficacy.meta_analysis.sensitivity_analysis import (run_leave_one_out_analysis,
+                                                                                 run_cumulative_meta_analysis)
+
+
+def _write_csv(csv_file, n_studies, seed=0):
+    """Writes the parents' and teachers' ratings of simulated studies in the form of the csv files of the examples."""
+
+    random_generator = np.random.default_rng(seed)
+    n_treatment = random_generator.integers(10, 60, n_studies)
+    n_control = random_generator.integers(10, 60, n_studies)
+    rows = []
+    for rater in ['Parents', 'Teachers']:
+        mean_pre = random_generator.normal(30, 3, (n_studies, 2))
+        mean_post = mean_pre - random_generator.normal([4, 2], 2, (n_studies, 2))
+        std = random_generator.uniform(5, 9, (n_studies, 4))
+        for group, column, n_patients in [('Treatment', 0, n_treatment), ('Control', 1, n_control)]:
+            for time_point, mean, std_column in [('pre', mean_pre, 2*column), ('post', mean_post, 2*column + 1)]:
+                rows.append(pd.DataFrame({'Author': ['Study %d' % study for study in range(n_studies)],
+                                          'Year': 1990 + np.arange(n_studies) % 30,
+                                          'Group': group,
+                                          'Score Name': ['Scale %d' % (study % 5) for study in range(n_studies)],
+                                          'Number of patients': n_patients,
+                                          'Raters': rater,
+                                          'Time': time_point,
+                                          'Mean': mean[:, column].round(2),
+                                          'Std': std[:, std_column].round(2),
+                                          'Line': np.arange(n_studies)}))
+    df = pd.concat(rows).sort_values(['Line', 'Raters'], kind='stable').drop(columns='Line')
+    df.to_csv(csv_file, index=False)
+
+
+def _import_with_masks(csv_file, raters):
+    """Imports the ratings of a rater as the importer did before the one-pass reshape: the csv file is parsed again for
+    each rater, and each group and time is selected with a boolean mask over all its lines."""
+
+    df = pd.read_csv(csv_file)
+    columns = {}
+    for group in ['Treatment', 'Control']:
+        for time_point in ['pre', 'post']:
+            lines = df[(df['Group'] == group) & (df['Time'] == time_point) & (df['Raters'] == raters)].index
+            columns['mean_%s_test_%s' % (time_point, group.lower())] = df.loc[lines, 'Mean'].tolist()
+            columns['std_%s_test_%s' % (time_point, group.lower())] = df.loc[lines, 'Std'].tolist()
+            if time_point == 'pre':
+                columns['n_%s' % group.lower()] = df.loc[lines, 'Number of patients'].tolist()
+                if group == 'Treatment':
+                    columns['year'] = df.loc[lines, 'Year'].tolist()
+                    columns['score_name'] = df.loc[lines, 'Score Name'].tolist()
+                    name_studies = df.loc[lines, 'Author']
+    df_values = pd.DataFrame(columns, index=[name_studies])
+
+    return df_values[df_values.isna().sum(axis=1) == 0]
+
+
+def _best_time(function, repeats):
+    """Returns the best run time of a function over several runs, in seconds."""
+
+    run_times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        run_times.append(time.perf_counter() - start)
+
+    return min(run_times)
+
+
+def _report(title, rows):
+    """Prints the run times of a benchmark, and the speed-up of each optimized path over the path it replaces."""
+
+    print('\n' + title)
+    for name, run_time, reference_time in rows:
+        speed_up = '' if reference_time is None else '  (x%.0f)' % (reference_time/run_time)
+        print('  %-64s %8.4f s%s' % (name, run_time, speed_up))
+
+
+def benchmark_batched_meta_analysis(df_values, repeats, n_groups=1000, n_loop=100):
+    """Meta-analyses of groups of studies in one call, against one call of ``run_meta_analysis`` per group."""
+
+    df_groups = pd.concat([df_values.iloc[:10*n_groups]], keys=['all'], names=['dataset'])
+    df_groups['group'] = np.arange(len(df_groups))//10
+    groups = [df_group.drop(columns='group') for _, df_group in df_groups[df_groups['group'] < n_loop].groupby('group')]
+
+    loop_time = _best_time(lambda: [run_meta_analysis(df_group.copy()) for df_group in groups], repeats)*n_groups/n_loop
+    _report('Meta-analyses of %d groups of 10 studies' % n_groups, [
+        ('one run_meta_analysis per group (extrapolated from %d)' % n_loop, loop_time, None),
+        ('run_batched_meta_analysis', _best_time(lambda: run_batched_meta_analysis(df_groups.copy(), 'group'),
+                                                 repeats), loop_time),
+        ('run_meta_analysis of all the %d studies' % len(df_values),
+         _best_time(lambda: run_meta_analysis(df_values.copy()), repeats), None)])
+
+
+def benchmark_sensitivity_analyses(df_values, repeats, n_studies=500):
+    """Leave-one-out and cumulative meta-analyses, against one refit of ``run_meta_analysis`` per subset of studies."""
+
+    df_subset = df_values.iloc[:n_studies].copy()
+    df_results_per_study, df_results, _ = run_meta_analysis(df_subset.copy())
+    df_sorted = df_subset.iloc[np.argsort(df_subset['year'].to_numpy(), kind='stable')]
+
+    refits_leave_one_out = _best_time(lambda: [run_meta_analysis(df_subset.drop(df_subset.index[study]))
+                                               for study in range(n_studies)], 1)
+    refits_cumulative = _best_time(lambda: [run_meta_analysis(df_sorted.iloc[:study + 1].copy())
+                                            for study in range(n_studies)], 1)
+    _report('Sensitivity analyses of %d studies' % n_studies, [
+        ('leave-one-out: one refit per study', refits_leave_one_out, None),
+        ('leave-one-out: run_leave_one_out_analysis',
+         _best_time(lambda: run_leave_one_out_analysis(df_results_per_study, df_results), repeats),
+         refits_leave_one_out),
+        ('cumulative: one refit per prefix', refits_cumulative, None),
+        ('cumulative: run_cumulative_meta_analysis',
+         _best_time(lambda: run_cumulative_meta_analysis(df_results_per_study), repeats), refits_cumulative)])
+
+    # Summary effects drifting with the year of publication, the case handled by the segmented prefix sums
+    df_results_per_study, df_results, _ = run_meta_analysis(df_values.copy())
+    df_results_per_study['Year'] = np.arange(len(df_results_per_study))
+    df_results_per_study['Effect size'] += np.linspace(0, 3, len(df_results_per_study))
+    _report('Sensitivity analyses of %d studies' % len(df_values), [
+        ('leave-one-out: run_leave_one_out_analysis',
+         _best_time(lambda: run_leave_one_out_analysis(df_results_per_study, df_results), repeats), None),
+        ('cumulative: run_cumulative_meta_analysis, drifting effect sizes',
+         _best_time(lambda: run_cumulative_meta_analysis(df_results_per_study), repeats), None)])
+
+
+def benchmark_import(csv_file, repeats):
+    """Import of the three raters of a csv file, parsed once or per rater, or loaded from its binary copy."""
+
+    masks_time = _best_time(lambda: [_import_with_masks(csv_file, rater) for rater in ['Parents', 'Teachers',
+                                                                                       'Clinicians']], repeats)
+    parse_time = _best_time(lambda: import_csv(csv_file), repeats)
+    rows = [('one parse and boolean masks per rater', masks_time, None),
+            ('import_csv, one parse and one reshape', parse_time, masks_time)]
+    try:
+        import pyarrow
+    except ImportError:
+        rows.append(('import_csv(cache=...): pyarrow is not installed', float('nan'), None))
+    else:
+        with tempfile.TemporaryDirectory() as cache_directory:
+            for cache_format in ['feather', 'parquet']:
+                import_csv(csv_file, cache=cache_directory, cache_format=cache_format)
+                rows.append(('import_csv(cache=...), %s copy' % cache_format,
+                             _best_time(lambda: import_csv(csv_file, cache=cache_directory, cache_format=cache_format),
+                                        repeats), parse_time))
+    _report('Import of %s (%.1f MB)' % (os.path.basename(csv_file), os.path.getsize(csv_file)/2**20), rows)
+
+
+def benchmark_import_time(repeats):
+    """Time to import the modules of the meta-analysis in a new interpreter, the plotting and regression libraries being
+    imported only when they are used."""
+
+    def import_time(statement):
+        return _best_time(lambda: subprocess.run([sys.executable, '-c', statement], check=True,
+                                                 cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__)))),
+                          repeats)
+
+    numpy_pandas = import_time('import numpy, pandas')
+    _report('Import in a new interpreter', [
+        ('numpy and pandas', numpy_pandas, None),
+        ('perform_meta_analysis',
+         import_time('import source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis'), None),
+        ('perform_saob', import_time('import source_assess_treatment_efficacy.systematic_analysis_of_biases.perform_saob'),
+         None),
+        ('matplotlib.pyplot and statsmodels, imported only when used',
+         import_time('import matplotlib.pyplot, statsmodels.api'), None)])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[-2].strip(),
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--studies', type=int, default=20000, help='number of simulated studies (default: 20000)')
+    parser.add_argument('--repeats', type=int, default=3, help='runs of each timing, the best one is kept (default: 3)')
+    arguments = parser.parse_args()
+
+    warnings.simplefilter('ignore')
+    with tempfile.TemporaryDirectory() as directory:
+        csv_file = os.path.join(directory, 'values_total_meta_analysis_simulated.csv')
+        _write_csv(csv_file, arguments.studies)
+        df_values = import_csv(csv_file, 'Parents')
+
+        print('%d simulated studies, %d lines, numpy %s, pandas %s' % (arguments.studies, 8*arguments.studies,
+                                                                       np.__version__, pd.__version__))
+        benchmark_batched_meta_analysis(df_values, arguments.repeats, n_groups=min(1000, arguments.studies//10))
+        benchmark_sensitivity_analyses(df_values, arguments.repeats, n_studies=min(500, arguments.studies))
+        benchmark_import(csv_file, arguments.repeats)
+        benchmark_import_time(arguments.repeats)
@@ -7,5 +7,11 @@ setup(name='source_assess_treatment_efficacy',
       url='https://github.com/AuroreBussalb/meta-analysis-statistical-tools',
       author='Aurore Bussalb',
       author_email='aurore.bussalb@mensiatech.com',
-      packages=['source_assess_treatment_efficacy/meta_analysis', 'source_assess_treatment_efficacy/systematic_analysis_of_biases'],
+      packages=['source_assess_treatment_efficacy', 'source_assess_treatment_efficacy/meta_analysis', 'source_assess_treatment_efficacy/systematic_analysis_of_biases'],
+      install_requires=['numpy>=1.17', 'pandas>=1.2', 'scipy>=0.19.0'],
+      # Only loaded by the functions that need them: plots, regressions of the SAOB, decision tree and cached imports
+      extras_require={'plot': ['matplotlib>=3.1'],
+                      'saob': ['scikit-learn>=0.18.1', 'statsmodels>=0.8.0'],
+                      'graphviz': ['graphviz>=0.8.1'],
+                      'cache': ['pyarrow']},
       zip_safe=False)
\ No newline at end of file
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: bulk_import
+    :synopsis: module importing all the csv files of a directory at once, tagged with their dataset, outcome and subgroup
+
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+"""
+
+import os
+import glob
+import warnings
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+from .compact import compact_dtypes
+from .meta_analysis import import_csv_for_meta_analysis
+from .systematic_analysis_of_biases import import_csv_for_factors
+
+
+# Outcomes found in the names of the csv files, e.g. values_total_meta_analysis.csv
+OUTCOMES = ['total', 'inattention', 'hyperactivity']
+
+LABELS = ['dataset', 'outcome', 'subgroup']
+
+
+def _file_labels(csv_file, root, outcomes):
+    """Labels a csv file from its localisation: the first directory below the root is the dataset, the next ones the
+    subgroup (None if the file is directly in the dataset), and the outcome is a word of the name of the file."""
+
+    directories = os.path.relpath(os.path.dirname(os.path.abspath(csv_file)), root).split(os.sep)
+    directories = [directory for directory in directories if directory != os.curdir]
+    dataset = directories[0] if directories else os.path.basename(root)
+    subgroup = '/'.join(directories[1:]) or None
+    name = os.path.splitext(os.path.basename(csv_file))[0]
+    outcome = next((word for word in name.split('_') if word in outcomes), name)
+
+    return dataset, outcome, subgroup
+
+
+def _import_file(csv_file, importer, cache, cache_format):
+    """Imports one csv file with all its raters in a single dataframe, in a worker thread or process."""
+
+    if importer == 'meta_analysis':
+        return import_csv_for_meta_analysis.import_csv(csv_file, long_format=True, cache=cache, cache_format=cache_format)
+
+    df_values_parents, df_values_teachers = import_csv_for_factors.import_csv(csv_file, cache=cache,
+                                                                              cache_format=cache_format)
+    return pd.concat([df_values_parents, df_values_teachers])
+
+
+def import_directory(path, importer='meta_analysis', n_jobs=1, pool='thread', outcomes=OUTCOMES, cache=False,
+                     cache_format='feather', compact=False):
+    """Imports all the csv files of a directory (and of its subdirectories) in one dataframe, the files being parsed
+    concurrently. Each study is tagged with the dataset, the outcome and the subgroup of its file, so that the
+    meta-analyses of all the files can be performed at once, e.g. with
+    ``run_batched_meta_analysis(df, group_by=['dataset', 'outcome', 'subgroup', 'raters'])``.
+
+    The labels come from the localisation of each file below the directory: for
+    ``meta-analysis/data-subgroup-analysis/standard-protocol/values_total_meta_analysis_sd.csv`` imported from
+    ``meta-analysis``, the dataset is 'data-subgroup-analysis', the subgroup 'standard-protocol' and the outcome 'total'.
+    The files directly in a dataset (e.g. ``meta-analysis/data-update``) have no subgroup.
+
+    Parameters
+    ----------
+    path: str
+        Directory, or glob pattern of the csv files (``**`` matches any subdirectory). With a pattern, the labels are
+        taken below its directories without wildcard.
+
+    importer: str, default = 'meta_analysis'
+        'meta_analysis' to import the files with ``import_csv_for_meta_analysis.import_csv``, or 'saob' to import them
+        with ``import_csv_for_factors.import_csv``.
+
+    n_jobs: int, default = 1
+        Number of files parsed concurrently, 1 to parse them one after the other in the current thread.
+
+    pool: str, default = 'thread'
+        'thread' (the parser of pandas releases the GIL for a large part of the parsing, no data is copied between
+        workers) or 'process' (the dataframes are pickled back to the current process).
+
+    outcomes: list of str, optional
+        Outcomes looked for in the words (separated by '_') of the names of the files. A file whose name contains none
+        of them has its name as outcome.
+
+    cache: bool or str, default = False
+        Cache of the parsed csv files, see ``import_csv_for_meta_analysis.import_csv``.
+
+    cache_format: str, default = 'feather'
+        Format of the cached files, 'feather' or 'parquet'.
+
+    compact: bool, default = False
+        If True, the dataframe has compact types, see ``compact.compact_dtypes``. The types are converted once all the
+        files are put together, so that the categories are shared by all the files.
+
+    Returns
+    -------
+    df_values: pandas.DataFrame
+        Studies of all the files, with the columns of the importer. The index has the levels 'dataset', 'outcome' and
+        'subgroup', then the levels of the importer: 'raters' and 'Author' for the meta-analysis, 'Author' for the SAOB
+        (whose rater is the column 'raters'). Files are in the order of their names.
+
+    """
+
+    if importer not in ['meta_analysis', 'saob']:
+        raise ValueError("importer is either 'meta_analysis' or 'saob'")
+    if pool not in ['thread', 'process']:
+        raise ValueError("pool is either 'thread' or 'process'")
+
+    if os.path.isdir(path):
+        root = os.path.abspath(path)
+        csv_files = sorted(glob.glob(os.path.join(path, '**', '*.csv'), recursive=True))
+    else:
+        csv_files = sorted(glob.glob(path, recursive=True))
+        # Directories of the pattern before the first wildcard
+        parts = os.path.dirname(path).split(os.sep)
+        n_fixed_parts = next((i for i, part in enumerate(parts) if glob.has_magic(part)), len(parts))
+        root = os.path.abspath(os.sep.join(parts[:n_fixed_parts]) or os.curdir)
+    if not csv_files:
+        raise ValueError('No csv file found in %s' % path)
+
+    labels = [_file_labels(csv_file, root, outcomes) for csv_file in csv_files]
+    if len(set(labels)) < len(labels):
+        warnings.warn('Several files have the same dataset, outcome and subgroup, their studies are put together')
+
+    arguments = [csv_files, [importer]*len(csv_files), [cache]*len(csv_files), [cache_format]*len(csv_files)]
+    if n_jobs == 1:
+        frames = list(map(_import_file, *arguments))
+    else:
+        Executor = ThreadPoolExecutor if pool == 'thread' else ProcessPoolExecutor
+        with Executor(max_workers=n_jobs) as executor:
+            frames = list(executor.map(_import_file, *arguments))
+
+    # The labels are repeated for the studies of each file and put before the levels of the index of the importer
+    # (concat with keys does not accept the missing subgroups)
+    df_values = pd.concat(frames)
+    lengths = [len(frame) for frame in frames]
+    label_levels = [np.repeat(np.array(values, dtype=object), lengths) for values in zip(*labels)]
+    df_values.index = pd.MultiIndex.from_arrays(label_levels + [df_values.index.get_level_values(level)
+                                                                for level in range(df_values.index.nlevels)],
+                                                names=LABELS + list(df_values.index.names))
+
+    return compact_dtypes(df_values) if compact else df_values
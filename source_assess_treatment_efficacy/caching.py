@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: caching
+    :synopsis: module caching the results of the analyses, keyed by a hash of their inputs, and the imported csv files
+
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+"""
+
+import os
+import glob
+import json
+import pickle
+import hashlib
+import inspect
+import functools
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+from .diagnostics import Diagnostics
+
+
+def _update_hash(hash_object, value):
+    """Adds a value to a hash: dataframes, series and arrays are hashed from their content, other values from their
+    pickled representation."""
+
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        frame = value.to_frame() if isinstance(value, pd.Series) else value
+        hash_object.update(pickle.dumps((type(value).__name__, list(frame.columns), [str(dtype) for dtype in frame.dtypes],
+                                         list(frame.index.names))))
+        # Columns of objects (strings, tuples) are hashed from their text
+        frame = frame.apply(lambda column: column.astype(str) if column.dtype == object else column)
+        hash_object.update(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+    elif isinstance(value, np.ndarray):
+        hash_object.update(pickle.dumps((value.shape, str(value.dtype))))
+        hash_object.update(np.ascontiguousarray(value).tobytes() if value.dtype != object else pickle.dumps(value.tolist()))
+    elif isinstance(value, (list, tuple)):
+        hash_object.update(pickle.dumps((type(value).__name__, len(value))))
+        for item in value:
+            _update_hash(hash_object, item)
+    else:
+        hash_object.update(pickle.dumps(value))
+
+
+def cache_key(function, *args, **kwargs):
+    """Computes the key of a call: a hash of the name of the function and of all its arguments, default values
+    included, so that positional and keyword arguments give the same key. The ``diagnostics`` argument does not change
+    the result and is not part of the key.
+
+    Parameters
+    ----------
+    function: callable
+        Function called.
+
+    *args, **kwargs
+        Arguments of the call.
+
+    Returns
+    -------
+    key: str
+        Hexadecimal SHA-256 hash.
+
+    """
+
+    arguments = inspect.signature(function).bind(*args, **kwargs)
+    arguments.apply_defaults()
+    hash_object = hashlib.sha256(('%s.%s' % (function.__module__, function.__qualname__)).encode())
+    for name, value in arguments.arguments.items():
+        if name == 'diagnostics':
+            continue
+        hash_object.update(name.encode())
+        _update_hash(hash_object, value)
+
+    return hash_object.hexdigest()
+
+
+class ResultCache:
+    """Cache of results with an in-memory tier (least recently used entries are evicted) and an optional on-disk tier
+    limited in size (least recently used files are evicted).
+
+    Results are stored pickled, so that a result returned from the cache can be modified without altering the cache.
+
+    Parameters
+    ----------
+    max_entries: int, default = 128
+        Maximum number of results kept in memory.
+
+    directory: str, optional
+        Directory of the on-disk tier. By default, results are only kept in memory.
+
+    max_disk_size: int, default = 1 GB
+        Maximum size in bytes of the files of the on-disk tier.
+
+    Attributes
+    ----------
+    statistics: dict
+        Number of 'memory_hits', 'disk_hits', 'misses' and 'evictions'.
+
+    Examples
+    --------
+    >>> cache = ResultCache(directory='.cache')
+    >>> df_results_per_study, df_results, effect_size = run_meta_analysis(df_values_parents, cache=cache)
+    >>> cache.statistics
+
+    """
+
+    def __init__(self, max_entries=128, directory=None, max_disk_size=2**30):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.max_disk_size = max_disk_size
+        self._memory = OrderedDict()
+        self.statistics = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'evictions': 0}
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def __len__(self):
+        return len(self._memory)
+
+    def _file(self, key):
+        return os.path.join(self.directory, key + '.pkl')
+
+    def _store_in_memory(self, key, data):
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.statistics['evictions'] += 1
+
+    def _store_on_disk(self, key, data):
+        # Written in a temporary file first, so that a concurrent reader never sees a partial file
+        temporary_file = self._file(key) + '.%d.tmp' % os.getpid()
+        with open(temporary_file, 'wb') as file:
+            file.write(data)
+        os.replace(temporary_file, self._file(key))
+
+        # Least recently used files (access time updated on each hit) are removed above the size limit
+        files = sorted(glob.glob(os.path.join(self.directory, '*.pkl')), key=os.path.getmtime)
+        sizes = [os.path.getsize(file) for file in files]
+        total_size = sum(sizes)
+        for file, size in zip(files, sizes):
+            if total_size <= self.max_disk_size or file == self._file(key):
+                break
+            os.remove(file)
+            total_size -= size
+            self.statistics['evictions'] += 1
+
+    def get(self, key):
+        """Returns the result stored under a key, or raises ``KeyError``."""
+
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.statistics['memory_hits'] += 1
+            return pickle.loads(self._memory[key])
+
+        if self.directory is not None and os.path.exists(self._file(key)):
+            with open(self._file(key), 'rb') as file:
+                data = file.read()
+            os.utime(self._file(key))
+            self._store_in_memory(key, data)
+            self.statistics['disk_hits'] += 1
+            return pickle.loads(data)
+
+        self.statistics['misses'] += 1
+        raise KeyError(key)
+
+    def set(self, key, value):
+        """Stores a result under a key, in memory and on disk."""
+
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._store_in_memory(key, data)
+        if self.directory is not None:
+            self._store_on_disk(key, data)
+
+    def clear(self):
+        """Removes all the results, in memory and on disk, and resets the statistics."""
+
+        self._memory.clear()
+        if self.directory is not None:
+            for file in glob.glob(os.path.join(self.directory, '*.pkl')):
+                os.remove(file)
+        self.statistics = dict.fromkeys(self.statistics, 0)
+
+
+default_cache = ResultCache()
+
+
+def cached(function=None, added_columns=()):
+    """Decorator adding a ``cache`` argument to an analysis: ``cache=True`` uses ``default_cache``, a ``ResultCache``
+    uses this cache, and ``None`` (the default) computes the result as usual.
+
+    The columns that the analysis adds to its first argument (a dataframe) are cached with the result and added again
+    on a hit, so that the dataframe is in the same state with or without the cache. Likewise, the diagnostics recorded
+    by an analysis with a ``diagnostics`` argument are cached and reported again on a hit.
+
+    Parameters
+    ----------
+    function: callable
+        Analysis, when the decorator is used without arguments (``@cached``).
+
+    added_columns: list of str, optional
+        Columns that the analysis writes in its first argument before reading them, e.g.
+        ``@cached(added_columns=['effect_size'])``. They do not change the result and are not part of the key, so that
+        calling the analysis again on the same dataframe, with these columns added by the first call, is a hit.
+    """
+
+    if function is None:
+        return functools.partial(cached, added_columns=added_columns)
+
+    signature = inspect.signature(function)
+
+    @functools.wraps(function)
+    def cached_function(*args, cache=None, **kwargs):
+        if cache is None or cache is False:
+            return function(*args, **kwargs)
+        if cache is True:
+            cache = default_cache
+
+        df = args[0] if args and isinstance(args[0], pd.DataFrame) else None
+        if df is not None:
+            key = cache_key(function, df.drop(columns=[column for column in added_columns if column in df.columns]),
+                            *args[1:], **kwargs)
+        else:
+            key = cache_key(function, *args, **kwargs)
+        arguments = signature.bind(*args, **kwargs)
+        arguments.apply_defaults()
+        diagnostics = arguments.arguments.get('diagnostics')
+        try:
+            result, df_added_columns, recorded = cache.get(key)
+        except KeyError:
+            columns = set(df.columns) if df is not None else set()
+            # The analysis records its diagnostics in a new object, cached with the result
+            recorded = None
+            if 'diagnostics' in arguments.arguments:
+                arguments.arguments['diagnostics'] = recorded = Diagnostics()
+            result = function(*arguments.args, **arguments.kwargs)
+            # The declared columns are kept even if the dataframe already had them before the call
+            df_added_columns = (df[[column for column in df.columns if column not in columns or column in added_columns]]
+                                if df is not None else None)
+            cache.set(key, (result, df_added_columns, recorded))
+        else:
+            if df_added_columns is not None:
+                for column in df_added_columns.columns:
+                    df[column] = df_added_columns[column]
+
+        if recorded is not None:
+            recorded.report(diagnostics)
+
+        return result
+
+    return cached_function
+
+
+def _file_hash(file_name):
+    """Computes the SHA-256 hash of the content of a file, read by blocks."""
+
+    hash_object = hashlib.sha256()
+    with open(file_name, 'rb') as file:
+        for block in iter(lambda: file.read(2**20), b''):
+            hash_object.update(block)
+
+    return hash_object.hexdigest()
+
+
+def cached_import(csv_file, read, cache=True, file_format='feather'):
+    """Returns the dataframe parsed from a csv file by an importer, stored in a binary columnar file (Feather or
+    Parquet) so that the csv file is only parsed again when it changes. It requires ``pyarrow``.
+
+    The binary file is named after the csv file and a hash of its absolute path, so that csv files of the same name
+    in different directories do not share a binary file in the same cache directory. It records the absolute path, the
+    modification time, the size and the SHA-256 hash of the csv file: it is used as long as the path, the modification
+    time and the size are unchanged, or if the content has the same hash (e.g. the csv file has been replaced by a copy).
+    Otherwise, the csv file is parsed again and the binary file replaced.
+
+    Parameters
+    ----------
+    csv_file: str
+        Name or localisation of the csv file.
+
+    read: callable
+        Importer parsing the csv file, ``read(csv_file)`` returns a dataframe.
+
+    cache: bool or str, default = True
+        Directory of the binary file, or True to store it next to the csv file.
+
+    file_format: str, default = 'feather'
+        'feather' (uncompressed, loaded with a memory map) or 'parquet' (compressed, smaller but slower to load).
+
+    Returns
+    -------
+    df: pandas.DataFrame
+        Dataframe returned by ``read``.
+
+    """
+
+    try:
+        import pyarrow as pa
+        import pyarrow.feather as feather
+        import pyarrow.parquet as parquet
+    except ImportError:
+        raise ImportError('pyarrow is required to cache the imported csv files')
+    if file_format not in ['feather', 'parquet']:
+        raise ValueError("file_format is either 'feather' or 'parquet'")
+
+    path = os.path.abspath(csv_file)
+    directory = os.path.dirname(path) if cache is True else cache
+    os.makedirs(directory, exist_ok=True)
+    path_hash = hashlib.sha256(path.encode()).hexdigest()[:16]
+    cache_file = os.path.join(directory, '%s.%s.%s.%s' % (os.path.basename(csv_file), path_hash, read.__name__.strip('_'),
+                                                          file_format))
+    status = os.stat(csv_file)
+
+    def read_table():
+        if file_format == 'feather':
+            return feather.read_table(cache_file, memory_map=True)
+        return parquet.read_table(cache_file, memory_map=True)
+
+    def write_table(table, source):
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), b'source': json.dumps(source).encode()})
+        # Written in a temporary file first, so that a concurrent reader never sees a partial file
+        temporary_file = cache_file + '.%d.tmp' % os.getpid()
+        if file_format == 'feather':
+            feather.write_feather(table, temporary_file, compression='uncompressed')
+        else:
+            parquet.write_table(table, temporary_file)
+        os.replace(temporary_file, cache_file)
+
+    def to_dataframe(table, source):
+        df = table.to_pandas()
+        # Arrow does not keep the index with a single level of the importers
+        if source['single_level_index']:
+            df.index = pd.MultiIndex.from_arrays([df.index])
+        return df
+
+    if os.path.exists(cache_file):
+        try:
+            table = read_table()
+            source = json.loads(table.schema.metadata[b'source'])
+        except (pa.ArrowInvalid, KeyError, ValueError, OSError):
+            source = None
+        if source is not None and source.get('path') == path:
+            if source['mtime'] == status.st_mtime_ns and source['size'] == status.st_size:
+                return to_dataframe(table, source)
+            if source['size'] == status.st_size and source['sha256'] == _file_hash(csv_file):
+                # Same content, only the modification time is updated
+                source['mtime'] = status.st_mtime_ns
+                write_table(table, source)
+                return to_dataframe(table, source)
+
+    df = read(csv_file)
+    source = {'path': path, 'mtime': status.st_mtime_ns, 'size': status.st_size, 'sha256': _file_hash(csv_file),
+              'single_level_index': isinstance(df.index, pd.MultiIndex) and df.index.nlevels == 1}
+    write_table(pa.Table.from_pandas(df), source)
+
+    return df
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: compact
+    :synopsis: module converting the imported dataframes to compact types, to hold many datasets in memory
+
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+"""
+
+import numpy as np
+import pandas as pd
+
+
+# Values of the yes/no factors of the csv files
+YES_NO = {'yes': True, 'no': False}
+
+# Columns of integers, which are floats in the long format and in the chunks of the importers
+INTEGER_COLUMNS = ['year', 'n_treatment', 'n_control', 'number_of_sessions']
+
+
+def _compact_column(values):
+    """Converts a column to its compact type: yes/no strings to nullable booleans, other strings to categories,
+    integers (and the floats of ``INTEGER_COLUMNS`` without missing values) to the smallest integer type. Other floats
+    are kept, so that the analyses give the same results."""
+
+    if values.dtype == object:
+        observed = values.dropna().unique()
+        if len(observed) > 0 and set(observed) <= set(YES_NO):
+            return values.map(YES_NO).astype('boolean')
+        return values.astype('category')
+
+    if pd.api.types.is_float_dtype(values.dtype):
+        array = values.to_numpy()
+        if (values.name not in INTEGER_COLUMNS or len(array) == 0 or not np.all(np.isfinite(array))
+                or not np.all(array == np.round(array))):
+            return values
+        values = values.astype(np.int64)
+
+    if pd.api.types.is_integer_dtype(values.dtype) and not pd.api.types.is_extension_array_dtype(values.dtype):
+        return pd.to_numeric(values, downcast='integer')
+
+    return values
+
+
+def compact_dtypes(df, flat_index=True):
+    """Returns a copy of an imported dataframe with compact types: the strings (name of the studies, clinical scale,
+    raters and categorical factors) become categories, the yes/no factors nullable booleans (missing values are kept)
+    and the integers (year, numbers of patients and sessions) the smallest integer type. Means, standard deviations and
+    other floats are unchanged, so that the analyses give the same results.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Dataframe returned by ``import_csv_for_meta_analysis.import_csv``, ``import_csv_for_factors.import_csv`` or
+        ``bulk_import.import_directory``.
+
+    flat_index: bool, default = True
+        If True, an index with a single level (the name of the studies) becomes a flat categorical index.
+        The levels of an index with several levels are already stored once, with integer codes.
+
+    Returns
+    -------
+    df_compact: pandas.DataFrame
+        Dataframe with the same values, columns and rows.
+
+    Examples
+    --------
+    >>> df_values_parents = compact_dtypes(import_csv('values_total_meta_analysis.csv', 'Parents'))
+    >>> df_values_parents.memory_usage(deep=True).sum()
+
+    """
+
+    df_compact = pd.DataFrame({column: _compact_column(df[column]).array for column in df.columns}, index=df.index)
+    if flat_index and isinstance(df.index, pd.MultiIndex) and df.index.nlevels == 1:
+        df_compact.index = pd.CategoricalIndex(df.index.get_level_values(0), name=df.index.names[0])
+
+    return df_compact
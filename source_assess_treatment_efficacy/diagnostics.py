@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: diagnostics
+    :synopsis: module recording the corrections and numerical issues of the analyses, reported once at the end of a run
+
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+"""
+
+import logging
+import warnings
+import numpy as np
+import pandas as pd
+
+
+logger = logging.getLogger(__name__)
+
+
+class DiagnosticsError(Exception):
+    """Raised by ``Diagnostics.emit(action='raise')`` when at least one issue was recorded."""
+
+
+class Diagnostics:
+    """Corrections and numerical issues recorded during one or several analyses.
+
+    The computations only keep references to the masks of the studies concerned (and to the measured values, e.g. the
+    condition number of a matrix); counts, messages and warnings are only computed when the diagnostics are read or
+    emitted, so that recording costs nothing in the loops of batched analyses.
+
+    Attributes
+    ----------
+    messages: dict
+        Message describing each kind of issue.
+
+    Examples
+    --------
+    >>> diagnostics = Diagnostics()
+    >>> for df in dataframes:
+    ...     run_meta_analysis(df, diagnostics=diagnostics)
+    >>> diagnostics.summary()
+    >>> diagnostics.emit('log')
+
+    """
+
+    ACTIONS = ['warn', 'log', 'raise', 'ignore']
+
+    def __init__(self):
+        self.messages = {}
+        self._masks = {}
+        self._values = {}
+
+    def __repr__(self):
+        return '<Diagnostics: %s>' % ', '.join('%s=%d' % item for item in self.counts.items())
+
+    def flag(self, name, mask, message):
+        """Records the studies (or analyses) concerned by an issue.
+
+        Parameters
+        ----------
+        name: str
+            Kind of issue, e.g. 'small_sample_correction'.
+
+        mask: numpy.ndarray of bool or bool
+            True for each study concerned.
+
+        message: str
+            Description of the issue.
+
+        """
+
+        self.messages.setdefault(name, message)
+        self._masks.setdefault(name, []).append(mask)
+
+    def measure(self, name, value):
+        """Records a measured value, e.g. the condition number of a moment matrix."""
+
+        self._values.setdefault(name, []).append(value)
+
+    def mask(self, name):
+        """Returns the mask of the studies concerned by an issue, concatenated over all the recorded analyses."""
+
+        return np.concatenate([np.atleast_1d(mask) for mask in self._masks.get(name, [])] or [np.zeros(0, dtype=bool)])
+
+    def values(self, name):
+        """Returns the values measured under a name, one per recorded analysis."""
+
+        return np.array(self._values.get(name, []))
+
+    @property
+    def counts(self):
+        """Number of studies concerned by each kind of issue."""
+
+        return {name: int(np.count_nonzero(self.mask(name))) for name in self._masks}
+
+    def summary(self):
+        """Returns a dataframe with, for each kind of issue, the number of studies concerned, the number of studies
+        checked and the message."""
+
+        return pd.DataFrame({'Count': [np.count_nonzero(self.mask(name)) for name in self._masks],
+                             'Total': [self.mask(name).size for name in self._masks],
+                             'Message': [self.messages[name] for name in self._masks]},
+                             index=pd.Index(list(self._masks), name='Diagnostic'))
+
+    def merge(self, other):
+        """Adds the issues and values recorded by another ``Diagnostics``."""
+
+        if other is self:
+            return
+        for name in other._masks:
+            self.messages.setdefault(name, other.messages[name])
+            self._masks.setdefault(name, []).extend(other._masks[name])
+        for name in other._values:
+            self._values.setdefault(name, []).extend(other._values[name])
+
+    def emit(self, action='warn'):
+        """Reports the recorded issues, one message per kind of issue with the number of studies concerned.
+
+        Parameters
+        ----------
+        action: str, default = 'warn'
+            'warn' (``warnings.warn``), 'log' (warning of the logger of this module), 'raise' (``DiagnosticsError``)
+            or 'ignore'.
+
+        """
+
+        if action not in self.ACTIONS:
+            raise ValueError("action is either 'warn', 'log', 'raise' or 'ignore'")
+        if action == 'ignore':
+            return
+
+        messages = ['%s (%d of %d)' % (self.messages[name], count, self.mask(name).size)
+                    for name, count in self.counts.items() if count > 0]
+        if not messages:
+            return
+        if action == 'raise':
+            raise DiagnosticsError('; '.join(messages))
+        for message in messages:
+            if action == 'warn':
+                warnings.warn(message)
+            else:
+                logger.warning(message)
+
+    def report(self, diagnostics):
+        """Hands the recorded issues over to the ``diagnostics`` argument of an analysis: they are added to it if it is a
+        ``Diagnostics``, otherwise it is the action given to ``emit``."""
+
+        if isinstance(diagnostics, Diagnostics):
+            diagnostics.merge(self)
+        else:
+            self.emit(diagnostics)
@@ -0,0 +1,281 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: forest_plot_renderer
+    :synopsis: module rendering forest plots of many studies, without pyplot, to PNG, SVG or PDF files
+
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+"""
+
+import os
+import importlib
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from .meta_analysis_result import MetaAnalysisResult
+
+
+def _import_matplotlib(module='matplotlib.pyplot'):
+    """Imports a module of matplotlib when a plot is drawn: matplotlib is an optional dependency (extra 'plot'), which
+    is not loaded by the computations."""
+
+    try:
+        return importlib.import_module(module)
+    except ImportError:
+        raise ImportError("matplotlib is required to draw the plots, install the extra 'plot' of the package")
+
+
+def _study_names(index):
+    """Names of the studies, the first level of the index of the ratings."""
+
+    if isinstance(index, pd.MultiIndex):
+        return index.get_level_values(0).astype(str).to_numpy()
+    return index.astype(str).to_numpy()
+
+
+def _forest_plot_data(df_results_per_study, df_results=None):
+    """Extracts the arrays needed by a forest plot from the results of a meta-analysis.
+
+    Parameters
+    ----------
+    df_results_per_study: pandas.DataFrame or MetaAnalysisResult
+        Results per study, obtained with ``run_meta_analysis``.
+
+    df_results: pandas.DataFrame, optional
+        Global results, obtained with ``run_meta_analysis``. Not used if ``df_results_per_study`` is a
+        ``MetaAnalysisResult``.
+
+    Returns
+    -------
+    names, effect_size, lower_limit, upper_limit, weight: numpy.ndarray
+        Name, effect size, bounds of the 95% confidence interval and weight (in percentage) of each study, sorted by
+        increasing effect size.
+
+    summary: numpy.ndarray
+        Summary effect and bounds of its 95% confidence interval.
+
+    """
+
+    if isinstance(df_results_per_study, MetaAnalysisResult):
+        if len(df_results_per_study.results_index) != 1:
+            raise ValueError('A forest plot represents one meta-analysis, the results contain %d meta-analyses'
+                             % len(df_results_per_study.results_index))
+        result = df_results_per_study
+        names = _study_names(result.index)
+        effect_size, lower_limit, upper_limit, weight = (result.effect_size, result.lower_limit, result.upper_limit,
+                                                         result.weight)
+        summary = np.array([result.summary_effect[0], result.lower_limit_summary_effect[0],
+                            result.upper_limit_summary_effect[0]])
+    else:
+        names = _study_names(df_results_per_study.index)
+        effect_size = df_results_per_study['Effect size'].to_numpy(dtype=float)
+        weight = df_results_per_study['Weight'].to_numpy(dtype=float)
+        if 'Lower limit of the ES' in df_results_per_study.columns:
+            lower_limit = df_results_per_study['Lower limit of the ES'].to_numpy(dtype=float)
+            upper_limit = df_results_per_study['Upper limit of the ES'].to_numpy(dtype=float)
+            summary = df_results[['Summary Effect', 'Lower limit of the Summary Effect',
+                                  'Upper limit of the Summary Effect']].to_numpy(dtype=float)[0]
+        else:
+            lower_limit, upper_limit = np.array(df_results_per_study['95% Confidence interval of the ES'].tolist(),
+                                                dtype=float).reshape(-1, 2).T
+            summary = np.r_[df_results['Summary Effect'].iloc[0],
+                            df_results['95% Confidence Interval of the Summary Effect'].iloc[0]].astype(float)
+
+    order = np.argsort(effect_size, kind='stable')
+
+    return names[order], effect_size[order], lower_limit[order], upper_limit[order], weight[order], summary
+
+
+def _draw_forest_plot(figure, names, effect_size, lower_limit, upper_limit, weight, summary,
+                      title='Standard Mean Difference, 95% Confidence Interval'):
+    """Draws a forest plot in a figure: the confidence intervals of all the studies are one collection of lines, their
+    effect sizes one collection of squares, and the summary effect a diamond at the bottom.
+
+    Parameters
+    ----------
+    figure: matplotlib.figure.Figure
+        Figure in which the forest plot is drawn.
+
+    names, effect_size, lower_limit, upper_limit, weight: numpy.ndarray
+        Name, effect size, bounds of the 95% confidence interval and weight (in percentage) of each study, the first
+        study is drawn at the top.
+
+    summary: numpy.ndarray
+        Summary effect and bounds of its 95% confidence interval.
+
+    title: str
+        Title of the forest plot.
+
+    Returns
+    -------
+    ax: matplotlib.axes.Axes
+        Axes of the forest plot.
+
+    """
+
+    from matplotlib.collections import LineCollection
+    from matplotlib.patches import Polygon
+
+    n_studies = len(effect_size)
+    y = np.arange(n_studies + 1, 1, -1)
+
+    ax = figure.add_subplot(1, 1, 1)
+    # Vertical line in zero
+    ax.axvline(0, color='k')
+    # Confidence intervals
+    segments = np.empty((n_studies, 2, 2))
+    segments[:, 0, 0] = lower_limit
+    segments[:, 1, 0] = upper_limit
+    segments[:, :, 1] = y[:, np.newaxis]
+    ax.add_collection(LineCollection(segments, colors='g'))
+    # Effect sizes, the area of the squares is proportional to the weight of the studies
+    ax.scatter(effect_size, y, s=5*np.asarray(weight), marker='s', color='b')
+    # Summary effect
+    ax.add_patch(Polygon([[summary[1], 1], [summary[0], 1.3], [summary[2], 1], [summary[0], 0.7]], closed=True,
+                         color='b'))
+
+    ax.set_yticks(np.r_[1, y])
+    ax.set_yticklabels(np.r_[['Summary Effect'], names])
+    ax.set_ylim(0.4, n_studies + 1.6)
+    ax.autoscale_view(scaley=False)
+    ax.set_xlabel('Effect size')
+    ax.set_title(title, fontweight='bold')
+
+    return ax
+
+
+def render_forest_plot(df_results_per_study, df_results=None, studies_per_page=40, file=None, format=None,
+                       title='Standard Mean Difference, 95% Confidence Interval', dpi=100):
+    """Renders the forest plot of a meta-analysis without pyplot, on several pages when there are many studies.
+
+    Studies are sorted by increasing effect size from the top of the first page to the bottom of the last page, the
+    summary effect is represented at the bottom of each page.
+
+    Parameters
+    ----------
+    df_results_per_study: pandas.DataFrame or MetaAnalysisResult
+        Results per study, obtained with ``run_meta_analysis``.
+
+    df_results: pandas.DataFrame, optional
+        Global results, obtained with ``run_meta_analysis``. Not used if ``df_results_per_study`` is a
+        ``MetaAnalysisResult``.
+
+    studies_per_page: int, default = 40
+        Largest number of studies represented on a page.
+
+    file: str, optional
+        Name or localisation of the file where the forest plot is saved.
+        A PDF file contains all the pages, for other formats each page after the first one is saved in its own file,
+        whose name ends with ``_page<number>``.
+
+    format: str, optional
+        'png', 'svg' or 'pdf'. By default, it is deduced from the extension of ``file``.
+
+    title: str, default = 'Standard Mean Difference, 95% Confidence Interval'
+        Title of the forest plot.
+
+    dpi: int, default = 100
+        Resolution of the PNG files.
+
+    Returns
+    -------
+    forest_plots: list of matplotlib.figure.Figure or list of str
+        Figures of the pages, or the files written if ``file`` is given.
+
+    """
+
+    Figure = _import_matplotlib('matplotlib.figure').Figure
+    names, effect_size, lower_limit, upper_limit, weight, summary = _forest_plot_data(df_results_per_study, df_results)
+    pages = range(0, max(len(effect_size), 1), studies_per_page)
+
+    figures = []
+    for number, start in enumerate(pages, 1):
+        page = slice(start, start + studies_per_page)
+        n_studies = len(effect_size[page])
+        figure = Figure(figsize=(8, max(3, 1.5 + 0.25*(n_studies + 1))))
+        page_title = title if len(pages) == 1 else '%s (%d/%d)' % (title, number, len(pages))
+        _draw_forest_plot(figure, names[page], effect_size[page], lower_limit[page], upper_limit[page], weight[page],
+                          summary, page_title)
+        figure.tight_layout()
+        figures.append(figure)
+
+    if file is None:
+        return figures
+
+    if format is None:
+        format = os.path.splitext(file)[1][1:].lower()
+    if format not in ['png', 'svg', 'pdf']:
+        raise ValueError("format must be 'png', 'svg' or 'pdf', got %r" % format)
+
+    if format == 'pdf':
+        from matplotlib.backends.backend_pdf import PdfPages
+        with PdfPages(file) as pdf:
+            for figure in figures:
+                pdf.savefig(figure)
+        return [file]
+
+    root, extension = os.path.splitext(file)
+    files = [file] + ['%s_page%d%s' % (root, number, extension) for number in range(2, len(figures) + 1)]
+    for figure, page_file in zip(figures, files):
+        figure.savefig(page_file, format=format, dpi=dpi)
+
+    return files
+
+
+def _split_result(result):
+    """Splits the results of several meta-analyses, obtained with ``run_batched_meta_analysis``, in one
+    ``MetaAnalysisResult`` per meta-analysis."""
+
+    order = np.argsort(result.groups, kind='stable')
+    bounds = np.r_[0, np.cumsum(np.bincount(result.groups, minlength=len(result.results_index)))]
+
+    return [MetaAnalysisResult(result.index[order[start:stop]], np.asfortranarray(result.per_study[order[start:stop]]),
+                               result.results_index[group:group + 1], np.asfortranarray(result.results[group:group + 1]),
+                               np.zeros(stop - start, dtype=int), year_dtype=result.year_dtype)
+            for group, (start, stop) in enumerate(zip(bounds[:-1], bounds[1:]))]
+
+
+def _render_forest_plot_to_file(results, file, kwargs):
+    """Renders one forest plot to a file, in a worker process."""
+
+    if isinstance(results, MetaAnalysisResult):
+        return render_forest_plot(results, file=file, **kwargs)
+    return render_forest_plot(*results, file=file, **kwargs)
+
+
+def render_forest_plots(results, files, n_jobs=1, **kwargs):
+    """Renders the forest plots of several meta-analyses to files, serially or in a pool of processes.
+
+    Parameters
+    ----------
+    results: list or MetaAnalysisResult
+        Results of each meta-analysis: ``MetaAnalysisResult`` or tuples ``(df_results_per_study, df_results)``.
+        A ``MetaAnalysisResult`` obtained with ``run_batched_meta_analysis`` gives one forest plot per meta-analysis.
+
+    files: list of str
+        Name or localisation of the file of each forest plot.
+
+    n_jobs: int, default = 1
+        Number of processes, 1 to render the forest plots in the current process.
+
+    **kwargs
+        Arguments of ``render_forest_plot``: ``studies_per_page``, ``format``, ``title`` and ``dpi``.
+
+    Returns
+    -------
+    files: list of list of str
+        Files written for each forest plot.
+
+    """
+
+    if isinstance(results, MetaAnalysisResult):
+        results = _split_result(results)
+    if len(results) != len(files):
+        raise ValueError('%d meta-analyses but %d files' % (len(results), len(files)))
+
+    if n_jobs == 1:
+        return [_render_forest_plot_to_file(result, file, kwargs) for result, file in zip(results, files)]
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(_render_forest_plot_to_file, results, files, [kwargs]*len(files)))
@@ -8,117 +8,186 @@
 """
 
 import warnings
+import numpy as np
 import pandas as pd
 
+from ..caching import cached_import
+from ..compact import compact_dtypes
+from ..pairing import _study_lines, _pairing_report, _warn_pairing_issues
+
+
+# Columns of the csv file used by the meta-analysis, and types of the columns identifying the rows of a study
+COLUMNS = ['Author', 'Year', 'Group', 'Score Name', 'Number of patients', 'Raters', 'Time', 'Mean', 'Std']
+
+RATERS = ['Parents', 'Teachers', 'Clinicians']
+
+DTYPES = {'Group': pd.CategoricalDtype(['Treatment', 'Control']),
+          'Time': pd.CategoricalDtype(['pre', 'post']),
+          'Raters': pd.CategoricalDtype(RATERS),
+          'Mean': float,
+          'Std': float}
+
+
+def _read_ratings(csv_file):
+    """Reads, in one pass, the columns of a csv file required to perform a meta-analysis: Group, Time and Raters are
+    parsed as categories, Mean and Std as floats, and the other columns of the file are not parsed.
 
-def _common_read(csv_file, raters):
-    """Reads data from a csv file containing parents and sometimes teachers and clinicians severity assessments of a disease. This csv file 
-    contains all the data required to perform a meta-analysis.
-   
     Parameters
     ----------
     csv_file: str
-        Name or localisation of the csv file that contains all the values of clinical trials required to perform the SAOB.
-        The csv file must have a specific form: 
-        - eight first columns: Author, Year, Score Name, Number of patients, Raters (Parents, Teachers, or Clinicians), Time (pre and post), Mean, Std;
-        - other columns correspond to factors to analyze;
-        - each study has at least 2 lines: Author name, Year, Score Name, Number of patients, Raters (Parents, Teachers, or Clinicians) repeated twice, 
-          Time (pre and post), Mean (at pre-test and post-test), Std (at pre-test and post-test). If Teachers assessments are available, 
-          two lines must be added (same in the case of clinicians);
-        - sometimes, for a study, several clinical scales are available, they are all entered in the csv file;
-        - for each author, the 2 lines of the Raters column have to be filled as follows: Parents, Parents, if teachers' assessment is available
-          2 more lines are added (Teachers, Teachers), same in the case of clinicians (Clinicians, Clinicians);
-        - for each author, the 2 lines of the Time column have to be filled as follows: pre, post (pattern repeated one more time if teachers or
-          clinicians assessment is available);
-        - Mean and Std correspond to the clinical score extracted from studies at pre-test and post-test.
-               
+        Name or localisation of the csv file, see ``import_csv``.
+
+    Returns
+    -------
+    df: pandas.DataFrame
+        One row per line of the csv file.
+
+    """
+
+    return pd.read_csv(csv_file, usecols=COLUMNS, dtype=DTYPES)
+
+
+def _wide_ratings(df):
+    """Puts the four lines of each study (Treatment and Control groups, at pre-test and post-test) in one row, for all
+    the raters in one reshape.
+
+    The lines are paired by their key (Author, Year, Score Name and Raters), whatever their order in the csv file: the
+    studies are identified with a hash table, and the k-th line of a study, group and time is paired with the k-th
+    line of the same study of the three other groups and times. A warning is raised for the studies with missing or
+    duplicate lines and the lines with an unknown rater, group or time, listed by ``validate_csv``.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Lines of the csv file, obtained with ``_read_ratings``.
+
+    Returns
+    -------
+    df_wide: pandas.DataFrame
+        One row per rater and study (indexed by the rater, the study in the order of the csv file and the occurrence of
+        its key), the columns are indexed by the column of the csv file, the group and the time.
+
+    """
+
+    study, cell, occurrence, counts = _study_lines(df, ['Group', 'Time'])
+    _warn_pairing_issues(df, cell, counts)
+
+    # Row of each line: its study and occurrence, numbered in the order of the csv file; empty lines (without group,
+    # time or rater) separate the studies in some files
+    lines = np.flatnonzero(cell >= 0)
+    rows, keys = pd.factorize(study[lines]*(occurrence.max(initial=0) + 1) + occurrence[lines])
+    first_lines = np.empty(len(keys), dtype=np.int64)
+    first_lines[rows[::-1]] = lines[::-1]
+
+    # Each column is scattered in one assignment to the row and the group and time of its lines, the missing lines
+    # are left empty
+    columns = ['Author', 'Year', 'Score Name', 'Number of patients', 'Mean', 'Std']
+    data = {}
+    for column in columns:
+        values = df[column].to_numpy()
+        wide_values = np.full((len(keys), 4), np.nan, dtype=object if values.dtype == object else float)
+        wide_values[rows, cell[lines]] = values[lines]
+        for i, (group, time) in enumerate([('Treatment', 'pre'), ('Treatment', 'post'), ('Control', 'pre'), ('Control', 'post')]):
+            data[(column, group, time)] = wide_values[:, i]
+
+    index = pd.MultiIndex.from_arrays([df['Raters'].to_numpy()[first_lines], study[first_lines], occurrence[first_lines]],
+                                      names=['Raters', 'Study', 'Occurrence'])
+
+    return pd.DataFrame(data, index=index)
+
+
+def _common_read(df_wide, raters, dtypes):
+    """Extracts the ratings of a rater from the rows of all the studies.
+
+    Parameters
+    ----------
+    df_wide: pandas.DataFrame
+        One row per rater and study, obtained with ``_wide_ratings``.
+
     raters: str, 'Teachers', 'Parents' or 'Clinicians'
         Person assessing the disease symptoms.
+
+    dtypes: pandas.Series
+        Types of the columns of the csv file, the columns of numbers keep their type (e.g. integers).
                            
     Returns
     -------
     df_values: pandas.DataFrame
-        Dataframe used to perform the SAOB.
-        Each row corresponds to a study rated by a specific rater on a specific scale.
+        Dataframe used to perform the meta-analysis.
+        Each row corresponds to a study rated by a specific rater on a specific scale, only the studies without missing
+        values are kept.
         Columns are: mean_post_test_treatment, mean_post_test_control, mean_pre_test_treatment, mean_pre_test_control, n_treatment.
         n_control, std_post_test_treatment, std_post_test_control, std_pre_test_treatment, std_pre_test_control, raters for each study.    
 
     """
-    
-    # Import a csv file as a dataframe   
-    df = pd.read_csv(csv_file)
-
-    # Name of studies with an evaluation and its associated score
-    indices_name_studies = df.loc[ (df['Group'] == "Treatment")
-                & (df['Time'] == "pre")
-                & (df['Raters'] == raters),
-                ['Mean', 'Std']
-                ].isnull().sum(axis=1).index
-    name_studies = df.loc[indices_name_studies, 'Author']
-    score_name = df.loc[indices_name_studies, 'Score Name']
-    
 
-    # Extract treatment values
-    treatment_indices_pre = df[
-                    (df['Group'] == "Treatment") 
-                  & (df['Time'] == "pre") 
-                  & (df['Raters'] == raters)
-                  ].index
-    n_treatment = df.loc[treatment_indices_pre, 'Number of patients']
-    year = df.loc[treatment_indices_pre, 'Year']
-    mean_pre_test_treatment = df.loc[treatment_indices_pre, 'Mean']
-    std_pre_test_treatment = df.loc[treatment_indices_pre, 'Std']
-    
-    treatment_indices_post = df[
-                    (df['Group'] == "Treatment") 
-                  & (df['Time'] == "post") 
-                  & (df['Raters'] == raters)
-                  ].index
-    mean_post_test_treatment = df.loc[treatment_indices_post, 'Mean']
-    std_post_test_treatment = df.loc[treatment_indices_post, 'Std']
-    
-    
-    # Extract Control values
-    control_indices_pre = df[
-                    (df['Group'] == "Control") 
-                  & (df['Time'] == "pre") 
-                  & (df['Raters'] == raters)
-                  ].index
-    n_control = df.loc[control_indices_pre, 'Number of patients']
-    year_control = df.loc[control_indices_pre, 'Year']
-    mean_pre_test_control = df.loc[control_indices_pre, 'Mean']
-    std_pre_test_control = df.loc[control_indices_pre, 'Std']
-    
-    control_indices_post = df[
-                    (df['Group'] == "Control") 
-                  & (df['Time'] == "post") 
-                  & (df['Raters'] == raters)
-                  ].index
-    mean_post_test_control = df.loc[control_indices_post, 'Mean']
-    std_post_test_control = df.loc[control_indices_post, 'Std']
-
-   
+    if raters in df_wide.index.get_level_values('Raters'):
+        df_rater = df_wide.xs(raters, level='Raters')
+    else:
+        df_rater = df_wide.iloc[:0]
+
+    def column(name, group, time):
+        return df_rater[(name, group, time)].to_numpy()
+
     # Creation of the data frame containing the results
-    df_values = pd.DataFrame({'year': year.tolist(),
-                            'n_control': n_control.tolist(),
-                            'mean_pre_test_control': mean_pre_test_control.tolist(),
-                            'mean_post_test_control': mean_post_test_control.tolist(),
-                            'std_pre_test_control': std_pre_test_control.tolist(),
-                            'std_post_test_control': std_post_test_control.tolist(),
-                            'n_treatment': n_treatment.tolist(),
-                            'score_name': score_name.tolist(),
-                            'mean_pre_test_treatment': mean_pre_test_treatment.tolist(),
-                            'mean_post_test_treatment': mean_post_test_treatment.tolist(),
-                            'std_pre_test_treatment': std_pre_test_treatment.tolist(),
-                            'std_post_test_treatment': std_post_test_treatment.tolist()},
-                            index=[name_studies])
-
-    df_values = df_values[ df_values.isna().sum(axis=1)==0 ]
-    
+    df_values = pd.DataFrame({'year': column('Year', 'Treatment', 'pre'),
+                              'n_control': column('Number of patients', 'Control', 'pre'),
+                              'mean_pre_test_control': column('Mean', 'Control', 'pre'),
+                              'mean_post_test_control': column('Mean', 'Control', 'post'),
+                              'std_pre_test_control': column('Std', 'Control', 'pre'),
+                              'std_post_test_control': column('Std', 'Control', 'post'),
+                              'n_treatment': column('Number of patients', 'Treatment', 'pre'),
+                              'score_name': column('Score Name', 'Treatment', 'pre'),
+                              'mean_pre_test_treatment': column('Mean', 'Treatment', 'pre'),
+                              'mean_post_test_treatment': column('Mean', 'Treatment', 'post'),
+                              'std_pre_test_treatment': column('Std', 'Treatment', 'pre'),
+                              'std_post_test_treatment': column('Std', 'Treatment', 'post')},
+                              index=pd.MultiIndex.from_arrays([column('Author', 'Treatment', 'pre')], names=['Author']))
+
+    df_values = df_values[ df_values.notna().all(axis=1) ]
+
+    # The reshape introduces missing values, and thus floats, for the studies with missing lines
+    return df_values.astype({'year': dtypes['Year'], 'n_control': dtypes['Number of patients'],
+                             'n_treatment': dtypes['Number of patients']})
+
+
+def _long_ratings(df):
+    """Puts the ratings of the three raters of the lines of a csv file in a single dataframe, whose index has a first
+    level 'raters'."""
+
+    df_wide = _wide_ratings(df)
+
+    return pd.concat([_common_read(df_wide, rater, df.dtypes) for rater in RATERS], keys=RATERS, names=['raters'])
+
+
+def _import_ratings(csv_file):
+    """Imports the ratings of the three raters of a csv file in a single dataframe, whose index has a first level
+    'raters'."""
+
+    return _long_ratings(_read_ratings(csv_file))
+
+
+def _ratings_of_rater(df_ratings, raters, flat_index=False):
+    """Extracts the ratings of a rater from the dataframe of the three raters, indexed by the name of the studies (with
+    a flat categorical index if ``flat_index=True``)."""
+
+    # Rows and names of the studies selected from the codes of the index, without comparing strings
+    index = df_ratings.index
+    if raters in index.levels[0]:
+        rows = index.codes[0] == index.levels[0].get_loc(raters)
+    else:
+        rows = np.zeros(len(index), dtype=bool)
+    df_values = df_ratings[rows]
+    if flat_index:
+        df_values.index = pd.CategoricalIndex(pd.Categorical.from_codes(index.codes[1][rows], index.levels[1]),
+                                              name=index.names[1])
+    else:
+        df_values.index = pd.MultiIndex(levels=[index.levels[1]], codes=[index.codes[1][rows]], names=[index.names[1]])
+
     return df_values
 
 
-def import_csv(csv_file, raters=''): 
+def import_csv(csv_file, raters='', long_format=False, cache=False, cache_format='feather', compact=False):
     """Imports data from a csv file containing parents and sometimes teachers and clinicians severity assessments of a disease. This csv file 
     contains all the data required to perform a meta-analysis. It is possible to import parents' ratings, teachers' or clinicians' only but also the three
     of them.
@@ -143,6 +212,22 @@ def import_csv(csv_file, raters=''):
            
     raters: str, optional 'Teachers', 'Parents' or 'Clinicians'
         Person assessing a disease symptoms, if no raters are precised then all values will be returned. 
+
+    long_format: bool, default = False
+        If True and no rater is precised, the ratings of the three raters are returned in a single dataframe, whose
+        index has a first level 'raters' (the meta-analyses of all the raters can then be performed with
+        ``run_batched_meta_analysis(df, group_by='raters')``).
+
+    cache: bool or str, default = False
+        If True, the parsed ratings are stored in a binary file next to the csv file (or in the directory given), and
+        loaded from it as long as the csv file is unchanged (see ``caching.cached_import``). It requires ``pyarrow``.
+
+    cache_format: str, default = 'feather'
+        Format of the binary file, 'feather' or 'parquet'.
+
+    compact: bool, default = False
+        If True, the dataframes have compact types (categories, small integers and a flat index of the names of the
+        studies), see ``compact.compact_dtypes``.
                            
     Returns
     -------
@@ -167,39 +252,145 @@ def import_csv(csv_file, raters=''):
         Columns are: mean_post_test_treatment, mean_post_test_control, mean_pre_test_treatment, mean_pre_test_control, n_treatment. 
         n_control, std_post_test_treatment, std_post_test_control, std_pre_test_treatment, std_pre_test_control for each study. 
 
+    df_values: pandas.DataFrame
+        Ratings of the three raters, returned instead of the three previous dataframes if ``long_format=True``.
+
     Notes
     -----   
         The three dataframes will be returned if no rater is precised.
+
+        The csv file is read once, and the lines of all the studies and raters are paired in one reshape, by their
+        Author, Year, Score Name and Raters rather than by their position: the lines of a study do not have to follow
+        each other. The studies whose lines cannot be paired are listed by ``validate_csv``.
         
     """
+
+    if raters not in RATERS + ['']:
+        warnings.warn('Raters are either teachers, parents, or clinicians')
+        return
+
+    # Import the csv file, or its binary copy, with the four lines of each study in one row
+    if cache:
+        df_ratings = cached_import(csv_file, _import_ratings, cache, cache_format)
+    else:
+        df_ratings = _import_ratings(csv_file)
     
-    # Parents
-    if raters == 'Parents':
-        df_values_parents = _common_read(csv_file, raters='Parents')
-        return df_values_parents
-        
-    # Teachers
-    elif raters == 'Teachers':
-        df_values_teachers = _common_read(csv_file, raters='Teachers')
-        return df_values_teachers 
-
-    # Clinicians
-    elif raters == 'Clinicians':
-        df_values_clinicians = _common_read(csv_file, raters='Clinicians')
-        return df_values_clinicians 
+    if compact:
+        df_ratings = compact_dtypes(df_ratings)
+
+    # Parents, teachers or clinicians
+    if raters != '':
+        return _ratings_of_rater(df_ratings, raters, flat_index=compact)
         
     # All
-    elif raters == '':
-        df_values_parents = _common_read(csv_file, raters='Parents')
-        df_values_teachers = _common_read(csv_file, raters='Teachers')
-        df_values_clinicians = _common_read(csv_file, raters='Clinicians')
+    if long_format:
+        return df_ratings
         
-        return df_values_parents, df_values_teachers, df_values_clinicians 
-    
-    # Error
-    else:
-        warnings.warn('Raters are either teachers, parents, or clinicians')
+    df_values_parents, df_values_teachers, df_values_clinicians = [_ratings_of_rater(df_ratings, rater, flat_index=compact)
+                                                                   for rater in RATERS]
+
+    return df_values_parents, df_values_teachers, df_values_clinicians
               
+def import_csv_in_chunks(csv_file, raters='', chunksize=100000):
+    """Imports the ratings of a csv file by chunks of lines, for files too large to be loaded at once. The studies are
+    returned as soon as their four lines have been read, so that they can be added to a meta-analysis chunk by chunk
+    (e.g. with ``MetaAnalysisAccumulator.add_studies``).
+
+    Parameters
+    ----------
+    csv_file: str
+        Name or localisation of the csv file, with the form described in ``import_csv``.
+
+    raters: str, optional 'Teachers', 'Parents' or 'Clinicians'
+        Person assessing a disease symptoms, if no raters are precised then the ratings of the three raters are returned.
+
+    chunksize: int, default = 100000
+        Number of lines of the csv file read at once.
+
+    Yields
+    ------
+    df_values: pandas.DataFrame
+        Ratings of the studies completed by a chunk of lines, with the columns of ``import_csv``, indexed by the name of
+        the studies. If no rater is precised, the index has a second level 'raters' (the levels of
+        ``import_csv(csv_file, long_format=True)`` in the reverse order), so that the studies are still named after the
+        first level of the index.
+        The studies are in the same order as with ``import_csv``. The year and the numbers of patients are floats, so
+        that all the chunks have the same types.
+
+    Examples
+    --------
+    >>> accumulator = MetaAnalysisAccumulator()
+    >>> for df_values_parents in import_csv_in_chunks('values_total_meta_analysis.csv', 'Parents'):
+    ...     accumulator.add_studies(df_values_parents)
+    >>> df_results = accumulator.results()
+
+    A meta-analysis per rater, with all the raters read at once:
+
+    >>> accumulators = {rater: MetaAnalysisAccumulator() for rater in ['Parents', 'Teachers', 'Clinicians']}
+    >>> for df_values in import_csv_in_chunks('values_total_meta_analysis.csv'):
+    ...     for rater, df_values_rater in df_values.groupby(level='raters'):
+    ...         accumulators[rater].add_studies(df_values_rater)
+
+    """
+
+    if raters not in RATERS + ['']:
+        warnings.warn('Raters are either teachers, parents, or clinicians')
+        return
+
+    def ratings(df):
+        df_ratings = _long_ratings(df)
+        return df_ratings.swaplevel('raters', 'Author') if raters == '' else _ratings_of_rater(df_ratings, raters)
+
+    # The lines of a study can be split between two chunks: the lines that are not yet paired with the three other
+    # lines of their study are carried over to the next chunk
+    dtypes = {**DTYPES, 'Year': float, 'Number of patients': float}
+    df_carried = None
+    with pd.read_csv(csv_file, usecols=COLUMNS, dtype=dtypes, chunksize=chunksize) as reader:
+        for chunk in reader:
+            df = chunk if df_carried is None else pd.concat([df_carried, chunk])
+
+            # The k-th lines of a study are complete if each of its four groups and times has at least k lines; the
+            # lines with an unknown rater, group or time are passed on, to be reported, and never carried over
+            study, cell, occurrence, counts = _study_lines(df, ['Group', 'Time'])
+            complete = (cell >= 0) & (occurrence < counts.min(axis=1)[study])
+            unmatched = (cell < 0) & df['Author'].notna().to_numpy()
+
+            if np.any(complete | unmatched):
+                df_values = ratings(df[complete | unmatched])
+                if len(df_values) > 0:
+                    yield df_values
+            df_carried = df[(cell >= 0) & ~complete]
+
+    # The remaining lines belong to incomplete studies, which are not kept but reported, as in import_csv
+    if df_carried is not None and len(df_carried) > 0:
+        df_values = ratings(df_carried)
+        if len(df_values) > 0:
+            yield df_values
+
+
+def validate_csv(csv_file):
+    """Checks that the lines of each study of a csv file can be paired: each study (Author, Year, Score Name and
+    Raters) must have one line per group and time.
+
+    Parameters
+    ----------
+    csv_file: str
+        Name or localisation of the csv file, with the form described in ``import_csv``.
+
+    Returns
+    -------
+    df_report: pandas.DataFrame
+        One row per study with an issue, indexed by Author, Year, Score Name and Raters. Columns are the number of lines
+        of each group and time ('Treatment pre', 'Treatment post', 'Control pre', 'Control post'), the number of lines
+        with an unknown rater, group or time ('Unmatched lines'), and whether lines are missing ('Incomplete', the
+        study is not imported) or duplicated ('Duplicate', the lines are paired in their order).
+        The dataframe is empty if all the studies can be paired.
+
+    """
+
+    return _pairing_report(_read_ratings(csv_file), ['Group', 'Time'])
+
+
 if __name__ == '__main__':
     import_csv_for_meta_analysis('values_inattention_meta_analysis.csv')   
 
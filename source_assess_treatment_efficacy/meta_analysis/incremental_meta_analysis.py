@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: incremental_meta_analysis
+    :synopsis: module updating a meta-analysis study by study, for living systematic reviews
+
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+"""
+
+import numpy as np
+
+from .perform_meta_analysis import (_effect_sizes_from_dataframe, _standard_error_effect_size, _results_dataframe)
+
+
+class MetaAnalysisAccumulator:
+    """Meta-analysis under a random effects model that is updated each time a study is added or removed, without
+    computing again the contributions of the other studies.
+
+    The fixed effect model and Tau² (DerSimonian and Laird) only depend on sums over the studies: the number of studies,
+    the sums of the weights, of the weighted effect sizes, of the weighted squared effect sizes and of the squared weights.
+    The weights of the random effects model 1/(variance_ES + Tau²) depend on Tau², they are expanded as a power series
+    around a reference value of Tau² so that their sums also are sums over the studies. When Tau² moves too far from the
+    reference, the series are computed again around the new value.
+
+    Parameters
+    ----------
+    n_terms: int, default = 40
+        Number of terms of the power series.
+
+    max_ratio: float, default = 0.3
+        Largest ratio between the change of Tau² and the smallest total variance for which the series are used.
+
+    Attributes
+    ----------
+    studies: dict
+        Effect size and variance of the effect size of each study, by name of study.
+
+    Examples
+    --------
+    >>> accumulator = MetaAnalysisAccumulator()
+    >>> accumulator.add_studies(df_values_parents)
+    >>> accumulator.remove_study('Bink')
+    >>> df_results = accumulator.results()
+    >>> accumulator.save('living_review.npz')
+    >>> accumulator = MetaAnalysisAccumulator.load('living_review.npz')
+
+    """
+
+    def __init__(self, n_terms=40, max_ratio=0.3):
+        self.n_terms = n_terms
+        self.max_ratio = max_ratio
+        self.studies = {}
+
+        # Sums of the fixed effect model: weights, weighted ES, weighted squared ES and squared weights
+        self._sums_fixed_model = np.zeros(4)
+
+        # Sums of the powers of the normalized random effects weights, and of the weighted effect sizes
+        self._reference_Tau2 = 0.
+        self._scale = np.nan
+        self._smallest_total_variance = np.inf
+        self._moments_weights = np.zeros(n_terms)
+        self._moments_weighted_ES = np.zeros(n_terms)
+        self._up_to_date = False
+
+    def _update(self, effect_size, variance_ES, sign):
+        """Adds (sign = 1) or removes (sign = -1) the contribution of a study to all the sums."""
+
+        weight_fixed_model = 1/variance_ES
+        self._sums_fixed_model += sign*np.array([weight_fixed_model, weight_fixed_model*effect_size,
+                                                 weight_fixed_model*effect_size**2, weight_fixed_model**2])
+
+        total_variance = variance_ES + self._reference_Tau2
+        if sign > 0:
+            self._smallest_total_variance = min(self._smallest_total_variance, total_variance)
+        # A study more precise than the scale would make the powers overflow: the series are computed again when needed
+        if self._up_to_date and total_variance >= self._scale:
+            powers = np.cumprod(np.full(self.n_terms, self._scale/total_variance))
+            self._moments_weights += sign*powers
+            self._moments_weighted_ES += sign*powers*effect_size
+        else:
+            self._up_to_date = False
+
+    def _expand(self, Tau2):
+        """Computes the power series of the random effects weights around Tau2 from all the studies."""
+
+        effect_size, variance_ES = np.array(list(self.studies.values())).reshape(-1, 2).T
+        total_variance = variance_ES + Tau2
+        self._reference_Tau2 = Tau2
+        self._smallest_total_variance = total_variance.min()
+        self._scale = self._smallest_total_variance
+        powers = np.cumprod(np.repeat((self._scale/total_variance)[:, np.newaxis], self.n_terms, axis=1), axis=1)
+        self._moments_weights = powers.sum(axis=0)
+        self._moments_weighted_ES = effect_size.dot(powers)
+        self._up_to_date = True
+
+    def _check_new_names(self, names):
+        """Checks that the names of the studies to add are strings, are not repeated and are not in the meta-analysis
+        yet, before any study is added."""
+
+        new_names = set()
+        for name in names:
+            if not isinstance(name, str):
+                raise ValueError('The name of a study must be a string, %r is not' % (name,))
+            if name in self.studies:
+                raise ValueError('The study %s is already in the meta-analysis' % name)
+            if name in new_names:
+                raise ValueError('The study %s is added several times' % name)
+            new_names.add(name)
+
+    def add_study(self, name, effect_size, standard_error_ES):
+        """Adds a study to the meta-analysis.
+
+        Parameters
+        ----------
+        name: str
+            Name of the study, it must be unique.
+
+        effect_size: float
+            Effect size of the study.
+
+        standard_error_ES: float
+            Standard error of the effect size.
+
+        """
+
+        self._check_new_names([name])
+        self._add(name, float(effect_size), float(standard_error_ES)**2)
+
+    def _add(self, name, effect_size, variance_ES):
+        """Adds a study whose name has been checked."""
+
+        self.studies[name] = (effect_size, variance_ES)
+        self._update(effect_size, variance_ES, 1)
+
+    def add_studies(self, df, scale_to_reverse=[], pre_post_correlation=0.5):
+        """Adds the studies of a dataframe to the meta-analysis, their effect sizes are computed as in ``run_meta_analysis``.
+
+        Parameters
+        ----------
+        df: pandas.DataFrame
+            Parents, teachers or clinicians ratings, obtained with the ``import_csv_for_meta_analysis`` module.
+            The studies are named after the first level of the index. If a name is already in the meta-analysis or
+            repeated, no study of the dataframe is added.
+
+        scale_to_reverse: list of str, optional
+            List of strings listing the clinical scales having a positive correlation with symptoms of the disease;
+            i.e increasing when a patient gets better.
+
+        pre_post_correlation: float, default = 0.5
+            Pearson correlation of the pre-test and post-test values.
+
+        """
+
+        n_treatment, n_control, effect_size = _effect_sizes_from_dataframe(df, scale_to_reverse)
+        standard_error_ES = _standard_error_effect_size(n_treatment, n_control, effect_size, pre_post_correlation)
+        names = df.index.get_level_values(0).tolist()
+        self._check_new_names(names)
+        for name, study_effect_size, study_variance_ES in zip(names, effect_size.tolist(), (standard_error_ES**2).tolist()):
+            self._add(name, study_effect_size, study_variance_ES)
+
+    def remove_study(self, name):
+        """Removes a study from the meta-analysis.
+
+        Parameters
+        ----------
+        name: str
+            Name of the study.
+
+        """
+
+        effect_size, variance_ES = self.studies.pop(name)
+        self._update(effect_size, variance_ES, -1)
+
+    def results(self):
+        """Computes the results of the meta-analysis with the studies added so far.
+
+        Returns
+        -------
+        df_results: pandas.DataFrame
+            Global results, as returned by ``run_meta_analysis``.
+            It contains the summary effect, its 95% confidence interval, its variance, its standard error, its p-value,
+            the between studies variance (Tau²), the heterogeneity (I²), its p-value, and the Chi2 value.
+
+        """
+
+        import scipy.stats as scp
+
+        if len(self.studies) == 0:
+            raise ValueError('The meta-analysis does not contain any study')
+
+        # Q, C, Tau² and I² (Equations 12.2 to 12.5 and 16.9 of Borenstein (2009))
+        sum_weights, sum_weighted_ES, sum_weighted_squared_ES, sum_squared_weights = self._sums_fixed_model
+        degrees_of_freedom = len(self.studies) - 1
+        Q = max(sum_weighted_squared_ES - sum_weighted_ES**2/sum_weights, 0)
+        C = sum_weights - sum_squared_weights/sum_weights
+        Tau2 = max((Q - degrees_of_freedom)/C, 0) if degrees_of_freedom > 0 else 0.
+        I2 = max(((Q - degrees_of_freedom)/Q)*100, 0) if Q > 0 else np.nan
+
+        # Sums of the random effects weights: 1/(u + delta) = sum over m of (-delta)^m/u^(m+1)
+        ratio = (Tau2 - self._reference_Tau2)/self._smallest_total_variance
+        if not self._up_to_date or abs(ratio) >= self.max_ratio:
+            self._expand(Tau2)
+        coefficients = np.cumprod(np.r_[1, np.full(self.n_terms - 1, -(Tau2 - self._reference_Tau2)/self._scale)])
+        sum_weights_random = coefficients.dot(self._moments_weights)/self._scale
+        sum_weighted_ES_random = coefficients.dot(self._moments_weighted_ES)/self._scale
+
+        df_results = _results_dataframe([Q], [1 - scp.chi2.cdf(Q, degrees_of_freedom)], [Tau2],
+                                        [sum_weighted_ES_random/sum_weights_random], [1/sum_weights_random], [I2],
+                                        index=['Results'])
+
+        return df_results
+
+    def save(self, file):
+        """Saves the state of the meta-analysis in a numpy ``.npz`` file.
+
+        Parameters
+        ----------
+        file: str
+            Name or localisation of the file.
+
+        """
+
+        # The names are strings (checked when the studies are added), they are loaded unchanged without pickling
+        effect_size, variance_ES = np.array(list(self.studies.values())).reshape(-1, 2).T
+        np.savez(file, names=np.array(list(self.studies.keys()), dtype=str), effect_size=effect_size, variance_ES=variance_ES,
+                 sums_fixed_model=self._sums_fixed_model, moments_weights=self._moments_weights,
+                 moments_weighted_ES=self._moments_weighted_ES,
+                 parameters=np.array([self.n_terms, self.max_ratio, self._reference_Tau2, self._scale,
+                                      self._smallest_total_variance, self._up_to_date]))
+
+    @classmethod
+    def load(cls, file):
+        """Loads the state of a meta-analysis saved with ``save``.
+
+        Parameters
+        ----------
+        file: str
+            Name or localisation of the file.
+
+        Returns
+        -------
+        accumulator: MetaAnalysisAccumulator
+            Meta-analysis in the state it was saved.
+
+        """
+
+        with np.load(file) as state:
+            n_terms, max_ratio, reference_Tau2, scale, smallest_total_variance, up_to_date = state['parameters']
+            accumulator = cls(int(n_terms), max_ratio)
+            accumulator.studies = dict(zip(state['names'].tolist(), zip(state['effect_size'].tolist(),
+                                                                        state['variance_ES'].tolist())))
+            accumulator._sums_fixed_model = state['sums_fixed_model']
+            accumulator._moments_weights = state['moments_weights']
+            accumulator._moments_weighted_ES = state['moments_weighted_ES']
+            accumulator._reference_Tau2 = reference_Tau2
+            accumulator._scale = scale
+            accumulator._smallest_total_variance = smallest_total_variance
+            accumulator._up_to_date = bool(up_to_date)
+
+        return accumulator
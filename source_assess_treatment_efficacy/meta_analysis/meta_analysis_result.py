@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: meta_analysis_result
+    :synopsis: module storing the results of one or several meta-analyses in arrays
+
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+"""
+
+import pandas as pd
+
+
+class MetaAnalysisResult:
+    """Results of one or several meta-analyses stored in two blocks of floats: one row per study and one row per
+    meta-analysis. Each column of the blocks is contiguous in memory, so the columns, the dataframes and the Arrow
+    tables built from them are views and not copies.
+
+    It is obtained with ``run_meta_analysis`` or ``run_batched_meta_analysis`` and the argument ``return_result=True``.
+
+    Parameters
+    ----------
+    index: pandas.Index
+        Label of each study.
+
+    per_study: numpy.ndarray
+        Results per study (in rows), with the columns of ``PER_STUDY_COLUMNS``, in Fortran order.
+
+    results_index: pandas.Index
+        Label of each meta-analysis.
+
+    results: numpy.ndarray
+        Global results of each meta-analysis (in rows), with the columns of ``RESULTS_COLUMNS``, in Fortran order.
+
+    groups: numpy.ndarray of int
+        Index of the meta-analysis (row of ``results``) each study belongs to.
+
+    diagnostics: Diagnostics, optional
+        Corrections and numerical issues recorded during the meta-analyses, e.g. ``diagnostics.mask('small_sample_correction')``
+        gives the studies whose effect size was corrected for their small sample size.
+
+    year_dtype: numpy.dtype or pandas dtype, default = float
+        Type of the years in the imported dataframe, restored in the dataframe of ``per_study_dataframe(legacy=True)``.
+
+    """
+
+    __slots__ = ('index', 'per_study', 'results_index', 'results', 'groups', 'diagnostics', 'year_dtype')
+
+    PER_STUDY_COLUMNS = ['Year', 'Effect size', 'Standard Error of the ES', 'Lower limit of the ES', 'Upper limit of the ES',
+                         'Weight']
+
+    RESULTS_COLUMNS = ['Chi2', 'p-value Heterogeneity', 'Tau2', 'Summary Effect', 'Variance Summary Effect',
+                       'Standard Error Summary Effect', 'Lower limit of the Summary Effect',
+                       'Upper limit of the Summary Effect', 'p-value', 'Heterogeneity']
+
+    def __init__(self, index, per_study, results_index, results, groups, diagnostics=None, year_dtype=float):
+        self.index = index
+        self.per_study = per_study
+        self.results_index = results_index
+        self.results = results
+        self.groups = groups
+        self.diagnostics = diagnostics
+        self.year_dtype = year_dtype
+
+    def __repr__(self):
+        return '<MetaAnalysisResult: %d meta-analyses, %d studies>' % (len(self.results_index), len(self.index))
+
+    @property
+    def year(self):
+        return self.per_study[:, 0]
+
+    @property
+    def effect_size(self):
+        return self.per_study[:, 1]
+
+    @property
+    def standard_error_ES(self):
+        return self.per_study[:, 2]
+
+    @property
+    def lower_limit(self):
+        return self.per_study[:, 3]
+
+    @property
+    def upper_limit(self):
+        return self.per_study[:, 4]
+
+    @property
+    def weight(self):
+        return self.per_study[:, 5]
+
+    @property
+    def Tau2(self):
+        return self.results[:, 2]
+
+    @property
+    def summary_effect(self):
+        return self.results[:, 3]
+
+    @property
+    def standard_error_summary_effect(self):
+        return self.results[:, 5]
+
+    @property
+    def lower_limit_summary_effect(self):
+        return self.results[:, 6]
+
+    @property
+    def upper_limit_summary_effect(self):
+        return self.results[:, 7]
+
+    @property
+    def I2(self):
+        return self.results[:, 9]
+
+    def per_study_dataframe(self, legacy=False):
+        """Results per study as a dataframe.
+
+        Parameters
+        ----------
+        legacy: bool, default = False
+            If True, the dataframe is the one returned by ``run_meta_analysis``, with the 95% confidence interval stored
+            as tuples; this requires a copy. Otherwise, the dataframe is a view of the results with the bounds of the
+            confidence interval in two columns.
+
+        Returns
+        -------
+        df_results_per_study: pandas.DataFrame
+            Results per study.
+
+        """
+
+        if not legacy:
+            return pd.DataFrame(self.per_study, index=self.index, columns=self.PER_STUDY_COLUMNS, copy=False)
+
+        # Years are stored as floats in the block, they have the type of the imported years in the dataframe of
+        # ``run_meta_analysis`` (floats if some years are missing)
+        year = pd.Series(self.year, copy=False).astype(self.year_dtype).array
+        df_results_per_study = pd.DataFrame({'Year': year,
+                                             'Effect size': self.effect_size,
+                                             'Standard Error of the ES': self.standard_error_ES,
+                                             '95% Confidence interval of the ES': list(zip(self.lower_limit, self.upper_limit)),
+                                             'Weight': self.weight},
+                                             index=self.index)
+
+        return df_results_per_study
+
+    def results_dataframe(self, legacy=False):
+        """Global results as a dataframe, one row per meta-analysis.
+
+        Parameters
+        ----------
+        legacy: bool, default = False
+            If True, the dataframe is the one returned by ``run_meta_analysis``, with the 95% confidence interval stored
+            as tuples; this requires a copy. Otherwise, the dataframe is a view of the results with the bounds of the
+            confidence interval in two columns.
+
+        Returns
+        -------
+        df_results: pandas.DataFrame
+            Global results.
+
+        """
+
+        df_results = pd.DataFrame(self.results, index=self.results_index, columns=self.RESULTS_COLUMNS, copy=legacy)
+
+        if legacy:
+            df_results.insert(6, '95% Confidence Interval of the Summary Effect',
+                              list(zip(self.lower_limit_summary_effect, self.upper_limit_summary_effect)))
+            df_results = df_results.drop(['Lower limit of the Summary Effect', 'Upper limit of the Summary Effect'], axis=1)
+
+        return df_results
+
+    def to_numpy(self, results=False):
+        """Returns the block of results per study, or of global results, without copy.
+
+        Parameters
+        ----------
+        results: bool, default = False
+            If True, the global results are returned, otherwise the results per study.
+
+        Returns
+        -------
+        values: numpy.ndarray
+            Block of floats, its columns are given by ``PER_STUDY_COLUMNS`` or ``RESULTS_COLUMNS``.
+
+        """
+
+        if results:
+            return self.results
+        return self.per_study
+
+    def to_arrow(self, results=False):
+        """Returns the results per study, or the global results, as an Arrow table whose columns share the memory of
+        the results. It requires ``pyarrow``.
+
+        Parameters
+        ----------
+        results: bool, default = False
+            If True, the global results are returned, otherwise the results per study.
+
+        Returns
+        -------
+        table: pyarrow.Table
+            Results, the labels of the studies or meta-analyses are not included.
+
+        """
+
+        try:
+            import pyarrow as pa
+        except ImportError:
+            raise ImportError('pyarrow is required to export the results to Arrow')
+
+        values = self.to_numpy(results)
+        columns = self.RESULTS_COLUMNS if results else self.PER_STUDY_COLUMNS
+
+        return pa.Table.from_arrays([pa.array(values[:, i]) for i in range(len(columns))], names=columns)
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: meta_regression
+    :synopsis: module performing mixed effects meta-regressions of the effect sizes on study moderators
+
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+"""
+
+import warnings
+import numpy as np
+import pandas as pd
+
+from .perform_meta_analysis import _effect_sizes_from_dataframe, _standard_error_effect_size
+
+
+def _design_matrix(df, moderators):
+    """Builds the design matrix of a meta-regression: an intercept, the numerical moderators, and one indicator per
+    level (except the first one) of the categorical moderators.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Ratings, with one column per moderator.
+
+    moderators: list of str
+        Columns of the moderators.
+
+    Returns
+    -------
+    X: numpy.ndarray
+        Design matrix, the rows of the studies with a missing moderator are set to 0.
+
+    terms: list of str
+        Name of each column of the design matrix.
+
+    complete: numpy.ndarray of bool
+        Mask of the studies whose moderators are all known.
+
+    """
+
+    columns = [np.ones(len(df))]
+    terms = ['Intercept']
+    complete = np.ones(len(df), dtype=bool)
+    for moderator in moderators:
+        values = df[moderator]
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            columns.append(values.to_numpy(dtype=float))
+            terms.append(moderator)
+            complete &= values.notna().to_numpy()
+        else:
+            codes, levels = pd.factorize(values, sort=True)
+            columns.extend((codes == level).astype(float) for level in range(1, len(levels)))
+            terms.extend('%s[%s]' % (moderator, level) for level in levels[1:])
+            complete &= codes >= 0
+
+    X = np.column_stack(columns)
+    X[~complete] = 0
+
+    return X, terms, complete
+
+
+def _weighted_least_squares(X, effect_size, weight):
+    """Solves weighted least squares problems sharing the same effect sizes, by QR decompositions of the rows scaled by
+    the square root of the weights.
+
+    Parameters
+    ----------
+    X: numpy.ndarray
+        Design matrices, of shape (number of models, number of studies, number of coefficients).
+
+    effect_size: numpy.ndarray
+        Effect size of each study.
+
+    weight: numpy.ndarray
+        Weight of each study for each model, 0 for the studies that are not included in a model.
+
+    Returns
+    -------
+    Q, R: numpy.ndarray
+        Reduced QR decompositions of the scaled design matrices.
+
+    coefficients: numpy.ndarray
+        Coefficients of each model.
+
+    residuals: numpy.ndarray
+        Residuals of each study for each model.
+
+    rank_deficient: numpy.ndarray of bool
+        Mask of the models whose design matrix is not of full rank, their coefficients are not estimated.
+
+    """
+
+    square_root_weight = np.sqrt(weight)
+    Q, R = np.linalg.qr(square_root_weight[:, :, np.newaxis]*X)
+
+    # A column of zeros or a column collinear to the other ones gives a null diagonal element
+    diagonal = np.abs(np.diagonal(R, axis1=1, axis2=2))
+    rank_deficient = np.any(diagonal <= 1e-10*diagonal.max(axis=1, keepdims=True), axis=1)
+    R[rank_deficient] = np.eye(X.shape[2])
+
+    projection = np.einsum('mkp,mk->mp', Q, square_root_weight*effect_size)
+    coefficients = np.linalg.solve(R, projection[:, :, np.newaxis])[:, :, 0]
+    coefficients[rank_deficient] = np.nan
+    residuals = effect_size - np.einsum('mkp,mp->mk', X, coefficients)
+
+    return Q, R, coefficients, residuals, rank_deficient
+
+
+def _estimate_residual_tau2(X, effect_size, variance_ES, complete, tau2_method, max_iterations=100, tolerance=1e-10):
+    """Estimates the residual between studies variance (Tau²) of several meta-regressions at once.
+
+    Parameters
+    ----------
+    X: numpy.ndarray
+        Design matrices, of shape (number of models, number of studies, number of coefficients).
+
+    effect_size, variance_ES: numpy.ndarray
+        Effect size of each study and its variance.
+
+    complete: numpy.ndarray of bool
+        Mask of the studies included in each model, of shape (number of models, number of studies).
+
+    tau2_method: str, 'DL' or 'REML'
+        Method of moments generalizing the estimator of DerSimonian and Laird, or restricted maximum likelihood
+        (Fisher scoring starting from the method of moments).
+
+    max_iterations: int, default = 100
+        Maximum number of iterations of REML.
+
+    tolerance: float, default = 1e-10
+        The iterations stop when Tau² changes by less than this value.
+
+    Returns
+    -------
+    Tau2: numpy.ndarray
+        Residual between studies variance of each model.
+
+    Q_residual: numpy.ndarray
+        Weighted sum of the squared residuals of the fixed effect model, which tests the residual heterogeneity.
+
+    """
+
+    if tau2_method not in ['DL', 'REML']:
+        raise ValueError("tau2_method is either 'DL' or 'REML'")
+
+    degrees_of_freedom = complete.sum(axis=1) - X.shape[2]
+
+    # Fixed effect model: trace of P = sum of the weights - trace of (X'WX)^-1 X'W²X = sum of w(1 - h)
+    weight = complete/variance_ES
+    Q, _, _, residuals, _ = _weighted_least_squares(X, effect_size, weight)
+    leverage = np.sum(Q**2, axis=2)
+    Q_residual = np.sum(weight*residuals**2, axis=1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Tau2 = np.maximum((Q_residual - degrees_of_freedom)/np.sum(weight*(1 - leverage), axis=1), 0)
+
+    if tau2_method == 'REML':
+        # The root of the score of the restricted likelihood is bracketed between 0 and an upper bound where the score is
+        # negative. Above the largest variance of the effect sizes, the weights are between 1/(2*Tau²) and 1/Tau², so
+        # that the score is negative for Tau² > 2*(residual sum of squares of ordinary least squares)/(k - p)
+        _, _, _, unweighted_residuals, _ = _weighted_least_squares(X, effect_size, complete.astype(float))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            upper_bound = np.maximum.reduce([np.max(complete*variance_ES, axis=1), Tau2,
+                                             2*np.sum(complete*unweighted_residuals**2, axis=1)/degrees_of_freedom])
+        lower_bound = np.zeros(len(Tau2))
+        previous_step = np.full(len(Tau2), np.inf)
+        active = degrees_of_freedom > 0
+        for iteration in range(max_iterations):
+            weight = complete[active]/(variance_ES + Tau2[active, np.newaxis])
+            Q, _, _, residuals, _ = _weighted_least_squares(X[active], effect_size, weight)
+            leverage = np.sum(Q**2, axis=2)
+            # Traces of P and P² from the QR decomposition: P = W^1/2 (I - QQ') W^1/2
+            trace_P = np.sum(weight*(1 - leverage), axis=1)
+            trace_PP = (np.sum(weight**2, axis=1) - 2*np.sum(leverage*weight**2, axis=1)
+                        + np.sum(np.einsum('mkp,mk,mkq->mpq', Q, weight, Q)**2, axis=(1, 2)))
+            score = np.sum((weight*residuals)**2, axis=1) - trace_P
+            with np.errstate(divide='ignore', invalid='ignore'):
+                step = score/trace_PP
+
+            # The steps leaving the bracket of the root, or not twice smaller than the previous one, are replaced by a
+            # bisection, as for the Tau² of the meta-analyses
+            lower_bound[active] = np.where(score > 0, np.maximum(lower_bound[active], Tau2[active]), lower_bound[active])
+            upper_bound[active] = np.where(score < 0, np.minimum(upper_bound[active], Tau2[active]), upper_bound[active])
+            bisection = ((Tau2[active] + step < lower_bound[active]) | (Tau2[active] + step > upper_bound[active])
+                         | ~np.isfinite(step) | (np.abs(step) > np.abs(previous_step[active])/2))
+            step = np.where(bisection, (lower_bound[active] + upper_bound[active])/2 - Tau2[active], step)
+
+            new_Tau2 = np.maximum(Tau2[active] + step, 0)
+            previous_step[active] = new_Tau2 - Tau2[active]
+            converged = np.abs(new_Tau2 - Tau2[active]) <= tolerance
+            Tau2[active] = new_Tau2
+            active[active] = ~converged
+            if not np.any(active):
+                break
+        else:
+            warnings.warn('Tau2 has not converged for %d meta-regressions' % np.sum(active))
+
+        # The restricted likelihood can have a local maximum at Tau² = 0 besides the root of the score: the root is kept
+        # only if its restricted likelihood is higher
+        def restricted_log_likelihood(Tau2):
+            weight = complete/(variance_ES + Tau2[:, np.newaxis])
+            _, R, _, residuals, _ = _weighted_least_squares(X, effect_size, weight)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return -(np.sum(complete*np.log(variance_ES + Tau2[:, np.newaxis]), axis=1)
+                         + 2*np.sum(np.log(np.abs(np.diagonal(R, axis1=1, axis2=2))), axis=1)
+                         + np.sum(weight*residuals**2, axis=1))/2
+        Tau2 = np.where(restricted_log_likelihood(np.zeros(len(Tau2))) > restricted_log_likelihood(Tau2), 0, Tau2)
+
+    return np.where(degrees_of_freedom > 0, Tau2, np.nan), Q_residual
+
+
+def _fit_meta_regressions(X, effect_size, variance_ES, complete, tau2_method):
+    """Fits meta-regressions sharing the same number of coefficients, with Knapp and Hartung inference.
+
+    Returns
+    -------
+    fit: dict
+        'k', 'Tau2', 'Q residual', 'coefficients', 'covariance' (Knapp and Hartung) and 'F' (omnibus test of the
+        moderators) of each model.
+
+    """
+
+    n_coefficients = X.shape[2]
+    k = complete.sum(axis=1)
+    degrees_of_freedom = k - n_coefficients
+    Tau2, Q_residual = _estimate_residual_tau2(X, effect_size, variance_ES, complete, tau2_method)
+
+    # Random effects weights 1/(variance_ES + Tau²)
+    weight = complete/(variance_ES + np.nan_to_num(Tau2)[:, np.newaxis])
+    _, R, coefficients, residuals, rank_deficient = _weighted_least_squares(X, effect_size, weight)
+
+    # Knapp and Hartung: the covariance (X'WX)^-1 = R^-1 R^-T is scaled by the weighted residual variance
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scale = np.sum(weight*residuals**2, axis=1)/degrees_of_freedom
+    inverse_R = np.linalg.inv(R)
+    covariance = scale[:, np.newaxis, np.newaxis]*np.einsum('mij,mkj->mik', inverse_R, inverse_R)
+
+    invalid = rank_deficient | (degrees_of_freedom <= 0)
+    if np.any(invalid):
+        warnings.warn('%d meta-regressions have collinear moderators or not enough studies, they are not estimated'
+                      % np.sum(invalid))
+
+    # Omnibus test of all the coefficients except the intercept
+    F = np.full(len(k), np.nan)
+    if n_coefficients > 1:
+        testable = ~invalid & (scale > 0)
+        moderators_coefficients = coefficients[testable, 1:]
+        F[testable] = np.einsum('mi,mi->m', moderators_coefficients,
+                                np.linalg.solve(covariance[testable, 1:, 1:],
+                                                moderators_coefficients[:, :, np.newaxis])[:, :, 0])/(n_coefficients - 1)
+
+    coefficients[invalid] = np.nan
+    covariance[invalid] = np.nan
+    Tau2[invalid] = np.nan
+
+    return {'k': k, 'Tau2': Tau2, 'Q residual': Q_residual, 'coefficients': coefficients, 'covariance': covariance,
+            'F': F}
+
+
+def run_meta_regression(df, moderators, scale_to_reverse=[], pre_post_correlation=0.5, tau2_method='DL'):
+    """Performs mixed effects meta-regressions of the effect sizes of ``run_meta_analysis`` on study moderators.
+
+    The effect sizes are weighted by 1/(variance of the effect size + residual Tau²), the coefficients are estimated by
+    QR decompositions of the rows scaled by the square root of the weights, and their standard errors follow Knapp and
+    Hartung (2003) "Improved tests for a random effects meta-regression with a single covariate", *Statistics in
+    Medicine*. Several sets of moderators can be given: all the models with the same number of coefficients are fitted
+    at once.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Parents, teachers or clinicians ratings required to perform the meta-analysis, with one column per moderator.
+        Categorical moderators (non numerical columns) are coded with one indicator per level except the first one.
+        Studies with a missing moderator are excluded from the models using it.
+
+    moderators: str, list of str or list of list of str
+        Moderators of one meta-regression, or list of sets of moderators, one meta-regression per set.
+        For instance ``[['year'], ['score_name'], ['year', 'score_name']]`` fits three models.
+
+    scale_to_reverse: list of str, optional
+        List of strings listing the clinical scales having a positive correlation with symptoms of the disease;
+        i.e increasing when a patient gets better.
+
+    pre_post_correlation: float, default = 0.5
+        Pearson correlation of the pre-test and post-test values.
+
+    tau2_method: str, default = 'DL'
+        Estimator of the residual between studies variance: 'DL' (method of moments) or 'REML'.
+
+    Returns
+    -------
+    df_coefficients: pandas.DataFrame
+        Rows are indexed by the model and the term, columns are the coefficient, its standard error, the t statistic,
+        its p-value and the 95% confidence interval (Student distribution with k - p degrees of freedom).
+
+    df_models: pandas.DataFrame
+        One row per model, with the number of studies, the residual Tau², the proportion of Tau² explained by the
+        moderators (R²), the omnibus F test of the moderators and its p-value, and the test of the residual
+        heterogeneity (Q residual and its p-value).
+
+    """
+
+    import scipy.stats as scp
+
+    if isinstance(moderators, str):
+        moderators = [[moderators]]
+    elif all(isinstance(moderator, str) for moderator in moderators):
+        moderators = [list(moderators)]
+
+    # Effect sizes and their variances, shared by all the models
+    n_treatment, n_control, effect_size = _effect_sizes_from_dataframe(df, scale_to_reverse)
+    variance_ES = _standard_error_effect_size(n_treatment, n_control, effect_size, pre_post_correlation)**2
+
+    designs = [_design_matrix(df, moderators_set) for moderators_set in moderators]
+    labels = [' + '.join(moderators_set) for moderators_set in moderators]
+    complete = np.array([design[2] for design in designs]).reshape(len(designs), len(effect_size))
+    n_coefficients = np.array([len(design[1]) for design in designs])
+
+    # Intercept-only models on the same studies, for the proportion of Tau² explained by the moderators
+    Tau2_without_moderators = _fit_meta_regressions(np.ones((len(designs), len(effect_size), 1)), effect_size,
+                                                    variance_ES, complete, tau2_method)['Tau2']
+
+    fits = [None]*len(designs)
+    for p in np.unique(n_coefficients):
+        models = np.flatnonzero(n_coefficients == p)
+        fit = _fit_meta_regressions(np.stack([designs[model][0] for model in models]), effect_size, variance_ES,
+                                    complete[models], tau2_method)
+        for position, model in enumerate(models):
+            fits[model] = {key: values[position] for key, values in fit.items()}
+
+    k = np.array([fit['k'] for fit in fits])
+    degrees_of_freedom = k - n_coefficients
+    Tau2 = np.array([fit['Tau2'] for fit in fits])
+    F = np.array([fit['F'] for fit in fits])
+    Q_residual = np.array([fit['Q residual'] for fit in fits])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        R2 = np.where(Tau2_without_moderators > 0,
+                      np.maximum((Tau2_without_moderators - Tau2)/Tau2_without_moderators, 0)*100, 0)
+        df_models = pd.DataFrame({'Number of studies': k,
+                                  'Tau2': Tau2,
+                                  'R2': np.where(np.isnan(Tau2), np.nan, R2),
+                                  'F': F,
+                                  'p-value Moderators': scp.f.sf(F, n_coefficients - 1, degrees_of_freedom),
+                                  'Q residual': Q_residual,
+                                  'p-value Residual Heterogeneity': scp.chi2.sf(Q_residual, degrees_of_freedom)},
+                                  index=pd.Index(labels, name='Model'))
+
+    coefficients = np.concatenate([fit['coefficients'] for fit in fits])
+    standard_error = np.concatenate([np.sqrt(np.diagonal(fit['covariance'])) for fit in fits])
+    term_degrees_of_freedom = np.repeat(degrees_of_freedom, n_coefficients)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = coefficients/standard_error
+        quantile = scp.t.ppf(0.975, term_degrees_of_freedom)
+    index = pd.MultiIndex.from_arrays([np.repeat(labels, n_coefficients),
+                                       np.concatenate([design[1] for design in designs])], names=['Model', 'Term'])
+    df_coefficients = pd.DataFrame({'Coefficient': coefficients,
+                                    'Standard Error': standard_error,
+                                    't': t,
+                                    'p-value': 2*scp.t.sf(np.abs(t), term_degrees_of_freedom),
+                                    'Lower limit': coefficients - quantile*standard_error,
+                                    'Upper limit': coefficients + quantile*standard_error},
+                                    index=index)
+
+    return df_coefficients, df_models
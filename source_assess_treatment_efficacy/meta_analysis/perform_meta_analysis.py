@@ -8,46 +8,83 @@
 """
 
 import numpy as np
-import scipy.stats as scp
 import pandas as pd
 import warnings
-import matplotlib.pyplot as plt
+
+from ..caching import cached
+from ..diagnostics import Diagnostics
+from .meta_analysis_result import MetaAnalysisResult
+from .forest_plot_renderer import _forest_plot_data, _draw_forest_plot, _import_matplotlib
+
+
+def _small_sample_correction(n_treatment, n_control):
+    """Computes the correction factor for small sample size (Borenstein (2009) *Introduction to meta-analysis*, Equation 4.22).
+    
+    Parameters
+    ----------
+    n_treatment: numpy.ndarray
+        Number of patients included in the treatment group of each study.
+
+    n_control: numpy.ndarray
+        Number of patients included in the control group of each study.
+
+    Returns
+    -------
+    correction_factor: numpy.ndarray
+        Correction factor of each study, equal to 1 when no correction is needed.
+
+    small_sample: numpy.ndarray of bool
+        Mask of the studies whose degrees of freedom are below 10 and thus corrected.
+
+    """
+
+    # This correction factor is close to 1 unless the degree of freedom is very small (<10)
+    degrees_of_freedom = n_treatment + n_control - 2
+    small_sample = degrees_of_freedom < 10
+    correction_factor = np.where(small_sample, 1 - (3/(4*degrees_of_freedom - 1)), 1.)
+
+    return correction_factor, small_sample
 
 
 def _effect_size_ppc(n_treatment, n_control, mean_post_test_treatment, mean_pre_test_treatment, mean_pre_test_control, mean_post_test_control,
-                    std_pre_test_treatment, std_pre_test_control):   
+                    std_pre_test_treatment, std_pre_test_control, diagnostics=None):   
     """Computes the pre post control effect size (Scott B. Morris (2008), also called the effect size between "Estimating Effect Sizes From Pretest-Posttest Control Group Designs 
     and under a random effects model", Organizational Research Methods (Equation 8)).
+
+    All the parameters can be given as arrays (one value per study), the effect sizes of all studies are then computed at once.
     
     Parameters
     ----------
-    n_treatment: int
+    n_treatment: int or numpy.ndarray
         Number of patients included in the treatment group.
 
-    n_control: int
+    n_control: int or numpy.ndarray
         Number of patients included in the control group.
 
-    mean_post_test_treatment: float
+    mean_post_test_treatment: float or numpy.ndarray
         Mean score after the treatment.
 
-    mean_pre_test_treatment: float
+    mean_pre_test_treatment: float or numpy.ndarray
         Mean score before the treatment.
 
-    mean_pre_test_control: float
+    mean_pre_test_control: float or numpy.ndarray
         Mean score before the treatment in the control group.
 
-    mean_post_test_control: float
+    mean_post_test_control: float or numpy.ndarray
         Mean score after the treatment in the control group.
            
-    std_pre_test_treatment: float
+    std_pre_test_treatment: float or numpy.ndarray
         Standard deviation of the mean score before the treatment.
 
-    std_post_test_treatment: float
+    std_post_test_treatment: float or numpy.ndarray
         Standard deviation of the mean score after the treatment.
 
+    diagnostics: Diagnostics, optional
+        If given, the studies corrected for their small sample size are recorded in it instead of raising a warning.
+
     Returns
     -------
-    effect_size: float
+    effect_size: float or numpy.ndarray
         Value estimating the efficacy of the treatment.
         If it's negative, the result is in favor of the treatment.
         
@@ -57,54 +94,56 @@ def _effect_size_ppc(n_treatment, n_control, mean_post_test_treatment, mean_pre_
                             (n_treatment + n_control - 2))
     d = ((mean_post_test_treatment - mean_pre_test_treatment) - (mean_post_test_control - mean_pre_test_control))/S_within
     
-    # Correction factor for small sample size. This correction factor is close to 1 unless the degree of freedom is very
-    # small (<10), see Borenstein, Introdution to meta-analysis, 2009.
-    if (n_treatment + n_control - 2) < 10:  
+    # Correction factor for small sample size, only applied to the studies with less than 10 degrees of freedom
+    correction_factor, small_sample = _small_sample_correction(n_treatment, n_control)
+    if diagnostics is not None:
+        diagnostics.flag('small_sample_correction', small_sample,
+                         'Since the sample size is too small, a correction factor is applied to the effect size')
+    elif np.any(small_sample):
         warnings.warn('Since the sample size is too small, a correction factor is applied to the effect size')
-        correction_factor = 1 - (3/(4*(n_treatment + n_control - 2) - 1))
-        effect_size = d*correction_factor 
-    else:
-        effect_size = d
+    effect_size = d*correction_factor
     
     return effect_size
 
 
-def _standard_error_effect_size(n_treatment, n_control, effect_size, pre_post_correlation):    
+def _standard_error_effect_size(n_treatment, n_control, effect_size, pre_post_correlation, diagnostics=None):    
     """Scott B. Morris (2008) "Estimating Effect Sizes From Pretest-Posttest Control Group Designs and under 
     a random effects model", Organizational Research Methods (Equation 25).
+
+    All the parameters can be given as arrays (one value per study), the standard errors of all studies are then computed at once.
     
     Parameters
     ----------
-    n_treatment: int
+    n_treatment: int or numpy.ndarray
         Number of patients included in the treatment group.
 
-    n_control: int
-    Number of patients included in the control group.
+    n_control: int or numpy.ndarray
+        Number of patients included in the control group.
 
-    effect_size: float
+    effect_size: float or numpy.ndarray
         Value estimating the efficacy of the treatment.
         If it's negative, the result is in favor of the treatment.
 
-    pre_post_correlation: float
+    pre_post_correlation: float or numpy.ndarray
         Pearson correlation of the pre-test and post-test values (i.e the pooled within-groups Pearson correlation.
+
+    diagnostics: Diagnostics, optional
+        If given, the studies corrected for their small sample size are recorded in it instead of raising a warning.
      
     Returns
     -------
-    standard_error_ES: float 
+    standard_error_ES: float or numpy.ndarray
         Standard error of the effect size.
-
-    variance_ES: float
-        Variance of the effect size.     
         
     """
     
-    # Correction factor for small sample size. This correction factor is close to 1 unless the degree of freedom is very
-    # small (<10), see Borenstein, Introdution to meta-analysis, 2009. 
-    if (n_treatment + n_control - 2) < 10: 
-        correction_factor = 1 - (3/(4*(n_treatment + n_control - 2) - 1))
+    # Correction factor for small sample size, only applied to the studies with less than 10 degrees of freedom
+    correction_factor, small_sample = _small_sample_correction(n_treatment, n_control)
+    if diagnostics is not None:
+        diagnostics.flag('small_sample_correction_of_the_variance', small_sample,
+                         'Since the sample size is too small, a correction factor is applied to the variance of the effect size')
+    elif np.any(small_sample):
         warnings.warn('Since the sample size is too small, a correction factor is applied to the variance of the effect size')
-    else:
-        correction_factor = 1
     
     # Variance 
     variance_ES = (2*(correction_factor**2)*(1 - pre_post_correlation)*((n_treatment + n_control)/
@@ -118,7 +157,417 @@ def _standard_error_effect_size(n_treatment, n_control, effect_size, pre_post_co
     return standard_error_ES
 
    
-def run_meta_analysis(df, scale_to_reverse=[], pre_post_correlation=0.5):
+def _effect_sizes_from_dataframe(df, scale_to_reverse=[], diagnostics=None):
+    """Computes the effect size of every study of a dataframe at once and homogenizes the direction of the clinical scales.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Ratings required to perform the meta-analysis, obtained with the ``import_csv_for_meta_analysis`` module.
+
+    scale_to_reverse: list of str, optional
+        List of strings listing the clinical scales having a positive correlation with symptoms of the disease; 
+        i.e increasing when a patient gets better.
+
+    diagnostics: Diagnostics, optional
+        If given, the studies corrected for their small sample size are recorded in it instead of raising a warning.
+
+    Returns
+    -------
+    n_treatment: numpy.ndarray
+        Number of patients included in the treatment group of each study.
+
+    n_control: numpy.ndarray
+        Number of patients included in the control group of each study.
+
+    effect_size: numpy.ndarray
+        Effect size of each study, a negative value is in favor of the treatment.
+
+    """
+
+    # Columns of the dataframe as arrays of floats
+    n_treatment = df['n_treatment'].to_numpy(dtype=float)
+    n_control = df['n_control'].to_numpy(dtype=float)
+    
+    # Compute the effect size    
+    effect_size = _effect_size_ppc(n_treatment, n_control, 
+                                   df['mean_post_test_treatment'].to_numpy(dtype=float), 
+                                   df['mean_pre_test_treatment'].to_numpy(dtype=float), 
+                                   df['mean_pre_test_control'].to_numpy(dtype=float), 
+                                   df['mean_post_test_control'].to_numpy(dtype=float), 
+                                   df['std_pre_test_treatment'].to_numpy(dtype=float), 
+                                   df['std_pre_test_control'].to_numpy(dtype=float),
+                                   diagnostics)
+
+    # Check if all the scales measure the desease severity the same way (high score = more symptomps) and homogenize.
+    # The standard error only depends on the squared effect size so it is not affected.
+    if len(scale_to_reverse) > 0:
+        effect_size[ df['score_name'].isin(scale_to_reverse).to_numpy() ] *= -1
+
+    return n_treatment, n_control, effect_size
+
+
+def _estimate_tau2(effect_size, variance_ES, groups, n_groups, method, Tau2_DL, max_iterations=100, tolerance=1e-10,
+                   diagnostics=None):
+    """Estimates the between studies variance (Tau²) of several independent meta-analyses at once with a method other 
+    than the one of DerSimonian and Laird. 
+    
+    The iterative methods (REML, ML and PM) are solved for all the meta-analyses at the same time, starting from the 
+    DerSimonian and Laird estimate; a meta-analysis that has converged is not updated anymore.
+
+    Parameters
+    ----------
+    effect_size: numpy.ndarray
+        Effect size of each study.
+
+    variance_ES: numpy.ndarray
+        Variance of the effect size of each study.
+
+    groups: numpy.ndarray of int
+        Index (between 0 and ``n_groups - 1``) of the meta-analysis each study belongs to.
+
+    n_groups: int
+        Number of meta-analyses.
+
+    method: str, 'REML', 'ML', 'PM', 'SJ' or 'HE'
+        Estimator of Tau²: restricted maximum likelihood, maximum likelihood, Paule and Mandel, Sidik and Jonkman, 
+        or Hedges (see Viechtbauer (2005) "Bias and Efficiency of Meta-Analytic Variance Estimators in the 
+        Random-Effects Model", *Journal of Educational and Behavioral Statistics*).
+
+    Tau2_DL: numpy.ndarray
+        DerSimonian and Laird estimate of each meta-analysis, starting point of the iterative methods.
+
+    max_iterations: int, default = 100
+        Maximum number of iterations of the iterative methods.
+
+    tolerance: float, default = 1e-10
+        The iterations stop when Tau² changes by less than this value.
+
+    diagnostics: Diagnostics, optional
+        If given, the meta-analyses whose Tau² has not converged are recorded in it instead of raising a warning.
+
+    Returns
+    -------
+    Tau2: numpy.ndarray
+        Between studies variance of each meta-analysis.
+
+    """
+
+    if method not in ['REML', 'ML', 'PM', 'SJ', 'HE']:
+        raise ValueError("tau2_method is either 'DL', 'REML', 'ML', 'PM', 'SJ' or 'HE'")
+
+    def _segmented_sum(values, rows=slice(None)):
+        return np.bincount(groups[rows], weights=values, minlength=n_groups)
+
+    k = np.bincount(groups, minlength=n_groups)
+
+    # Non iterative estimators, based on the unweighted mean of the effect sizes (Tau² is 0 with a single study, as
+    # with the other estimators)
+    unweighted_mean = _segmented_sum(effect_size)/k
+    squared_deviations = _segmented_sum((effect_size - unweighted_mean[groups])**2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance_of_the_effect_sizes = np.where(k > 1, squared_deviations/(k - 1), 0)
+        if method == 'HE':
+            return np.where(k > 1, np.maximum(variance_of_the_effect_sizes - _segmented_sum(variance_ES)/k, 0), 0)
+        if method == 'SJ':
+            Tau2_initial = squared_deviations/k
+            weight = 1/(variance_ES + Tau2_initial[groups])
+            mean = _segmented_sum(weight*effect_size)/_segmented_sum(weight)
+            return np.where(k > 1, Tau2_initial*_segmented_sum(weight*(effect_size - mean[groups])**2)/(k - 1), 0)
+
+    # Iterative estimators: the root of the score (or of the generalized Q statistic) is bracketed between 0 and an
+    # upper bound where the score is negative. Above the largest variance of the effect sizes, the weights are between
+    # 1/(2*Tau²) and 1/Tau², so that the score of the (restricted) likelihood is negative for
+    # Tau² > 2*(sum of the squared deviations)/(k - 2), and for Tau² > (sum of the squared deviations) if k = 2
+    largest_variance = np.zeros(n_groups)
+    np.maximum.at(largest_variance, groups, variance_ES)
+    Tau2 = Tau2_DL.astype(float)
+    lower_bound = np.zeros(n_groups)
+    upper_bound = np.maximum.reduce([variance_of_the_effect_sizes, Tau2, largest_variance,
+                                     2*squared_deviations/np.maximum(k - 2, 1)])
+    previous_step = np.full(n_groups, np.inf)
+    active = k > 1
+    for iteration in range(max_iterations):
+        rows = active[groups]
+        group_rows = groups[rows]
+        weight = 1/(variance_ES[rows] + Tau2[group_rows])
+        sum_weights = _segmented_sum(weight, rows)
+        sum_squared_weights = _segmented_sum(weight**2, rows)
+
+        # The sums of the meta-analyses that are not updated anymore are 0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            residuals = effect_size[rows] - (_segmented_sum(weight*effect_size[rows], rows)/sum_weights)[group_rows]
+            weighted_squared_residuals = _segmented_sum(weight**2*residuals**2, rows)
+            if method == 'ML':
+                # Fisher scoring of the likelihood
+                score = weighted_squared_residuals - sum_weights
+                step = score/sum_squared_weights
+            elif method == 'REML':
+                # Fisher scoring of the restricted likelihood
+                trace_P = sum_weights - sum_squared_weights/sum_weights
+                trace_PP = (sum_squared_weights - 2*_segmented_sum(weight**3, rows)/sum_weights
+                            + (sum_squared_weights/sum_weights)**2)
+                score = weighted_squared_residuals - trace_P
+                step = score/trace_PP
+            else:
+                # Newton step on the generalized Q statistic, which has to be equal to k - 1
+                score = _segmented_sum(weight*residuals**2, rows) - (k - 1)
+                step = score/weighted_squared_residuals
+
+            # The steps leaving the bracket of the root, or not twice smaller than the previous one, are replaced by
+            # a bisection: the bracket shrinks at least every other iteration and the iterations cannot oscillate
+            lower_bound = np.where(active & (score > 0), np.maximum(lower_bound, Tau2), lower_bound)
+            upper_bound = np.where(active & (score < 0), np.minimum(upper_bound, Tau2), upper_bound)
+            bisection = ((Tau2 + step < lower_bound) | (Tau2 + step > upper_bound) | ~np.isfinite(step)
+                         | (np.abs(step) > np.abs(previous_step)/2))
+            step = np.where(bisection, (lower_bound + upper_bound)/2 - Tau2, step)
+
+        new_Tau2 = np.where(active, np.maximum(Tau2 + step, 0), Tau2)
+        previous_step = np.where(active, new_Tau2 - Tau2, previous_step)
+        active &= np.abs(new_Tau2 - Tau2) > tolerance
+        Tau2 = new_Tau2
+        if not np.any(active):
+            break
+    else:
+        if diagnostics is None:
+            warnings.warn('Tau2 has not converged for %d meta-analyses' % np.sum(active))
+    if diagnostics is not None:
+        diagnostics.flag('tau2_not_converged', active, 'Tau2 has not converged after %d iterations' % max_iterations)
+
+    if method in ['ML', 'REML']:
+        # The (restricted) likelihood can have a local maximum at Tau² = 0 besides the root of the score: the root is
+        # kept only if its likelihood is higher
+        def log_likelihood(Tau2):
+            weight = 1/(variance_ES + Tau2[groups])
+            sum_weights = _segmented_sum(weight)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                residuals = effect_size - (_segmented_sum(weight*effect_size)/sum_weights)[groups]
+                values = -(_segmented_sum(np.log(variance_ES + Tau2[groups])) + _segmented_sum(weight*residuals**2))/2
+                return values - np.log(sum_weights)/2 if method == 'REML' else values
+        Tau2 = np.where(log_likelihood(np.zeros(n_groups)) > log_likelihood(Tau2), 0, Tau2)
+
+    return np.where(k > 1, Tau2, 0)
+
+
+def _random_effects_pooling(effect_size, variance_ES, groups, n_groups, tau2_method='DL', Tau2=None, diagnostics=None):
+    """Pools the effect sizes of several independent meta-analyses at once under a random effects model, with the
+    equations of Borenstein (2009) *Introduction to meta-analysis* (Tau² estimated by default with the method of DerSimonian and Laird).
+
+    Each sum of the equations is computed for all the meta-analyses in one segmented reduction over the studies.
+
+    Parameters
+    ----------
+    effect_size: numpy.ndarray
+        Effect size of each study.
+
+    variance_ES: numpy.ndarray
+        Variance of the effect size of each study.
+
+    groups: numpy.ndarray of int
+        Index (between 0 and ``n_groups - 1``) of the meta-analysis each study belongs to.
+
+    n_groups: int
+        Number of meta-analyses.
+
+    tau2_method: str, default = 'DL'
+        Estimator of Tau², see ``run_meta_analysis``.
+
+    Tau2: numpy.ndarray, optional
+        Between studies variance of each meta-analysis, used instead of estimating it.
+
+    diagnostics: Diagnostics, optional
+        If given, the meta-analyses whose Tau² has not converged are recorded in it instead of raising a warning.
+
+    Returns
+    -------
+    pooling: dict of numpy.ndarray
+        Results of each meta-analysis: 'k' (number of studies), 'Q', 'C', 'Tau2', 'Summary Effect', 
+        'Variance Summary Effect', 'p-value Heterogeneity', 'Heterogeneity', and per study 'weight' 
+        (under the random effects model) and 'percentage_weight'.
+
+    """
+
+    import scipy.stats as scp
+
+    def _segmented_sum(values):
+        return np.bincount(groups, weights=values, minlength=n_groups)
+
+    # Weight under a fixed effect model (Equation 11.2)
+    weight_fixed_model = 1/variance_ES
+
+    # Degrees of freedom, Q and C (Equations 12.3 to 12.5)
+    k = np.bincount(groups, minlength=n_groups)
+    degrees_of_freedom = k - 1
+    sum_weights = _segmented_sum(weight_fixed_model)
+    sum_weighted_ES = _segmented_sum(weight_fixed_model*effect_size)
+    Q = _segmented_sum(weight_fixed_model*effect_size**2) - sum_weighted_ES**2/sum_weights
+    C = sum_weights - _segmented_sum(weight_fixed_model**2)/sum_weights
+
+    # Tau² (Equation 12.2), negative values are put at zero, a meta-analysis of one study has no between studies variance
+    if Tau2 is None:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            Tau2 = np.where(k > 1, np.maximum((Q - degrees_of_freedom)/C, 0), 0)
+        if tau2_method != 'DL':
+            Tau2 = _estimate_tau2(effect_size, variance_ES, groups, n_groups, tau2_method, Tau2, diagnostics=diagnostics)
+
+    # Weights and summary effect under a random effects model (Equations 12.6 to 12.8)
+    weight = 1/(variance_ES + Tau2[groups])
+    sum_weights_random = _segmented_sum(weight)
+    summary_effect = _segmented_sum(weight*effect_size)/sum_weights_random
+
+    # Heterogeneity (Equation 16.9), a meta-analysis of one study has no heterogeneity
+    with np.errstate(divide='ignore', invalid='ignore'):
+        I2 = np.maximum(((Q - degrees_of_freedom)/Q)*100, 0)
+
+    pooling = {'k': k,
+               'Q': Q,
+               'C': C,
+               'Tau2': Tau2,
+               'Summary Effect': summary_effect,
+               'Variance Summary Effect': 1/sum_weights_random,
+               'p-value Heterogeneity': 1 - scp.chi2.cdf(Q, degrees_of_freedom),
+               'Heterogeneity': I2,
+               'weight': weight,
+               'percentage_weight': (weight*100)/sum_weights_random[groups]}
+
+    return pooling
+
+
+def _summary_effect_inference(summary_effect, variance_summary_effect):
+    """Computes the standard error, the 95% confidence interval and the p-value of summary effects.
+
+    Parameters
+    ----------
+    summary_effect: numpy.ndarray
+        Summary effect of each meta-analysis.
+
+    variance_summary_effect: numpy.ndarray
+        Variance of the summary effect of each meta-analysis.
+
+    Returns
+    -------
+    standard_error_summary_effect, lower_limit, upper_limit, p_value: numpy.ndarray
+        Standard error of the summary effect, bounds of its 95% confidence interval and its p-value.
+
+    """
+
+    import scipy.stats as scp
+
+    summary_effect = np.asarray(summary_effect, dtype=float)
+    variance_summary_effect = np.asarray(variance_summary_effect, dtype=float)
+
+    # 95% Confidence interval (Equations 12.10 and 12.11)
+    standard_error_summary_effect = np.sqrt(variance_summary_effect)
+    lower_limit = summary_effect - 1.96*standard_error_summary_effect
+    upper_limit = summary_effect + 1.96*standard_error_summary_effect
+
+    # P value for the summary effect (Equations 12.12 and 12.14)
+    z = summary_effect/standard_error_summary_effect
+    p_value = 2*(1 - scp.norm.cdf(np.abs(z)))
+
+    return standard_error_summary_effect, lower_limit, upper_limit, p_value
+
+
+def _results_dataframe(Q, p_value_heterogeneity, Tau2, summary_effect, variance_summary_effect, I2, index):
+    """Gathers the global results of one or several meta-analyses in the dataframe returned by ``run_meta_analysis``.
+
+    Parameters
+    ----------
+    Q, p_value_heterogeneity, Tau2, summary_effect, variance_summary_effect, I2: numpy.ndarray
+        Chi2 value, p-value of the heterogeneity, between studies variance, summary effect, its variance and 
+        heterogeneity of each meta-analysis.
+
+    index: list or pandas.Index
+        Label of each meta-analysis.
+
+    Returns
+    -------
+    df_results: pandas.DataFrame
+        Global results, one row per meta-analysis.
+        It contains the summary effect, its 95% confidence interval, its variance, its standard error, its p-value, 
+        the between studies variance (Tau²), the heterogeneity (I²), its p-value, and the Chi2 value.
+
+    """
+
+    standard_error_summary_effect, lower_limit, upper_limit, p_value = _summary_effect_inference(summary_effect, 
+                                                                                                 variance_summary_effect)
+
+    df_results = pd.DataFrame({'Chi2': Q,
+                               'p-value Heterogeneity': p_value_heterogeneity,
+                               'Tau2': Tau2,
+                               'Summary Effect': np.asarray(summary_effect, dtype=float),
+                               'Variance Summary Effect': np.asarray(variance_summary_effect, dtype=float),
+                               'Standard Error Summary Effect': standard_error_summary_effect,
+                               '95% Confidence Interval of the Summary Effect': list(zip(lower_limit, upper_limit)),
+                               'p-value': p_value,
+                               'Heterogeneity': I2},
+                               index=index)
+
+    return df_results
+
+
+def _meta_analysis_result(index, year, effect_size, standard_error_ES, percentage_weight, groups, 
+                          results_index, Q, p_value_heterogeneity, Tau2, summary_effect, variance_summary_effect, I2,
+                          diagnostics=None):
+    """Gathers the results of one or several meta-analyses in a ``MetaAnalysisResult``.
+
+    Parameters
+    ----------
+    index: pandas.Index
+        Label of each study.
+
+    year: pandas.Series or numpy.ndarray
+        Year of each study, stored as floats; the type of a series is kept in the legacy dataframe of the results.
+
+    effect_size, standard_error_ES, percentage_weight: numpy.ndarray
+        Effect size, its standard error and weight (in percentage) of each study.
+
+    groups: numpy.ndarray of int
+        Index of the meta-analysis each study belongs to.
+
+    results_index: list or pandas.Index
+        Label of each meta-analysis.
+
+    Q, p_value_heterogeneity, Tau2, summary_effect, variance_summary_effect, I2: numpy.ndarray
+        Chi2 value, p-value of the heterogeneity, between studies variance, summary effect, its variance and 
+        heterogeneity of each meta-analysis.
+
+    diagnostics: Diagnostics, optional
+        Corrections and numerical issues recorded during the meta-analyses.
+
+    Returns
+    -------
+    result: MetaAnalysisResult
+        Results stored in arrays.
+
+    """
+
+    standard_error_summary_effect, lower_limit, upper_limit, p_value = _summary_effect_inference(summary_effect, 
+                                                                                                 variance_summary_effect)
+
+    year_dtype = year.dtype if isinstance(year, pd.Series) else float
+    year = year.to_numpy(dtype=float, na_value=np.nan) if isinstance(year, pd.Series) else year
+
+    per_study = np.empty((len(effect_size), len(MetaAnalysisResult.PER_STUDY_COLUMNS)), order='F')
+    for i, column in enumerate([year, effect_size, standard_error_ES, effect_size - 1.96*standard_error_ES, 
+                                effect_size + 1.96*standard_error_ES, percentage_weight]):
+        per_study[:, i] = column
+
+    results = np.empty((len(results_index), len(MetaAnalysisResult.RESULTS_COLUMNS)), order='F')
+    for i, column in enumerate([Q, p_value_heterogeneity, Tau2, summary_effect, variance_summary_effect, 
+                                standard_error_summary_effect, lower_limit, upper_limit, p_value, I2]):
+        results[:, i] = column
+
+    if not isinstance(results_index, pd.Index):
+        results_index = pd.Index(results_index)
+
+    return MetaAnalysisResult(index, per_study, results_index, results, groups, diagnostics, year_dtype)
+
+
+@cached(added_columns=['effect_size', 'standard_error_ES', 'confidence_interval_of_the_ES', 'weight_fixed_model',
+                       'weight', 'percentage_weight'])
+def run_meta_analysis(df, scale_to_reverse=[], pre_post_correlation=0.5, tau2_method='DL', return_result=False,
+                      diagnostics='warn'):
     """Performs a meta analysis with the formulae described in Scott B. Morris (2008) "Estimating Effect Sizes From Pretest-
     Posttest Control Group Designs and under a random effects model", *Organizational Research Methods* and in Borenstein (2009)
     *Introduction to meta-analysis*. These formulae are the same as the ones used in Cortese et al., 2016. 
@@ -145,6 +594,26 @@ def run_meta_analysis(df, scale_to_reverse=[], pre_post_correlation=0.5):
         default (see Cuijpers et al., 2016 and Balk et al., 2012 "Empirical Assessment of Within-Arm Correlation Imputation in Trials 
         of Continuous Outcomes").                  
 
+    tau2_method: str, default = 'DL'
+        Estimator of the between studies variance (Tau²): 'DL' (DerSimonian and Laird, method of moments of Borenstein), 
+        'REML' (restricted maximum likelihood), 'ML' (maximum likelihood), 'PM' (Paule and Mandel), 'SJ' (Sidik and Jonkman) 
+        or 'HE' (Hedges). The iterative estimators (REML, ML and PM) start from the DerSimonian and Laird estimate.
+
+    return_result: bool, default = False
+        If True, the results are returned in a ``MetaAnalysisResult`` storing them in arrays, and ``df`` is not modified.
+
+    diagnostics: str or Diagnostics, default = 'warn'
+        What to do with the corrections (small sample sizes) and numerical issues (Tau² not converged) met during the
+        meta-analysis: they are reported once at the end, with the number of studies concerned, by 'warn', 'log', 'raise'
+        or 'ignore' (see ``Diagnostics.emit``), or added to a given ``Diagnostics`` to be reported after a batch of analyses.
+        The ``MetaAnalysisResult`` also stores them in its ``diagnostics`` attribute.
+
+    cache: bool or ResultCache, optional
+        If given, the results are looked up in (and stored to) this cache, keyed by a hash of ``df`` and of all the
+        parameters; ``True`` uses the default in-memory cache of the ``caching`` module. The columns added to ``df`` by
+        the meta-analysis are not part of the key, and they are added to ``df`` on a hit too: calling the meta-analysis
+        again on the same ``df`` is a hit.
+
     Returns
     -------
     df_results_per_study: pandas.DataFrame 
@@ -157,49 +626,41 @@ def run_meta_analysis(df, scale_to_reverse=[], pre_post_correlation=0.5):
         It contains the summary effect, its 95% confidence interval, its variance, its standard error, its p-value, 
         the between studies variance (Tau²), the heterogeneity (I²), its p-value, and the Chi2 value.
 
+    effect_size: pandas.Series
+        Effect size of each study.
+
+    result: MetaAnalysisResult
+        Results per study and global results, returned instead of the three previous values if ``return_result=True``.
+
     Notes
     -----
         Effect sizes computed for each study correspond to the effect sizes between subjects. Thus, the studies included in the meta-analysis 
         must be controlled and provide pre and post scores for treatment and control groups.
+
+        All the computations are performed on the columns of ``df`` converted to arrays, so that the run time does not depend
+        on a loop over the studies.
         
     """
-   
-    # Creation of the dataframe for total results
-    index = ['Results']
-    df_results = pd.DataFrame(index=index)
-    
-    
-    # Compute the effect size    
-    df['effect_size'] = df[
-                ['n_treatment', 'n_control', 'mean_post_test_treatment', 
-                 'mean_pre_test_treatment', 'mean_pre_test_control', 
-                 'mean_post_test_control', 'std_pre_test_treatment', 'std_pre_test_control']
-                          ].apply(lambda row:_effect_size_ppc(**row), axis=1)
+
+    import scipy.stats as scp
     
+    # Effect sizes of all studies, the corrections are recorded and reported at the end
+    recorded = Diagnostics()
+    n_treatment, n_control, effect_size = _effect_sizes_from_dataframe(df, scale_to_reverse, recorded)
     
     # Compute the standard error of the effect size
-    df['standard_error_ES'] = df[
-                        ['n_treatment', 'n_control', 'effect_size']
-                                ].apply(lambda row:_standard_error_effect_size(row['n_treatment'], row['n_control'],
-                                                         row['effect_size'], pre_post_correlation), axis=1)
-
-     
-    # Check if all the scales measure the desease severity the same way (high score = more symptomps) and homogenize
-    for scale_name in scale_to_reverse:
-        df['effect_size'][ df['score_name']==scale_name ] *= -1
+    standard_error_ES = _standard_error_effect_size(n_treatment, n_control, effect_size, pre_post_correlation, recorded)
     
     
     # All the following equations come from M. Borenstein and L. Hedges (2009) Introduction to Meta-Analysis
     
     # 95% Confidence interval (Equations 8.3 and 8.4)    
-    df['confidence_interval_of_the_ES'] = df[
-                                ['effect_size', 'standard_error_ES']].apply(lambda row: (
-                                 row['effect_size'] - 1.96*row['standard_error_ES'],
-                                 row['effect_size'] + 1.96*row['standard_error_ES']), axis=1)
+    lower_limit = effect_size - 1.96*standard_error_ES
+    upper_limit = effect_size + 1.96*standard_error_ES
     
     
     # Compute the inverse of the variance = weight under a fixed effect model (Equation 11.2)
-    df['weight_fixed_model'] = 1/(df['standard_error_ES']**2)
+    weight_fixed_model = 1/(standard_error_ES**2)
 
     
     # Computation of Tau²: between studies variance
@@ -208,17 +669,16 @@ def run_meta_analysis(df, scale_to_reverse=[], pre_post_correlation=0.5):
     degrees_of_freedom = len(df.index) - 1 
     
     ## Compute Q (Equation 12.3)  
-    Q = (df['weight_fixed_model']*df['effect_size']**2).sum() - ((df['weight_fixed_model']*df['effect_size']).sum())**2/df['weight_fixed_model'].sum()
-    df_results['Chi2'] = Q
+    Q = (weight_fixed_model*effect_size**2).sum() - ((weight_fixed_model*effect_size).sum())**2/weight_fixed_model.sum()
         
     ## P value of the heterogeneity
     # To know if heterogeneity is statistically significant, we can use Q and degrees of freedom
     # Null hypothesis: all studies share a common effect size
     # Under the null hypothesis, Q will follow a central chi-squared distribution
-    df_results['p-value Heterogeneity'] = 1 - scp.chi2.cdf(Q, degrees_of_freedom)
+    p_value_heterogeneity = 1 - scp.chi2.cdf(Q, degrees_of_freedom)
 
     ## Compute C (Equation 12.5)
-    C = df['weight_fixed_model'].sum() - ((df['weight_fixed_model']**2).sum()/df['weight_fixed_model'].sum())
+    C = weight_fixed_model.sum() - ((weight_fixed_model**2).sum()/weight_fixed_model.sum())
     
     ## Tau² (Equation 12.2)
     # When Tau2 is negative, we put it at zero (this negative value is due to sampling issues, 
@@ -226,42 +686,53 @@ def run_meta_analysis(df, scale_to_reverse=[], pre_post_correlation=0.5):
     Tau2 = (Q - degrees_of_freedom)/C    
     if Tau2 < 0:
         Tau2 = 0
-    df_results['Tau2'] = Tau2 
+
+    ## Other estimators of Tau²
+    if tau2_method != 'DL':
+        Tau2 = _estimate_tau2(effect_size, standard_error_ES**2, np.zeros(len(effect_size), dtype=int), 1, 
+                              tau2_method, np.array([Tau2]), diagnostics=recorded)[0]
 
         
     # Compute the weight of each study under a random effects model
     ## Compute the weights (Equation 12.6)
-    df['weight'] = 1/(df['standard_error_ES']**2 + Tau2)
+    weight = 1/(standard_error_ES**2 + Tau2)
     ## In percentage
-    df['percentage_weight'] = (df['weight']*100)/df['weight'].sum()
+    percentage_weight = (weight*100)/weight.sum()
     
 
     # Summary effect (Equation 12.7)
-    df_results['Summary Effect'] = (df['effect_size']*df['percentage_weight']).sum()/df['percentage_weight'].sum()
-
-    # Variance and SE of the summary effect (Equations 12.8 and 12.9)
-    df_results['Variance Summary Effect'] = 1/df['weight'].sum()
-    df_results['Standard Error Summary Effect'] = np.sqrt(df_results['Variance Summary Effect'])
+    summary_effect = (effect_size*percentage_weight).sum()/percentage_weight.sum()
 
-    # 95% Confidence interval (Equations 12.10 and 12.11)
-    df_results['95% Confidence Interval of the Summary Effect'] = df_results[
-                                         ['Summary Effect', 'Standard Error Summary Effect']].apply(lambda row: (
-                                           row['Summary Effect'] - 1.96*row['Standard Error Summary Effect'], 
-                                           row['Summary Effect'] + 1.96*row['Standard Error Summary Effect']), axis=1)
-   
-    # P value for the summary effect (Equations 12.12 and 12.14)
-    # Null hypothesis: control group and treatment group have no different effect
-    z = df_results['Summary Effect']/df_results['Standard Error Summary Effect']
-    df_results['p-value'] = 2*(1 - scp.norm.cdf(abs(z)))
+    # Variance of the summary effect (Equation 12.8)
+    variance_summary_effect = 1/weight.sum()
        
         
     # Heterogeneity (Equation 16.9)
     I2 = (((Q - degrees_of_freedom))/Q)*100
     if I2 < 0:
         I2 = 0
-    df_results['Heterogeneity'] = I2 
     
     
+    recorded.report(diagnostics)
+    if return_result:
+        return _meta_analysis_result(df.index, df['year'], effect_size, standard_error_ES, 
+                                     percentage_weight, np.zeros(len(effect_size), dtype=int), ['Results'], 
+                                     [Q], [p_value_heterogeneity], [Tau2], [summary_effect], [variance_summary_effect], [I2],
+                                     recorded)
+
+    # Per study values are stored in the input dataframe
+    df['effect_size'] = effect_size
+    df['standard_error_ES'] = standard_error_ES
+    df['confidence_interval_of_the_ES'] = list(zip(lower_limit, upper_limit))
+    df['weight_fixed_model'] = weight_fixed_model
+    df['weight'] = weight
+    df['percentage_weight'] = percentage_weight
+
+    # Creation of the dataframe for total results, with the standard error, the 95% confidence interval 
+    # and the p-value of the summary effect (Equations 12.9 to 12.14)
+    df_results = _results_dataframe([Q], [p_value_heterogeneity], [Tau2], [summary_effect], 
+                                    [variance_summary_effect], [I2], index=['Results'])
+    
     # Creation of the dataframe with results by studies
     df_results_per_study = pd.DataFrame({'Year': df['year'],
                                         'Effect size': df['effect_size'],
@@ -272,22 +743,112 @@ def run_meta_analysis(df, scale_to_reverse=[], pre_post_correlation=0.5):
 
     return df_results_per_study, df_results, df['effect_size']
 
+
+def run_batched_meta_analysis(df, group_by, scale_to_reverse=[], pre_post_correlation=0.5, tau2_method='DL', 
+                              return_result=False, diagnostics='warn'):
+    """Performs several independent meta-analyses in one call, one per group of studies of a long-format dataframe 
+    (e.g one per rater, outcome, subgroup and dataset). The formulae are the same as in ``run_meta_analysis``.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Ratings required to perform the meta-analyses, with the columns of the dataframes obtained with the
+        ``import_csv_for_meta_analysis`` module and one or several columns identifying the meta-analysis 
+        each study belongs to (they can be added with ``pandas.concat(..., keys=...)``).
+
+    group_by: str or list of str
+        Column(s) or index level(s) identifying the meta-analyses.
+
+    scale_to_reverse: list of str, optional
+        List of strings listing the clinical scales having a positive correlation with symptoms of the disease; 
+        i.e increasing when a patient gets better.
+    
+    pre_post_correlation: float, default = 0.5
+        Pearson correlation of the pre-test and post-test values (i.e the pooled within-groups Pearson correlation).
+
+    tau2_method: str, default = 'DL'
+        Estimator of the between studies variance (Tau²), see ``run_meta_analysis``.
+
+    return_result: bool, default = False
+        If True, the results are returned in a ``MetaAnalysisResult`` storing them in arrays.
+
+    diagnostics: str or Diagnostics, default = 'warn'
+        What to do with the corrections and numerical issues met during the meta-analyses, see ``run_meta_analysis``.
+
+    Returns
+    -------
+    df_results_per_study: pandas.DataFrame 
+        Results per study, in the order of ``df``.
+        Columns correspond to the effect size of the study, its standard error, its 95% confidence interval,
+        and the weight of the study inside its meta-analysis.
+
+    df_results: pandas.DataFrame
+        Global results, one row per meta-analysis indexed by ``group_by``.
+        Columns are the ones of the global results of ``run_meta_analysis`` and the number of studies.
+
+    result: MetaAnalysisResult
+        Results per study and global results, returned instead of the two previous dataframes if ``return_result=True``.
+
+    """
+
+    # Index of the meta-analysis of each study
+    grouped = df.groupby(group_by, sort=True, dropna=False)
+    groups = grouped.ngroup().to_numpy()
+    keys = grouped.size().index
+
+    # Effect sizes and their standard errors
+    recorded = Diagnostics()
+    n_treatment, n_control, effect_size = _effect_sizes_from_dataframe(df, scale_to_reverse, recorded)
+    standard_error_ES = _standard_error_effect_size(n_treatment, n_control, effect_size, pre_post_correlation, recorded)
+
+    # Pooling of all the meta-analyses at once
+    pooling = _random_effects_pooling(effect_size, standard_error_ES**2, groups, len(keys), tau2_method,
+                                      diagnostics=recorded)
+    recorded.report(diagnostics)
+
+    if return_result:
+        year = df['year'] if 'year' in df.columns else np.full(len(effect_size), np.nan)
+        return _meta_analysis_result(df.index, year, effect_size, standard_error_ES, pooling['percentage_weight'], groups, 
+                                     keys, pooling['Q'], pooling['p-value Heterogeneity'], pooling['Tau2'], 
+                                     pooling['Summary Effect'], pooling['Variance Summary Effect'], pooling['Heterogeneity'],
+                                     recorded)
+
+    df_results = _results_dataframe(pooling['Q'], pooling['p-value Heterogeneity'], pooling['Tau2'], 
+                                    pooling['Summary Effect'], pooling['Variance Summary Effect'], 
+                                    pooling['Heterogeneity'], keys)
+    df_results['Number of studies'] = pooling['k']
+
+    df_results_per_study = pd.DataFrame({'Effect size': effect_size,
+                                         'Standard Error of the ES': standard_error_ES,
+                                         '95% Confidence interval of the ES': list(zip(effect_size - 1.96*standard_error_ES,
+                                                                                       effect_size + 1.96*standard_error_ES)),
+                                         'Weight': pooling['percentage_weight']},
+                                         index=df.index)
+    if 'year' in df.columns:
+        df_results_per_study.insert(0, 'Year', df['year'])
+    for name in np.atleast_1d(group_by)[::-1]:
+        if name in df.columns:
+            df_results_per_study.insert(0, name, df[name])
+
+    return df_results_per_study, df_results
+
 if __name__ == '__main__':
     meta_analysis('values_total_meta_analysis.csv', 'Parents') 
 
 
-def forest_plot(df_results_per_study, df_results):
+def forest_plot(df_results_per_study, df_results=None):
     """Creates a forest plot.
     
     Parameters
     ----------
-    df_results_per_study: pandas.DataFrame
+    df_results_per_study: pandas.DataFrame or MetaAnalysisResult
         Results per study.
         Dataframe obtained after performing the meta-analysis with ``run_meta_analysis``.
         Rows of the dataframe correspond to the studies, columns correspond to the effect size of the study, its standard 
         error, its 95% confidence interval, and the weight of the study.
+        If it is a ``MetaAnalysisResult``, it also contains the global results and ``df_results`` is not used.
 
-    df_results: pandas.DataFrame
+    df_results: pandas.DataFrame, optional
         Global results.
         It contains the summary effect, its 95% confidence interval, its variance, its standard error, its p-value, 
         the between studies variance (Tau²), the heterogeneity (I²), its p-value, and the Chi2 value.
@@ -300,55 +861,12 @@ def forest_plot(df_results_per_study, df_results):
         
     """
 
-    # Sort data so that studies with bigger effect size are in the top of the forest plot
-    df_results_per_study = df_results_per_study.sort_values(df_results_per_study.columns[1], ascending=[True])
-    
-    # Conversion to lists for the plotting
-    ES = df_results_per_study['Effect size'].tolist()
-    weight = df_results_per_study['Weight'].tolist()
-    names = df_results_per_study.index.tolist()
-    names = [i[0] for i in names]
-
-    # Preparing for the plotting
-    ## Confidence Interval
-    lower_limit = []
-    upper_limit = []
-    for confidence_interval in df_results_per_study['95% Confidence interval of the ES']:
-        lower_limit.append(confidence_interval[0])
-        upper_limit.append(confidence_interval[1])
-    lower_limit_summary = df_results['95% Confidence Interval of the Summary Effect'][0][0]
-    upper_limit_summary = df_results['95% Confidence Interval of the Summary Effect'][0][1]
-    
-    # Add the confidence interval of the summary effect to others
-    lower_limit.extend([lower_limit_summary])
-    lower_limit.reverse() # the summary effect must be at the bottom
-    upper_limit.extend([upper_limit_summary]) 
-    upper_limit.reverse()
-    
-    # Add the summary effect at the other effects size
-    names.append('Summary Effect')
-    names.reverse()
-    ES.extend(df_results['Summary Effect'])
-    ES.reverse()  
-    
-    # Make the effect size representation more visible (squares are bigger)
-    weight = [i * 5 for i in weight]
+    plt = _import_matplotlib()
 
-    # Graphic
-    y = np.array(range(1,len(names)+1))
+    # Sort data so that studies with smaller effect size are in the top of the forest plot, 
+    # confidence intervals and effect sizes of all the studies are drawn at once
     forest_plot = plt.figure()
-    plt.yticks(y, names)
-    # Vertical line in zero
-    plt.axvline(0, color = 'k')   
-    # Plot Confidence Interval
-    for i in range(0,len(names)): 
-        plt.plot([lower_limit[i], upper_limit[i]], [y[i],y[i]], color = 'g')
-    # Plot effect sizes
-    plt.scatter(ES[1:len(names)], y[1:len(names)], s=weight[1:len(names)],
-                marker = 's', color = 'b')
-    plt.scatter(ES[0], y[0], s=100, marker = 'D', color = 'b')
-    plt.xlabel('Effect size')
-    plt.title('Standard Mean Difference, 95% Confidence Interval', fontweight = "bold")
-    
-    return forest_plot 
+    _draw_forest_plot(forest_plot, *_forest_plot_data(df_results_per_study, df_results))
+    forest_plot.tight_layout()
 
+    return forest_plot
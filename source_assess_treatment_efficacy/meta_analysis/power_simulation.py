@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: power_simulation
+    :synopsis: module estimating by Monte Carlo simulations the power and the coverage of a future meta-analysis
+
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+"""
+
+import itertools
+import warnings
+import numpy as np
+import pandas as pd
+
+from .perform_meta_analysis import (_effect_size_ppc, _standard_error_effect_size, _random_effects_pooling,
+                                    _summary_effect_inference)
+from .resampling import _map_in_processes
+
+
+def _simulation_shard(n_studies, n_treatment, n_control, effect_size, Tau2, pre_post_correlation, alpha, tau2_method,
+                      n_replicates, seed):
+    """Simulates meta-analyses of pre-test/post-test control group studies and pools them as ``run_meta_analysis``.
+
+    Parameters
+    ----------
+    n_studies: int
+        Number of studies of each meta-analysis.
+
+    n_treatment, n_control: int
+        Number of patients included in the treatment and control groups of each study.
+
+    effect_size: float
+        True summary effect, a negative value is in favor of the treatment.
+
+    Tau2: float
+        True between studies variance.
+
+    pre_post_correlation: float
+        True Pearson correlation of the pre-test and post-test values, also used to compute the standard errors.
+
+    alpha: float
+        Significance level of the test of the summary effect.
+
+    tau2_method: str
+        Estimator of Tau².
+
+    n_replicates: int
+        Number of simulated meta-analyses.
+
+    seed: numpy.random.SeedSequence
+        Seed of the random generator.
+
+    Returns
+    -------
+    replicates: numpy.ndarray
+        Rejection of the null hypothesis, coverage of the true effect by the 95% confidence interval, summary effect
+        and Tau² (in columns) of each simulated meta-analysis (in rows).
+
+    """
+
+    random_generator = np.random.default_rng(seed)
+    shape = (n_replicates, n_studies)
+
+    # True effect of each study, the scores have a standard deviation of 1 so it is the mean change of the treatment
+    # group relative to the control group
+    study_effect = effect_size + np.sqrt(Tau2)*random_generator.standard_normal(shape)
+
+    def summary_statistics(n_patients, mean_change):
+        # Means of bivariate normal pre-test and post-test scores, and standard deviation of the pre-test scores
+        mean_pre_test = random_generator.standard_normal(shape)/np.sqrt(n_patients)
+        mean_post_test = (mean_change + pre_post_correlation*mean_pre_test
+                          + np.sqrt(1 - pre_post_correlation**2)*random_generator.standard_normal(shape)/np.sqrt(n_patients))
+        std_pre_test = np.sqrt(random_generator.chisquare(n_patients - 1, shape)/(n_patients - 1))
+        return mean_pre_test, mean_post_test, std_pre_test
+
+    mean_pre_test_treatment, mean_post_test_treatment, std_pre_test_treatment = summary_statistics(n_treatment, study_effect)
+    mean_pre_test_control, mean_post_test_control, std_pre_test_control = summary_statistics(n_control, 0.)
+
+    # Effect sizes, standard errors and pooling of all the replicates at once, as in run_meta_analysis
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        simulated_ES = _effect_size_ppc(n_treatment, n_control, mean_post_test_treatment, mean_pre_test_treatment,
+                                        mean_pre_test_control, mean_post_test_control, std_pre_test_treatment,
+                                        std_pre_test_control)
+        standard_error_ES = _standard_error_effect_size(n_treatment, n_control, simulated_ES, pre_post_correlation)
+    groups = np.repeat(np.arange(n_replicates), n_studies)
+    pooling = _random_effects_pooling(simulated_ES.ravel(), standard_error_ES.ravel()**2, groups, n_replicates,
+                                      tau2_method)
+    _, lower_limit, upper_limit, p_value = _summary_effect_inference(pooling['Summary Effect'],
+                                                                     pooling['Variance Summary Effect'])
+
+    return np.column_stack([p_value < alpha, (lower_limit <= effect_size) & (effect_size <= upper_limit),
+                            pooling['Summary Effect'], pooling['Tau2']])
+
+
+def run_power_simulation(n_studies, n_treatment, effect_size, Tau2=0., n_control=None, pre_post_correlation=0.5,
+                         alpha=0.05, n_simulations=1000, random_state=None, n_jobs=1, shard_size=1000, tau2_method='DL'):
+    """Estimates the power of the test of the summary effect and the coverage of its 95% confidence interval for a grid
+    of designs of meta-analyses.
+
+    For each combination of the parameters, studies with a pre-test/post-test control group design are simulated:
+    the true effect of each study is drawn around ``effect_size`` with a variance ``Tau2``, then the means and
+    standard deviations of the scores (standard deviation of 1, correlation ``pre_post_correlation`` between pre-test
+    and post-test) of each group. Effect sizes, standard errors and pooled results are computed with the functions of
+    ``run_meta_analysis``, for all the replicates at once. Replicates are split in shards, each with its own random
+    generator, computed serially or in a pool of processes.
+
+    Parameters
+    ----------
+    n_studies: int or list of int
+        Number of studies of the meta-analysis.
+
+    n_treatment: int or list of int
+        Number of patients included in the treatment group of each study.
+
+    effect_size: float or list of float
+        True summary effect, a negative value is in favor of the treatment.
+
+    Tau2: float or list of float, default = 0
+        True between studies variance.
+
+    n_control: int or list of int, optional
+        Number of patients included in the control group of each study. By default, the same as ``n_treatment``.
+
+    pre_post_correlation: float or list of float, default = 0.5
+        Pearson correlation of the pre-test and post-test values.
+
+    alpha: float, default = 0.05
+        Significance level of the test of the summary effect.
+
+    n_simulations: int, default = 1000
+        Number of simulated meta-analyses for each combination of the parameters.
+
+    random_state: int, optional
+        Seed making the simulations reproducible, whatever the number of processes.
+
+    n_jobs: int, default = 1
+        Number of processes sharing the simulations.
+
+    shard_size: int, default = 1000
+        Number of simulations computed at once by a process.
+
+    tau2_method: str, default = 'DL'
+        Estimator of the between studies variance (Tau²), see ``run_meta_analysis``.
+
+    Returns
+    -------
+    df_power: pandas.DataFrame
+        One row per combination of the parameters (in the index), with the power, the coverage, their Monte Carlo
+        standard errors, and the means of the summary effect and of Tau².
+        A surface is obtained by unstacking the index, e.g. ``df_power['Power'].unstack('Tau2')``.
+
+    Examples
+    --------
+    >>> df_power = run_power_simulation(n_studies=[5, 10, 20], n_treatment=[20, 40], effect_size=-0.3, Tau2=[0, 0.05],
+    ...                                 random_state=0, n_jobs=4)
+
+    """
+
+    parameters = {'n_studies': n_studies, 'n_treatment': n_treatment, 'n_control': n_control,
+                  'effect_size': effect_size, 'Tau2': Tau2, 'pre_post_correlation': pre_post_correlation}
+    grid = list(itertools.product(*[np.atleast_1d(values).tolist() for values in parameters.values()]))
+    # Without n_control, both groups of each design have the same size
+    if n_control is None:
+        grid = [(k, n_t, n_t) + tuple(point) for k, n_t, _, *point in grid]
+
+    # One seed per combination and per shard, so that the results depend neither on the number of processes nor on the
+    # other combinations of the grid
+    shard_sizes = [min(shard_size, n_simulations - start) for start in range(0, n_simulations, shard_size)]
+    seeds = np.random.SeedSequence(random_state).spawn(len(grid))
+    arguments = [(int(k), n_t, n_c, delta, tau2, correlation, alpha, tau2_method, size, seed)
+                 for (k, n_t, n_c, delta, tau2, correlation), point_seed in zip(grid, seeds)
+                 for size, seed in zip(shard_sizes, point_seed.spawn(len(shard_sizes)))]
+    shards = _map_in_processes(_simulation_shard, arguments, n_jobs)
+
+    replicates = np.stack([np.concatenate(shards[i:i + len(shard_sizes)]) for i in range(0, len(shards), len(shard_sizes))])
+    power = replicates[:, :, 0].mean(axis=1)
+    coverage = replicates[:, :, 1].mean(axis=1)
+
+    df_power = pd.DataFrame({'Power': power,
+                             'Monte Carlo Standard Error of the Power': np.sqrt(power*(1 - power)/n_simulations),
+                             'Coverage': coverage,
+                             'Monte Carlo Standard Error of the Coverage': np.sqrt(coverage*(1 - coverage)/n_simulations),
+                             'Mean Summary Effect': replicates[:, :, 2].mean(axis=1),
+                             'Mean Tau2': replicates[:, :, 3].mean(axis=1)},
+                             index=pd.MultiIndex.from_tuples(grid, names=list(parameters)))
+
+    return df_power
@@ -0,0 +1,385 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: publication_bias
+    :synopsis: module assessing small-study effects and publication bias of one or several meta-analyses
+
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+"""
+
+import warnings
+import numpy as np
+import pandas as pd
+
+from .forest_plot_renderer import _import_matplotlib
+from .meta_analysis_result import MetaAnalysisResult
+from .perform_meta_analysis import _random_effects_pooling, _results_dataframe
+
+
+def _per_study_arrays(df_results_per_study, group_by=None):
+    """Extracts the effect sizes, their variances and the meta-analysis of each study.
+
+    Parameters
+    ----------
+    df_results_per_study: pandas.DataFrame or MetaAnalysisResult
+        Results per study, obtained with ``run_meta_analysis`` or ``run_batched_meta_analysis``.
+
+    group_by: str or list of str, optional
+        Columns or index levels identifying the meta-analysis of each study, as in ``run_batched_meta_analysis``.
+        Not used if ``df_results_per_study`` is a ``MetaAnalysisResult``.
+
+    Returns
+    -------
+    effect_size, variance_ES: numpy.ndarray
+        Effect size of each study and its variance.
+
+    groups: numpy.ndarray of int
+        Index of the meta-analysis each study belongs to.
+
+    keys: pandas.Index
+        Label of each meta-analysis.
+
+    """
+
+    if isinstance(df_results_per_study, MetaAnalysisResult):
+        return (df_results_per_study.effect_size, df_results_per_study.standard_error_ES**2,
+                df_results_per_study.groups, df_results_per_study.results_index)
+
+    effect_size = df_results_per_study['Effect size'].to_numpy(dtype=float)
+    variance_ES = df_results_per_study['Standard Error of the ES'].to_numpy(dtype=float)**2
+    if group_by is None:
+        return effect_size, variance_ES, np.zeros(len(effect_size), dtype=int), pd.Index(['Results'])
+
+    grouped = df_results_per_study.groupby(group_by, sort=True, dropna=False)
+
+    return effect_size, variance_ES, grouped.ngroup().to_numpy(), grouped.size().index
+
+
+def _egger_regression(effect_size, variance_ES, groups, n_groups):
+    """Regression of the standardized effect sizes on the precisions of the studies, for all the meta-analyses at once.
+
+    Returns
+    -------
+    k, intercept, standard_error_intercept, slope: numpy.ndarray
+        Number of studies, intercept and its standard error, and slope of each meta-analysis.
+
+    """
+
+    def group_sum(values):
+        return np.bincount(groups, weights=values, minlength=n_groups)
+
+    standard_error_ES = np.sqrt(variance_ES)
+    precision = 1/standard_error_ES
+    standardized_ES = effect_size/standard_error_ES
+
+    # Ordinary least squares on the deviations from the means of each meta-analysis
+    k = np.bincount(groups, minlength=n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_precision = group_sum(precision)/k
+        mean_standardized_ES = group_sum(standardized_ES)/k
+        deviation_precision = precision - mean_precision[groups]
+        deviation_standardized_ES = standardized_ES - mean_standardized_ES[groups]
+        sum_squares_precision = group_sum(deviation_precision**2)
+        slope = group_sum(deviation_precision*deviation_standardized_ES)/sum_squares_precision
+        intercept = mean_standardized_ES - slope*mean_precision
+        residual_variance = group_sum((deviation_standardized_ES - slope[groups]*deviation_precision)**2)/(k - 2)
+        standard_error_intercept = np.sqrt(residual_variance*(1/k + mean_precision**2/sum_squares_precision))
+
+    return k, intercept, standard_error_intercept, slope
+
+
+def run_egger_test(df_results_per_study, group_by=None):
+    """Performs Egger's regression test of funnel plot asymmetry for one or several meta-analyses.
+
+    The standardized effect sizes (effect size/standard error) are regressed on the precisions (1/standard error), an
+    intercept different from 0 indicates small-study effects.
+
+    Parameters
+    ----------
+    df_results_per_study: pandas.DataFrame or MetaAnalysisResult
+        Results per study, obtained with ``run_meta_analysis`` or ``run_batched_meta_analysis``.
+
+    group_by: str or list of str, optional
+        Columns or index levels identifying the meta-analysis of each study, as in ``run_batched_meta_analysis``.
+        By default, all the studies belong to the same meta-analysis.
+
+    Returns
+    -------
+    df_egger: pandas.DataFrame
+        One row per meta-analysis, with the intercept, its standard error, the t statistic, its p-value (Student
+        distribution with k - 2 degrees of freedom), the slope and the number of studies.
+        Meta-analyses with fewer than 3 studies get NaN values.
+
+    """
+
+    import scipy.stats as scp
+
+    effect_size, variance_ES, groups, keys = _per_study_arrays(df_results_per_study, group_by)
+    k, intercept, standard_error_intercept, slope = _egger_regression(effect_size, variance_ES, groups, len(keys))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = np.where(k > 2, intercept/standard_error_intercept, np.nan)
+        p_value = 2*scp.t.sf(np.abs(t), k - 2)
+
+    df_egger = pd.DataFrame({'Intercept': np.where(k > 2, intercept, np.nan),
+                             'Standard Error of the Intercept': np.where(k > 2, standard_error_intercept, np.nan),
+                             't': t,
+                             'p-value': p_value,
+                             'Slope': np.where(k > 2, slope, np.nan),
+                             'Number of studies': k},
+                             index=keys)
+
+    return df_egger
+
+
+def _pairs_within_groups(groups):
+    """Indices (i, j), i < j, of all the pairs of studies belonging to the same meta-analysis, the studies being sorted
+    by meta-analysis."""
+
+    # Last position (excluded) of the meta-analysis of each study
+    end = np.cumsum(np.bincount(groups))[groups]
+    n_pairs = end - np.arange(len(groups)) - 1
+    first = np.repeat(np.arange(len(groups)), n_pairs)
+    offsets = np.arange(n_pairs.sum()) - np.repeat(np.cumsum(n_pairs) - n_pairs, n_pairs)
+
+    return first, first + 1 + offsets
+
+
+def run_begg_test(df_results_per_study, group_by=None):
+    """Performs Begg and Mazumdar's rank correlation test of funnel plot asymmetry for one or several meta-analyses.
+
+    Kendall's tau is computed between the standardized deviations of the effect sizes from the fixed effect summary
+    effect and the variances of the effect sizes. All the pairs of studies of all the meta-analyses are compared at once.
+
+    Parameters
+    ----------
+    df_results_per_study: pandas.DataFrame or MetaAnalysisResult
+        Results per study, obtained with ``run_meta_analysis`` or ``run_batched_meta_analysis``.
+
+    group_by: str or list of str, optional
+        Columns or index levels identifying the meta-analysis of each study, as in ``run_batched_meta_analysis``.
+        By default, all the studies belong to the same meta-analysis.
+
+    Returns
+    -------
+    df_begg: pandas.DataFrame
+        One row per meta-analysis, with Kendall's tau, the z statistic (normal approximation, without correction for
+        ties), its p-value and the number of studies.
+
+    """
+
+    import scipy.stats as scp
+
+    effect_size, variance_ES, groups, keys = _per_study_arrays(df_results_per_study, group_by)
+    n_groups = len(keys)
+    order = np.argsort(groups, kind='stable')
+    effect_size, variance_ES, groups = effect_size[order], variance_ES[order], groups[order]
+
+    # Standardized deviations from the fixed effect summary effect
+    weight = 1/variance_ES
+    sum_weights = np.bincount(groups, weights=weight, minlength=n_groups)
+    summary_effect = np.bincount(groups, weights=weight*effect_size, minlength=n_groups)/sum_weights
+    standardized_deviation = (effect_size - summary_effect[groups])/np.sqrt(variance_ES - 1/sum_weights[groups])
+
+    # Concordant minus discordant pairs
+    first, second = _pairs_within_groups(groups)
+    concordance = (np.sign(standardized_deviation[first] - standardized_deviation[second])
+                   *np.sign(variance_ES[first] - variance_ES[second]))
+    score = np.bincount(groups[first], weights=concordance, minlength=n_groups)
+
+    k = np.bincount(groups, minlength=n_groups)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tau = score/(k*(k - 1)/2)
+        z = score/np.sqrt(k*(k - 1)*(2*k + 5)/18)
+    p_value = 2*scp.norm.sf(np.abs(z))
+
+    df_begg = pd.DataFrame({"Kendall's tau": tau,
+                            'z': z,
+                            'p-value': p_value,
+                            'Number of studies': k},
+                            index=keys)
+
+    return df_begg
+
+
+def run_trim_and_fill(df_results_per_study, group_by=None, side=None, estimator='L0', tau2_method='DL',
+                      max_iterations=100):
+    """Performs Duval and Tweedie's trim and fill method for one or several meta-analyses.
+
+    The most extreme studies of the side opposite to the missing studies are trimmed until the number of missing studies
+    estimated from the ranks of the deviations to the summary effect is stable. The trimmed studies are then mirrored
+    around the summary effect of the remaining studies and the random effects model is fitted on all the studies.
+
+    The effect sizes are sorted once; at each iteration the ranks of the absolute deviations are obtained by merging
+    the negative and positive deviations, which are already sorted, so nothing is sorted again. All the meta-analyses
+    are iterated at once.
+
+    Parameters
+    ----------
+    df_results_per_study: pandas.DataFrame or MetaAnalysisResult
+        Results per study, obtained with ``run_meta_analysis`` or ``run_batched_meta_analysis``.
+
+    group_by: str or list of str, optional
+        Columns or index levels identifying the meta-analysis of each study, as in ``run_batched_meta_analysis``.
+        By default, all the studies belong to the same meta-analysis.
+
+    side: str, optional
+        'left' or 'right', side of the funnel plot where studies are missing. By default, it is estimated for each
+        meta-analysis from the sign of the intercept of Egger's test: a positive intercept means that small studies
+        have larger effect sizes, so studies are missing on the left.
+
+    estimator: str, default = 'L0'
+        Estimator of the number of missing studies: 'L0' or 'R0'.
+
+    tau2_method: str, default = 'DL'
+        Estimator of the between studies variance (Tau²), see ``run_meta_analysis``.
+
+    max_iterations: int, default = 100
+        Maximum number of trimming iterations.
+
+    Returns
+    -------
+    df_results: pandas.DataFrame
+        Global results after filling, one row per meta-analysis.
+        Columns are the ones of the global results of ``run_meta_analysis``, the side and the number of missing studies.
+
+    df_filled_studies: pandas.DataFrame
+        Studies added by the method, with the label of their meta-analysis, their effect size and its standard error.
+
+    """
+
+    if estimator not in ['L0', 'R0']:
+        raise ValueError("estimator must be 'L0' or 'R0', got %r" % estimator)
+
+    effect_size, variance_ES, groups, keys = _per_study_arrays(df_results_per_study, group_by)
+    n_groups = len(keys)
+    k = np.bincount(groups, minlength=n_groups)
+
+    # Missing studies on the left: the largest effect sizes are trimmed. For the right side, the effect sizes are
+    # negated so that the largest ones are always trimmed.
+    if side is None:
+        _, intercept, _, _ = _egger_regression(effect_size, variance_ES, groups, n_groups)
+        sign = np.where(intercept < 0, -1., 1.)
+    elif side in ['left', 'right']:
+        sign = np.full(n_groups, 1. if side == 'left' else -1.)
+    else:
+        raise ValueError("side must be 'left', 'right' or None, got %r" % side)
+
+    # Studies sorted by meta-analysis and by effect size, once
+    oriented_ES = sign[groups]*effect_size
+    order = np.lexsort((oriented_ES, groups))
+    oriented_ES, variance_ES, groups = oriented_ES[order], variance_ES[order], groups[order]
+    end = np.cumsum(k)
+    start = end - k
+    # Position of each study from the largest effect size of its meta-analysis
+    position_from_end = end[groups] - 1 - np.arange(len(groups))
+
+    # Sorting keys of the deviations: meta-analyses are separated by more than the range of the deviations
+    spacing = 2*(np.ptp(oriented_ES) + 1) if len(oriented_ES) else 1.
+    group_offsets = spacing*np.arange(n_groups)
+    offsets = group_offsets[groups]
+
+    n_missing = np.zeros(n_groups, dtype=int)
+    for iteration in range(max_iterations):
+        # Summary effect of the studies that are not trimmed
+        kept = position_from_end >= n_missing[groups]
+        summary_effect = _random_effects_pooling(oriented_ES[kept], variance_ES[kept], groups[kept], n_groups,
+                                                 tau2_method)['Summary Effect']
+
+        # Deviations, sorted within each meta-analysis since the effect sizes are
+        deviation = oriented_ES - summary_effect[groups]
+        sorted_keys = offsets + deviation
+        positive = deviation > 0
+        # Studies with a deviation lower or equal to 0 in each meta-analysis
+        n_non_positive = np.searchsorted(sorted_keys, group_offsets, side='right') - start
+
+        if estimator == 'L0':
+            # Rank of each positive deviation among the absolute deviations: its rank among the positive deviations,
+            # plus the number of non positive deviations of smaller absolute value
+            smaller_non_positive = (start[groups] + n_non_positive[groups]
+                                    - np.searchsorted(sorted_keys, offsets - deviation, side='right'))
+            rank = np.arange(len(groups)) - (start + n_non_positive)[groups] + 1 + smaller_non_positive
+            sum_positive_ranks = np.bincount(groups, weights=np.where(positive, rank, 0), minlength=n_groups)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                estimate = (4*sum_positive_ranks - k*(k + 1))/(2*k - 1)
+        else:
+            # Number of positive deviations larger than the largest absolute non positive deviation
+            largest_non_positive = np.where(n_non_positive > 0, -deviation[np.minimum(start, len(groups) - 1)], 0)
+            run = end - np.searchsorted(sorted_keys, group_offsets + largest_non_positive, side='right')
+            estimate = run - 1.
+
+        new_n_missing = np.clip(np.round(np.nan_to_num(estimate)), 0, np.maximum(k - 2, 0)).astype(int)
+        if np.array_equal(new_n_missing, n_missing):
+            break
+        n_missing = new_n_missing
+    else:
+        warnings.warn('Trim and fill did not converge after %d iterations' % max_iterations)
+
+    # Filling: the trimmed studies are mirrored around the summary effect of the other studies
+    trimmed = position_from_end < n_missing[groups]
+    filled_ES = 2*summary_effect[groups[trimmed]] - oriented_ES[trimmed]
+    filled_groups = groups[trimmed]
+    all_groups = np.r_[groups, filled_groups]
+    pooling = _random_effects_pooling(np.r_[oriented_ES, filled_ES], np.r_[variance_ES, variance_ES[trimmed]],
+                                      all_groups, n_groups, tau2_method)
+
+    df_results = _results_dataframe(pooling['Q'], pooling['p-value Heterogeneity'], pooling['Tau2'],
+                                    sign*pooling['Summary Effect'], pooling['Variance Summary Effect'],
+                                    pooling['Heterogeneity'], keys)
+    df_results['Number of studies'] = pooling['k']
+    df_results['Side'] = np.where(sign > 0, 'left', 'right')
+    df_results['Number of missing studies'] = n_missing
+
+    df_filled_studies = pd.DataFrame({'Effect size': sign[filled_groups]*filled_ES,
+                                      'Standard Error of the ES': np.sqrt(variance_ES[trimmed])},
+                                      index=keys[filled_groups])
+
+    return df_results, df_filled_studies
+
+
+def funnel_plot(df_results_per_study, df_results, df_filled_studies=None):
+    """Creates a funnel plot: effect size of each study against its standard error.
+
+    Parameters
+    ----------
+    df_results_per_study: pandas.DataFrame or MetaAnalysisResult
+        Results per study of one meta-analysis, obtained with ``run_meta_analysis``.
+
+    df_results: pandas.DataFrame
+        Global results, obtained with ``run_meta_analysis`` or ``run_trim_and_fill``.
+        The vertical line and the pseudo 95% confidence region are centered on its summary effect.
+
+    df_filled_studies: pandas.DataFrame, optional
+        Studies added by ``run_trim_and_fill``, represented with empty circles.
+
+    Returns
+    -------
+    funnel_plot: matplotlib.figure.Figure
+        Graphical representation of the small-study effects. The figure is drawn without pyplot, so that it can be
+        created in worker processes and without display, and saved with its ``savefig`` method.
+
+    """
+
+    Figure = _import_matplotlib('matplotlib.figure').Figure
+
+    effect_size, variance_ES, _, _ = _per_study_arrays(df_results_per_study)
+    standard_error_ES = np.sqrt(variance_ES)
+    summary_effect = df_results['Summary Effect'].iloc[0]
+
+    funnel_plot = Figure()
+    ax = funnel_plot.add_subplot(1, 1, 1)
+    # Pseudo 95% confidence region
+    largest_standard_error = standard_error_ES.max()*1.05
+    ax.plot([summary_effect - 1.96*largest_standard_error, summary_effect, summary_effect + 1.96*largest_standard_error],
+            [largest_standard_error, 0, largest_standard_error], color='k', linestyle='--', linewidth=0.8)
+    ax.axvline(summary_effect, color='k')
+    ax.scatter(effect_size, standard_error_ES, color='b')
+    if df_filled_studies is not None:
+        ax.scatter(df_filled_studies['Effect size'], df_filled_studies['Standard Error of the ES'],
+                   facecolors='none', edgecolors='b')
+    ax.set_ylim(largest_standard_error, 0)
+    ax.set_xlabel('Effect size')
+    ax.set_ylabel('Standard Error of the ES')
+    ax.set_title('Funnel plot', fontweight='bold')
+
+    return funnel_plot
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: resampling
+    :synopsis: module performing resampling methods on the results of a meta-analysis
+ 
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+"""
+
+import warnings
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
+from ..diagnostics import Diagnostics
+from .perform_meta_analysis import _effect_sizes_from_dataframe, _standard_error_effect_size, _random_effects_pooling
+
+
+def _map_in_processes(function, arguments, n_jobs):
+    """Calls a function on each tuple of arguments, serially or in a pool of processes.
+
+    Parameters
+    ----------
+    function: callable
+        Function called as ``function(*argument)`` for each argument.
+
+    arguments: list of tuple
+        Arguments of each call.
+
+    n_jobs: int
+        Number of processes, 1 to call the function in the current process.
+
+    Returns
+    -------
+    results: list
+        Result of each call, in the order of ``arguments``.
+
+    """
+
+    if n_jobs == 1:
+        return [function(*argument) for argument in arguments]
+
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(function, *zip(*arguments)))
+
+
+def _run_in_shards(function, n_replicates, shard_size, random_state, n_jobs, *args):
+    """Splits replicates in shards of fixed size, each one with its own random generator, and runs them serially or 
+    in a pool of processes. 
+    
+    The seed of each shard is derived from ``random_state`` and from the position of the shard, so the results do not 
+    depend on the number of processes.
+
+    Parameters
+    ----------
+    function: callable
+        Function computing a shard: ``function(*args, n_replicates_of_the_shard, seed)`` returns an array whose first 
+        dimension corresponds to the replicates.
+
+    n_replicates: int
+        Total number of replicates.
+
+    shard_size: int
+        Number of replicates per shard.
+
+    random_state: int or None
+        Seed of the whole computation.
+
+    n_jobs: int
+        Number of processes, 1 to run the shards in the current process.
+
+    Returns
+    -------
+    replicates: numpy.ndarray
+        Concatenation of the results of all the shards.
+
+    """
+
+    shard_sizes = [min(shard_size, n_replicates - start) for start in range(0, n_replicates, shard_size)]
+    seeds = np.random.SeedSequence(random_state).spawn(len(shard_sizes))
+    arguments = [args + (size, seed) for size, seed in zip(shard_sizes, seeds)]
+
+    return np.concatenate(_map_in_processes(function, arguments, n_jobs))
+
+
+def _bootstrap_shard(effect_size, variance_ES, method, summary_effect, Tau2, tau2_method, n_replicates, seed):
+    """Computes the summary effect, Tau² and I² of bootstrap replicates of a meta-analysis.
+
+    Parameters
+    ----------
+    effect_size: numpy.ndarray
+        Effect size of each study.
+
+    variance_ES: numpy.ndarray
+        Variance of the effect size of each study.
+
+    method: str, 'nonparametric' or 'parametric'
+        Resampling of the studies or simulation of new effect sizes.
+
+    summary_effect: float
+        Summary effect of the meta-analysis, used by the parametric bootstrap.
+
+    Tau2: float
+        Between studies variance of the meta-analysis, used by the parametric bootstrap.
+
+    tau2_method: str
+        Estimator of Tau² of the replicates.
+
+    n_replicates: int
+        Number of replicates.
+
+    seed: numpy.random.SeedSequence
+        Seed of the random generator.
+
+    Returns
+    -------
+    replicates: numpy.ndarray
+        Summary effect, Tau² and I² (in columns) of each replicate (in rows).
+
+    """
+
+    random_generator = np.random.default_rng(seed)
+    n_studies = len(effect_size)
+
+    if method == 'nonparametric':
+        # Studies drawn with replacement
+        indices = random_generator.integers(0, n_studies, size=(n_replicates, n_studies))
+        effect_size_replicates = effect_size[indices]
+        variance_ES_replicates = variance_ES[indices]
+    else:
+        # Effect sizes drawn from the fitted random effects model
+        variance_ES_replicates = np.broadcast_to(variance_ES, (n_replicates, n_studies))
+        effect_size_replicates = summary_effect + np.sqrt(variance_ES + Tau2)*random_generator.standard_normal((n_replicates, n_studies))
+
+    # All the replicates pooled at once
+    groups = np.repeat(np.arange(n_replicates), n_studies)
+    pooling = _random_effects_pooling(effect_size_replicates.ravel(), variance_ES_replicates.ravel(), groups, n_replicates, 
+                                      tau2_method)
+
+    return np.column_stack([pooling['Summary Effect'], pooling['Tau2'], pooling['Heterogeneity']])
+
+
+def run_bootstrap(df_results_per_study, df_results, n_bootstrap=1000, method='nonparametric', confidence_level=0.95, 
+                  random_state=None, n_jobs=1, shard_size=1000, tau2_method='DL'):
+    """Computes bootstrap confidence intervals of the summary effect, of the between studies variance (Tau²) and of 
+    the heterogeneity (I²) of a meta-analysis.
+
+    Parameters
+    ----------
+    df_results_per_study: pandas.DataFrame
+        Results per study.
+        Dataframe obtained after performing the meta-analysis with ``run_meta_analysis``.
+
+    df_results: pandas.DataFrame
+        Global results.
+        Dataframe obtained after performing the meta-analysis with ``run_meta_analysis``.
+
+    n_bootstrap: int, default = 1000
+        Number of bootstrap replicates.
+
+    method: str, default = 'nonparametric'
+        Either 'nonparametric', the studies are drawn with replacement, or 'parametric', new effect sizes are drawn
+        from a normal distribution centered on the summary effect with the variance of the study plus Tau².
+
+    confidence_level: float, default = 0.95
+        Confidence level of the percentile intervals.
+
+    random_state: int, optional
+        Seed making the replicates reproducible, whatever the number of processes.
+
+    n_jobs: int, default = 1
+        Number of processes sharing the replicates.
+
+    shard_size: int, default = 1000
+        Number of replicates computed at once by a process.
+
+    tau2_method: str, default = 'DL'
+        Estimator of the between studies variance (Tau²) of the replicates, it should be the one used to obtain ``df_results``
+        (see ``run_meta_analysis``).
+
+    Returns
+    -------
+    df_bootstrap: pandas.DataFrame
+        Estimate of the meta-analysis and bounds of the percentile confidence interval (in columns) of the summary effect,
+        Tau² and I² (in rows).
+
+    df_replicates: pandas.DataFrame
+        Summary effect, Tau² and I² (in columns) of each bootstrap replicate (in rows).
+
+    """
+
+    if method not in ['nonparametric', 'parametric']:
+        raise ValueError("method is either 'nonparametric' or 'parametric'")
+
+    effect_size = df_results_per_study['Effect size'].to_numpy(dtype=float)
+    variance_ES = df_results_per_study['Standard Error of the ES'].to_numpy(dtype=float)**2
+    statistics = ['Summary Effect', 'Tau2', 'Heterogeneity']
+    estimates = df_results[statistics].iloc[0].to_numpy(dtype=float)
+
+    replicates = _run_in_shards(_bootstrap_shard, n_bootstrap, shard_size, random_state, n_jobs,
+                                effect_size, variance_ES, method, estimates[0], estimates[1], tau2_method)
+
+    # Percentile confidence intervals (I² is not defined when all the replicated studies are identical)
+    alpha = 1 - confidence_level
+    lower_limit, upper_limit = np.nanpercentile(replicates, [100*alpha/2, 100*(1 - alpha/2)], axis=0)
+
+    df_bootstrap = pd.DataFrame({'Estimate': estimates,
+                                 'Lower limit': lower_limit,
+                                 'Upper limit': upper_limit},
+                                 index=statistics)
+    df_replicates = pd.DataFrame(replicates, columns=statistics)
+
+    return df_bootstrap, df_replicates
+
+
+def _heterogeneity_shard(n_treatment, n_control, variance_ES, summary_effect, pre_post_correlation, n_simulations, seed):
+    """Simulates Q statistics under the null hypothesis of a common effect size.
+
+    Parameters
+    ----------
+    n_treatment: numpy.ndarray
+        Number of patients included in the treatment group of each study.
+
+    n_control: numpy.ndarray
+        Number of patients included in the control group of each study.
+
+    variance_ES: numpy.ndarray
+        Variance of the effect size of each study.
+
+    summary_effect: float
+        Common effect size.
+
+    pre_post_correlation: float
+        Pearson correlation of the pre-test and post-test values.
+
+    n_simulations: int
+        Number of simulated meta-analyses.
+
+    seed: numpy.random.SeedSequence
+        Seed of the random generator.
+
+    Returns
+    -------
+    Q: numpy.ndarray
+        Q statistic of each simulated meta-analysis.
+
+    """
+
+    random_generator = np.random.default_rng(seed)
+
+    # Simulated effect sizes (simulations in rows, studies in columns), and their variances as estimated by each study
+    effect_size = summary_effect + np.sqrt(variance_ES)*random_generator.standard_normal((n_simulations, len(variance_ES)))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        weight_fixed_model = 1/_standard_error_effect_size(n_treatment, n_control, effect_size, pre_post_correlation)**2
+
+    # Q (Equation 12.3 of Borenstein (2009)) of all the simulations at once
+    Q = ((weight_fixed_model*effect_size**2).sum(axis=1) 
+         - (weight_fixed_model*effect_size).sum(axis=1)**2/weight_fixed_model.sum(axis=1))
+
+    return Q
+
+
+def run_heterogeneity_test(df, df_results, pre_post_correlation=0.5, n_simulations=10000, random_state=None, n_jobs=1, 
+                           shard_size=1000, scale_to_reverse=[]):
+    """Computes the p-value of the heterogeneity of a meta-analysis by Monte Carlo simulations of the Q statistic.
+
+    The p-value returned by ``run_meta_analysis`` relies on the chi-squared distribution of Q, which is unreliable with 
+    few studies, in particular because the variance of each effect size is estimated from the effect size itself. 
+    Here, effect sizes are simulated under the null hypothesis (all studies share the summary effect of the fixed effect 
+    model) from the variance of each study, their variances are estimated again, and the observed Q is compared 
+    to the simulated ones.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Dataframe given to ``run_meta_analysis``, the effect size of each study and its standard error are computed
+        again from its ratings.
+
+    df_results: pandas.DataFrame
+        Global results.
+        Dataframe obtained after performing the meta-analysis with ``run_meta_analysis``.
+
+    pre_post_correlation: float, default = 0.5
+        Pearson correlation of the pre-test and post-test values used by ``run_meta_analysis``.
+
+    n_simulations: int, default = 10000
+        Number of simulated meta-analyses.
+
+    random_state: int, optional
+        Seed making the simulations reproducible, whatever the number of processes.
+
+    n_jobs: int, default = 1
+        Number of processes sharing the simulations.
+
+    shard_size: int, default = 1000
+        Number of simulations computed at once by a process.
+
+    scale_to_reverse: list of str, optional
+        Clinical scales reversed by ``run_meta_analysis``.
+
+    Returns
+    -------
+    p_value: float
+        Monte Carlo p-value of the heterogeneity.
+
+    Q_simulations: numpy.ndarray
+        Q statistic of each simulated meta-analysis.
+
+    """
+
+    # Effect sizes and their variances as in run_meta_analysis, its corrections have already been reported
+    recorded = Diagnostics()
+    n_treatment, n_control, effect_size = _effect_sizes_from_dataframe(df, scale_to_reverse, recorded)
+    variance_ES = _standard_error_effect_size(n_treatment, n_control, effect_size, pre_post_correlation, recorded)**2
+    Q = float(df_results['Chi2'].iloc[0])
+
+    # Summary effect under the null hypothesis (fixed effect model, Equation 11.3 of Borenstein (2009))
+    weight_fixed_model = 1/variance_ES
+    summary_effect = (weight_fixed_model*effect_size).sum()/weight_fixed_model.sum()
+
+    Q_simulations = _run_in_shards(_heterogeneity_shard, n_simulations, shard_size, random_state, n_jobs, 
+                                   n_treatment, n_control, variance_ES, summary_effect, pre_post_correlation)
+
+    # The observed meta-analysis is counted among the simulations so that the p-value is never 0
+    p_value = (1 + np.sum(Q_simulations >= Q))/(n_simulations + 1)
+
+    return p_value, Q_simulations
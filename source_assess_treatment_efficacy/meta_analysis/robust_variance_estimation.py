@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: robust_variance_estimation
+    :synopsis: module pooling correlated effect sizes (several scales or raters per study) with robust variance estimation
+
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+"""
+
+import warnings
+import numpy as np
+import pandas as pd
+
+from .perform_meta_analysis import _effect_sizes_from_dataframe, _standard_error_effect_size
+from .meta_regression import _design_matrix
+
+
+def _cluster_sums(values, clusters, n_clusters):
+    """Sums the rows of a matrix over the studies of each cluster."""
+
+    return np.column_stack([np.bincount(clusters, weights=column, minlength=n_clusters) for column in values.T])
+
+
+def run_robust_meta_analysis(df, cluster=None, moderators=[], scale_to_reverse=[], pre_post_correlation=0.5, rho=0.8):
+    """Pools effect sizes that are correlated within studies (several scales, raters or time points per study) with the
+    correlated effects model and the robust variance estimation of Hedges, Tipton and Johnson (2010) "Robust variance
+    estimation in meta-regression with dependent effect size estimates", *Research Synthesis Methods*.
+
+    The effect sizes of a study share the weight 1/(k_j*(mean variance of the study + Tau²)), where k_j is the number
+    of effect sizes of the study. The standard errors come from the cluster sandwich estimator, with the small-sample
+    correction m/(m - p) (m clusters, p coefficients) and a Student distribution with m - p degrees of freedom. All
+    the sums over the studies are reductions over the clusters, no matrix of size (number of effect sizes)² is built.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Ratings required to perform the meta-analysis, one row per effect size. A study can have several rows, for
+        instance several scales, or the ratings of several raters concatenated.
+
+    cluster: str, optional
+        Column or index level identifying the study of each effect size. By default, the first level of the index
+        (the name of the study).
+
+    moderators: list of str, optional
+        Moderators of a meta-regression, see ``run_meta_regression``. By default, only the summary effect is estimated.
+
+    scale_to_reverse: list of str, optional
+        List of strings listing the clinical scales having a positive correlation with symptoms of the disease;
+        i.e increasing when a patient gets better.
+
+    pre_post_correlation: float, default = 0.5
+        Pearson correlation of the pre-test and post-test values.
+
+    rho: float, default = 0.8
+        Assumed correlation between the effect sizes of a study, only used to estimate Tau².
+
+    Returns
+    -------
+    df_coefficients: pandas.DataFrame
+        One row per term (the intercept is the summary effect), with the coefficient, its robust standard error, the
+        t statistic, its p-value and the 95% confidence interval.
+
+    df_results: pandas.DataFrame
+        Tau², the assumed correlation, the number of studies, the number of effect sizes and the degrees of freedom.
+
+    """
+
+    import scipy.stats as scp
+
+    # Effect sizes and their variances
+    n_treatment, n_control, effect_size = _effect_sizes_from_dataframe(df, scale_to_reverse)
+    variance_ES = _standard_error_effect_size(n_treatment, n_control, effect_size, pre_post_correlation)**2
+    X, terms, complete = _design_matrix(df, moderators)
+    if cluster is None:
+        cluster_labels = df.index.get_level_values(0)
+    elif cluster in df.columns:
+        cluster_labels = df[cluster]
+    else:
+        cluster_labels = df.index.get_level_values(cluster)
+    effect_size, variance_ES, X = effect_size[complete], variance_ES[complete], X[complete]
+    clusters, _ = pd.factorize(np.asarray(cluster_labels)[complete])
+    n_clusters = clusters.max() + 1
+    n_coefficients = X.shape[1]
+
+    # Number of effect sizes and mean variance of each study, sums of the rows of X of each study
+    k = np.bincount(clusters, minlength=n_clusters)
+    mean_variance = np.bincount(clusters, weights=variance_ES, minlength=n_clusters)/k
+    sums_X = _cluster_sums(X, clusters, n_clusters)
+
+    def weighted_least_squares(weight):
+        # Weights are constant within a study: X'WX and X'WT are sums over the rows
+        inverse_XWX = np.linalg.inv((X*weight[clusters, np.newaxis]).T.dot(X))
+        coefficients = inverse_XWX.dot((X*weight[clusters, np.newaxis]).T.dot(effect_size))
+        return inverse_XWX, coefficients, effect_size - X.dot(coefficients)
+
+    # Tau² by the method of moments, from the weights 1/(k_j*mean variance) of the fixed effect model:
+    # E[Q_E] = m - tr(V A) + Tau²(sum of the weights - tr(V B))
+    weight = 1/(k*mean_variance)
+    inverse_XWX, _, residuals = weighted_least_squares(weight)
+    Q_E = np.sum(weight[clusters]*residuals**2)
+    # A: sampling covariance within the studies, B: common random effect of the effect sizes of a study
+    A = ((1 - rho)*(X*(weight/k)[clusters, np.newaxis]).T.dot(X)
+         + rho*(sums_X*(weight/k)[:, np.newaxis]).T.dot(sums_X))
+    B = (sums_X*(weight**2)[:, np.newaxis]).T.dot(sums_X)
+    Tau2 = max((Q_E - n_clusters + np.trace(inverse_XWX.dot(A)))/(np.sum(k*weight) - np.trace(inverse_XWX.dot(B))), 0)
+
+    # Correlated effects weights and cluster sandwich estimator
+    weight = 1/(k*(mean_variance + Tau2))
+    inverse_XWX, coefficients, residuals = weighted_least_squares(weight)
+    scores = _cluster_sums(X*(weight[clusters]*residuals)[:, np.newaxis], clusters, n_clusters)
+    degrees_of_freedom = n_clusters - n_coefficients
+    if degrees_of_freedom < 4:
+        warnings.warn('With %d degrees of freedom, the robust standard errors are not reliable' % degrees_of_freedom)
+    covariance = n_clusters/degrees_of_freedom*inverse_XWX.dot(scores.T.dot(scores)).dot(inverse_XWX)
+
+    standard_error = np.sqrt(np.diag(covariance))
+    t = coefficients/standard_error
+    quantile = scp.t.ppf(0.975, degrees_of_freedom)
+    df_coefficients = pd.DataFrame({'Coefficient': coefficients,
+                                    'Standard Error': standard_error,
+                                    't': t,
+                                    'p-value': 2*scp.t.sf(np.abs(t), degrees_of_freedom),
+                                    'Lower limit': coefficients - quantile*standard_error,
+                                    'Upper limit': coefficients + quantile*standard_error},
+                                    index=pd.Index(terms, name='Term'))
+
+    df_results = pd.DataFrame({'Tau2': [Tau2],
+                               'rho': [rho],
+                               'Number of studies': [n_clusters],
+                               'Number of effect sizes': [len(effect_size)],
+                               'Degrees of freedom': [degrees_of_freedom]},
+                               index=['Results'])
+
+    return df_coefficients, df_results
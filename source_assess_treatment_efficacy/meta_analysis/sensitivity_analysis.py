@@ -0,0 +1,431 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: sensitivity_analysis
+    :synopsis: module performing sensitivity analyses of a meta-analysis
+ 
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+"""
+
+import numpy as np
+import pandas as pd
+
+from .forest_plot_renderer import _import_matplotlib
+from .perform_meta_analysis import (_effect_sizes_from_dataframe, _standard_error_effect_size, 
+                                    _random_effects_pooling, _results_dataframe)
+
+
+def run_pre_post_correlation_sensitivity(df, pre_post_correlations, scale_to_reverse=[], tau2_method='DL'):
+    """Performs the meta-analysis of ``run_meta_analysis`` for a grid of pre-post correlations.
+
+    The pre-post correlation is rarely reported by the studies and has to be imputed, this analysis shows how the results 
+    depend on this assumption. The standard errors of the effect sizes and the random effects pooling are computed for all 
+    the correlations at once.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Parents, teachers or clinicians ratings required to perform the meta-analysis.
+        This dataframe corresponds to one of those obtained with the ``import_csv_for_meta_analysis`` module.
+
+    pre_post_correlations: array-like of float
+        Pearson correlations of the pre-test and post-test values to test, each one strictly lower than 1.
+
+    scale_to_reverse: list of str, optional
+        List of strings listing the clinical scales having a positive correlation with symptoms of the disease; 
+        i.e increasing when a patient gets better.
+
+    tau2_method: str, default = 'DL'
+        Estimator of the between studies variance (Tau²), see ``run_meta_analysis``.
+
+    Returns
+    -------
+    df_results_per_study: pandas.DataFrame
+        Results per correlation and per study.
+        Rows are indexed by the correlation and the study, columns correspond to the effect size of the study, its standard 
+        error, and its weight.
+
+    df_results: pandas.DataFrame
+        Global results, one row per correlation.
+        Columns are the ones of the global results of ``run_meta_analysis``.
+
+    Notes
+    -----
+        The effect sizes do not depend on the pre-post correlation, only their standard errors do.
+
+    """
+
+    pre_post_correlations = np.asarray(pre_post_correlations, dtype=float).ravel()
+    n_correlations = len(pre_post_correlations)
+    n_studies = len(df.index)
+
+    # Effect sizes, and standard errors for each correlation (correlations in rows, studies in columns)
+    n_treatment, n_control, effect_size = _effect_sizes_from_dataframe(df, scale_to_reverse)
+    standard_error_ES = _standard_error_effect_size(n_treatment, n_control, effect_size, pre_post_correlations[:, np.newaxis])
+
+    # Each correlation corresponds to a meta-analysis
+    groups = np.repeat(np.arange(n_correlations), n_studies)
+    pooling = _random_effects_pooling(np.tile(effect_size, n_correlations), standard_error_ES.ravel()**2, 
+                                      groups, n_correlations, tau2_method)
+
+    index_correlations = pd.Index(pre_post_correlations, name='pre_post_correlation')
+    df_results = _results_dataframe(pooling['Q'], pooling['p-value Heterogeneity'], pooling['Tau2'], 
+                                    pooling['Summary Effect'], pooling['Variance Summary Effect'], 
+                                    pooling['Heterogeneity'], index_correlations)
+
+    index_studies = [np.tile(df.index.get_level_values(level), n_correlations) for level in range(df.index.nlevels)]
+    index = pd.MultiIndex.from_arrays([np.repeat(pre_post_correlations, n_studies)] + index_studies, 
+                                      names=['pre_post_correlation'] + list(df.index.names))
+    df_results_per_study = pd.DataFrame({'Effect size': np.tile(effect_size, n_correlations),
+                                         'Standard Error of the ES': standard_error_ES.ravel(),
+                                         'Weight': pooling['percentage_weight']},
+                                         index=index)
+
+    return df_results_per_study, df_results
+
+
+def _random_effects_sums_of_subsets(effect_size, variance_ES, Tau2, Tau2_subsets, max_ratio=0.3):
+    """Computes, for each leave-one-out subset of the studies, the sum of the weights and of the weighted effect sizes
+    under a random effects model, the between studies variance being the one of the subset.
+    The subset i contains all the studies except the i-th one.
+
+    Each weight 1/(variance_ES + Tau2_subsets) is expanded as a power series around the weight 1/(variance_ES + Tau2) of 
+    the whole meta-analysis, so that the sums are obtained from the totals of the powers of the weights.
+    The subsets whose Tau² is too far from Tau2 for the series to converge quickly are computed directly.
+
+    Parameters
+    ----------
+    effect_size: numpy.ndarray
+        Effect size of each study.
+
+    variance_ES: numpy.ndarray
+        Variance of the effect size of each study.
+
+    Tau2: float
+        Between studies variance of the whole meta-analysis.
+
+    Tau2_subsets: numpy.ndarray
+        Between studies variance of each subset.
+
+    max_ratio: float, default = 0.3
+        Largest ratio between the change of Tau² and the smallest total variance for which the series is used.
+
+    Returns
+    -------
+    sum_weights: numpy.ndarray
+        Sum of the weights of the studies of each subset.
+
+    sum_weighted_ES: numpy.ndarray
+        Sum of the weighted effect sizes of the studies of each subset.
+
+    """
+
+    # Total variances normalized by the smallest one, so that their powers neither overflow nor underflow
+    total_variance = variance_ES + Tau2
+    smallest_total_variance = total_variance.min()
+    normalized_weight = smallest_total_variance/total_variance
+    ratio = (Tau2_subsets - Tau2)/smallest_total_variance
+    series = np.abs(ratio) < max_ratio
+
+    # 1/(u + delta) = sum over m of (-delta)^m/u^(m+1), summed over the studies of the subset
+    sum_weights = np.zeros(len(effect_size))
+    sum_weighted_ES = np.zeros(len(effect_size))
+    weight_power = normalized_weight.copy()
+    ratio_power = np.where(series, 1., 0.)
+    ratio = np.where(series, ratio, 0)
+    while np.any(ratio_power != 0):
+        sum_weights += ratio_power*(weight_power.sum() - weight_power)
+        sum_weighted_ES += ratio_power*((weight_power*effect_size).sum() - weight_power*effect_size)
+        weight_power *= normalized_weight
+        ratio_power *= -ratio
+        ratio_power[np.abs(ratio_power) < np.finfo(float).eps] = 0
+    sum_weights /= smallest_total_variance
+    sum_weighted_ES /= smallest_total_variance
+
+    # Direct computation for the other subsets, by blocks to bound the memory
+    direct = np.flatnonzero(~series)
+    block_size = max(1, 2**20//len(effect_size))
+    for start in range(0, len(direct), block_size):
+        block = direct[start:start + block_size]
+        weight = 1/(variance_ES[np.newaxis, :] + Tau2_subsets[block, np.newaxis])
+        weight[np.arange(len(block)), block] = 0
+        sum_weights[block] = weight.sum(axis=1)
+        sum_weighted_ES[block] = weight.dot(effect_size)
+
+    return sum_weights, sum_weighted_ES
+
+
+def _random_effects_sums_of_prefixes(effect_size, variance_ES, Tau2_prefixes, max_ratio=0.3):
+    """Computes, for each cumulative subset of the studies (the i first ones), the sum of the weights and of the
+    weighted effect sizes under a random effects model, the between studies variance being the one of the subset.
+
+    The weights 1/(variance_ES + Tau2_prefixes) are expanded as power series around a reference Tau², so that the sums
+    of the prefixes are obtained from the running totals of the powers of the weights, as in
+    ``MetaAnalysisAccumulator``. When the Tau² of a prefix moves too far from the reference, or a study much more
+    precise than the previous ones is added, the running totals are computed again around the Tau² of this prefix: this
+    happens a few times only, as the Tau² of the prefixes settles when studies are added.
+
+    Parameters
+    ----------
+    effect_size: numpy.ndarray
+        Effect size of each study, in the order in which they are added.
+
+    variance_ES: numpy.ndarray
+        Variance of the effect size of each study.
+
+    Tau2_prefixes: numpy.ndarray
+        Between studies variance of each cumulative subset.
+
+    max_ratio: float, default = 0.3
+        Largest ratio between the change of Tau² and the smallest total variance for which the series are used.
+
+    Returns
+    -------
+    sum_weights: numpy.ndarray
+        Sum of the weights of the studies of each cumulative subset.
+
+    sum_weighted_ES: numpy.ndarray
+        Sum of the weighted effect sizes of the studies of each cumulative subset.
+
+    """
+
+    n_studies = len(effect_size)
+    # Number of terms for which max_ratio**n_terms is below the machine precision
+    n_terms = int(np.ceil(np.log(np.finfo(float).eps)/np.log(max_ratio))) + 1
+    smallest_variance = np.minimum.accumulate(variance_ES)
+    block_size = max(1, 2**20//n_terms)
+
+    sum_weights = np.empty(n_studies)
+    sum_weighted_ES = np.empty(n_studies)
+    start = 0
+    while start < n_studies:
+        # The series around the Tau² of the first prefix of the segment are used while the change of Tau² is small
+        # compared to the smallest total variance, which stays larger than half the one of the first prefix (so that
+        # the normalized weights are lower than 2)
+        reference_Tau2 = Tau2_prefixes[start]
+        scale = smallest_variance[start] + reference_Tau2
+        smallest_total_variance = smallest_variance[start:] + reference_Tau2
+        in_segment = ((np.abs(Tau2_prefixes[start:] - reference_Tau2) < max_ratio*smallest_total_variance)
+                      & (smallest_total_variance >= scale/2))
+        stop = start + (np.argmin(in_segment) if not np.all(in_segment) else n_studies - start)
+
+        # Totals of the powers of the normalized weights of the studies before the segment
+        normalized_weight = scale/(variance_ES[:start] + reference_Tau2)
+        weight_power = normalized_weight.copy()
+        moments_weights = np.empty(n_terms)
+        moments_weighted_ES = np.empty(n_terms)
+        for power in range(n_terms):
+            moments_weights[power] = weight_power.sum()
+            moments_weighted_ES[power] = weight_power.dot(effect_size[:start])
+            weight_power *= normalized_weight
+
+        # Running totals along the segment, by blocks to bound the memory (prefixes in rows, powers in columns)
+        for block_start in range(start, stop, block_size):
+            block = slice(block_start, min(block_start + block_size, stop))
+            powers = np.cumprod(np.repeat((scale/(variance_ES[block] + reference_Tau2))[:, np.newaxis], n_terms, axis=1),
+                                axis=1)
+            running_moments_weights = moments_weights + np.cumsum(powers, axis=0)
+            running_moments_weighted_ES = moments_weighted_ES + np.cumsum(powers*effect_size[block, np.newaxis], axis=0)
+            moments_weights = running_moments_weights[-1]
+            moments_weighted_ES = running_moments_weighted_ES[-1]
+
+            # 1/(u + delta) = sum over m of (-delta)^m/u^(m+1), for the Tau² of each prefix
+            coefficients = np.cumprod(np.repeat(-(Tau2_prefixes[block, np.newaxis] - reference_Tau2)/scale, n_terms, axis=1),
+                                      axis=1)
+            coefficients = np.hstack([np.ones((len(coefficients), 1)), coefficients[:, :-1]])
+            sum_weights[block] = (coefficients*running_moments_weights).sum(axis=1)/scale
+            sum_weighted_ES[block] = (coefficients*running_moments_weighted_ES).sum(axis=1)/scale
+
+        start = stop
+
+    return sum_weights, sum_weighted_ES
+
+
+def run_leave_one_out_analysis(df_results_per_study, df_results):
+    """Performs a leave-one-out analysis of a meta-analysis: the meta-analysis is performed again without each study in turn, 
+    and the influence of each study is measured.
+
+    All the leave-one-out statistics are obtained at once, by subtracting the share of each study from the sums of the weights, 
+    of the weighted effect sizes and of the squared weights of the whole meta-analysis, so that the run time is linear in 
+    the number of studies.
+
+    Parameters
+    ----------
+    df_results_per_study: pandas.DataFrame
+        Results per study.
+        Dataframe obtained after performing the meta-analysis with ``run_meta_analysis``.
+
+    df_results: pandas.DataFrame
+        Global results.
+        Dataframe obtained after performing the meta-analysis with ``run_meta_analysis``.
+
+    Returns
+    -------
+    df_leave_one_out: pandas.DataFrame
+        Results of the meta-analysis without each study, one row per study left out.
+        It contains the summary effect, its standard error, its 95% confidence interval, its p-value, the Chi2 value, 
+        the between studies variance (Tau²) and the heterogeneity (I²) obtained without the study. It also contains
+        the DFFITS of the study and its coordinates on the Baujat plot (contribution to the heterogeneity and
+        influence on the summary effect).
+
+    Notes
+    -----
+        The DFFITS is the change of the summary effect when the study is left out, standardized as in Viechtbauer and
+        Cheung (2010) "Outlier and influence diagnostics for meta-analysis", *Research Synthesis Methods*.
+        The Baujat plot is described in Baujat et al. (2002) "A graphical method for exploring heterogeneity in 
+        meta-analyses: application to a meta-analysis of 65 trials", *Statistics in Medicine*.
+
+    """
+
+    import scipy.stats as scp
+
+    effect_size = df_results_per_study['Effect size'].to_numpy(dtype=float)
+    variance_ES = df_results_per_study['Standard Error of the ES'].to_numpy(dtype=float)**2
+    Tau2 = float(df_results['Tau2'].iloc[0])
+    summary_effect = float(df_results['Summary Effect'].iloc[0])
+
+    # Totals of the fixed effect model, without the share of each study
+    weight_fixed_model = 1/variance_ES
+    sum_weights = weight_fixed_model.sum() - weight_fixed_model
+    sum_weighted_ES = (weight_fixed_model*effect_size).sum() - weight_fixed_model*effect_size
+    sum_weighted_squared_ES = (weight_fixed_model*effect_size**2).sum() - weight_fixed_model*effect_size**2
+    sum_squared_weights = (weight_fixed_model**2).sum() - weight_fixed_model**2
+
+    # Q, C, Tau² and I² without each study (Equations 12.2 to 12.5 and 16.9 of Borenstein (2009))
+    degrees_of_freedom = len(effect_size) - 2
+    Q = sum_weighted_squared_ES - sum_weighted_ES**2/sum_weights
+    C = sum_weights - sum_squared_weights/sum_weights
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Tau2_leave_one_out = np.where(degrees_of_freedom > 0, np.maximum((Q - degrees_of_freedom)/C, 0), 0)
+        I2 = np.maximum(((Q - degrees_of_freedom)/Q)*100, 0)
+
+    # Summary effect without each study under a random effects model (Equations 12.6 to 12.9)
+    sum_weights_random, sum_weighted_ES_random = _random_effects_sums_of_subsets(effect_size, variance_ES, Tau2, 
+                                                                                 Tau2_leave_one_out)
+    summary_effect_leave_one_out = sum_weighted_ES_random/sum_weights_random
+    standard_error_summary_effect = np.sqrt(1/sum_weights_random)
+    df_leave_one_out = _results_dataframe(Q, 1 - scp.chi2.cdf(Q, degrees_of_freedom), Tau2_leave_one_out, 
+                                          summary_effect_leave_one_out, standard_error_summary_effect**2, I2, 
+                                          df_results_per_study.index)
+
+    # DFFITS: change of the summary effect standardized by the leverage of the study
+    weight = 1/(variance_ES + Tau2)
+    leverage = weight/weight.sum()
+    df_leave_one_out['DFFITS'] = (summary_effect - summary_effect_leave_one_out)/np.sqrt(leverage*(Tau2_leave_one_out + variance_ES))
+
+    # Baujat plot: contribution to Q and influence on the summary effect of the fixed effect model
+    summary_effect_fixed_model = (weight_fixed_model*effect_size).sum()/weight_fixed_model.sum()
+    df_leave_one_out['Contribution to heterogeneity'] = weight_fixed_model*(effect_size - summary_effect_fixed_model)**2
+    df_leave_one_out['Influence on the summary effect'] = (summary_effect_fixed_model - sum_weighted_ES/sum_weights)**2*sum_weights
+
+    return df_leave_one_out
+
+
+def run_cumulative_meta_analysis(df_results_per_study, sort_by='Year', ascending=True):
+    """Performs a cumulative meta-analysis: the studies are sorted (by default by publication year) and the meta-analysis
+    is performed again each time a study is added.
+
+    The studies are sorted once and all the cumulative results are obtained from the running sums of the weights, 
+    of the weighted effect sizes and of the squared terms, so that the run time is linear in the number of studies.
+
+    Parameters
+    ----------
+    df_results_per_study: pandas.DataFrame
+        Results per study.
+        Dataframe obtained after performing the meta-analysis with ``run_meta_analysis``.
+
+    sort_by: str, default = 'Year'
+        Column of ``df_results_per_study`` giving the order in which the studies are added.
+
+    ascending: bool, default = True
+        Sort in ascending order.
+
+    Returns
+    -------
+    df_cumulative: pandas.DataFrame
+        Results of the meta-analysis after the addition of each study, one row per study in the order in which they are added.
+        It contains the summary effect, its 95% confidence interval, its variance, its standard error, its p-value, 
+        the between studies variance (Tau²), the heterogeneity (I²), its p-value, the Chi2 value and the number of studies.
+
+    """
+
+    import scipy.stats as scp
+
+    # Studies sorted once, ties keep the order of the dataframe
+    order = np.argsort(df_results_per_study[sort_by].to_numpy(), kind='stable')
+    if not ascending:
+        order = order[::-1]
+    effect_size = df_results_per_study['Effect size'].to_numpy(dtype=float)[order]
+    variance_ES = df_results_per_study['Standard Error of the ES'].to_numpy(dtype=float)[order]**2
+
+    # Running totals of the fixed effect model
+    weight_fixed_model = 1/variance_ES
+    sum_weights = np.cumsum(weight_fixed_model)
+    sum_weighted_ES = np.cumsum(weight_fixed_model*effect_size)
+    sum_weighted_squared_ES = np.cumsum(weight_fixed_model*effect_size**2)
+    sum_squared_weights = np.cumsum(weight_fixed_model**2)
+
+    # Q, C, Tau² and I² after each addition (Equations 12.2 to 12.5 and 16.9 of Borenstein (2009)).
+    # With the first study alone there is no heterogeneity: Q and C are only rounding errors.
+    number_of_studies = np.arange(1, len(effect_size) + 1)
+    degrees_of_freedom = number_of_studies - 1
+    Q = sum_weighted_squared_ES - sum_weighted_ES**2/sum_weights
+    Q[0] = 0
+    C = sum_weights - sum_squared_weights/sum_weights
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Tau2 = np.where(degrees_of_freedom > 0, np.maximum((Q - degrees_of_freedom)/C, 0), 0)
+        I2 = np.maximum(((Q - degrees_of_freedom)/Q)*100, 0)
+
+    # Summary effect after each addition under a random effects model (Equations 12.6 to 12.9)
+    sum_weights_random, sum_weighted_ES_random = _random_effects_sums_of_prefixes(effect_size, variance_ES, Tau2)
+    df_cumulative = _results_dataframe(Q, 1 - scp.chi2.cdf(Q, degrees_of_freedom), Tau2, 
+                                       sum_weighted_ES_random/sum_weights_random, 1/sum_weights_random, I2, 
+                                       df_results_per_study.index[order])
+    df_cumulative.insert(0, sort_by, df_results_per_study[sort_by].to_numpy()[order])
+    df_cumulative['Number of studies'] = number_of_studies
+
+    return df_cumulative
+
+
+def cumulative_forest_plot(df_cumulative):
+    """Creates a cumulative forest plot.
+    
+    Parameters
+    ----------
+    df_cumulative: pandas.DataFrame
+        Results of the cumulative meta-analysis.
+        Dataframe obtained with ``run_cumulative_meta_analysis``.
+        
+    Returns
+    -------
+    cumulative_forest_plot: matplotlib.figure.Figure
+        Graphical representation of the cumulative meta-analysis' results.
+        Representation of the summary effect and its 95% confidence interval after the addition of each study, 
+        the first study being at the top. The figure is drawn without pyplot, so that it can be created in worker
+        processes and without display, and saved with its ``savefig`` method.
+        
+    """
+
+    Figure = _import_matplotlib('matplotlib.figure').Figure
+
+    # Names of the studies added, the first one at the top
+    names = ['+ ' + str(name) for name in df_cumulative.index.get_level_values(0)]
+    y = np.arange(len(names), 0, -1)
+    summary_effect = df_cumulative['Summary Effect'].to_numpy()
+    lower_limit, upper_limit = np.array(df_cumulative['95% Confidence Interval of the Summary Effect'].tolist()).T
+
+    # Graphic
+    cumulative_forest_plot = Figure()
+    ax = cumulative_forest_plot.add_subplot(1, 1, 1)
+    ax.set_yticks(y)
+    ax.set_yticklabels(names)
+    # Vertical line in zero
+    ax.axvline(0, color='k')
+    # Plot Confidence Interval
+    ax.hlines(y, lower_limit, upper_limit, color='g')
+    # Plot summary effects
+    ax.scatter(summary_effect, y, s=100, marker='D', color='b')
+    ax.set_xlabel('Summary effect')
+    ax.set_title('Cumulative meta-analysis, 95% Confidence Interval', fontweight='bold')
+
+    return cumulative_forest_plot
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: subgroup_analysis
+    :synopsis: module comparing the summary effects of subgroups of studies
+
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+"""
+
+import numpy as np
+import pandas as pd
+
+from .perform_meta_analysis import (_effect_sizes_from_dataframe, _standard_error_effect_size,
+                                    _random_effects_pooling, _results_dataframe)
+
+
+def run_subgroup_analysis(df, subgroup, group_by=None, scale_to_reverse=[], pre_post_correlation=0.5, tau2_method='DL',
+                          pooled_tau2=False):
+    """Performs the meta-analysis of each subgroup of studies and tests the difference between the subgroups
+    (Borenstein (2009) *Introduction to meta-analysis*, Chapter 19).
+
+    All the subgroups, of all the meta-analyses when ``group_by`` is given, are pooled in one grouped pass over the
+    studies.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Parents, teachers or clinicians ratings required to perform the meta-analysis, with a column (or an index level)
+        giving the subgroup of each study.
+
+    subgroup: str
+        Column or index level of the subgroups, for instance the protocol or the medication status.
+
+    group_by: str or list of str, optional
+        Columns or index levels identifying independent meta-analyses, as in ``run_batched_meta_analysis``.
+        By default, all the studies belong to the same meta-analysis.
+
+    scale_to_reverse: list of str, optional
+        List of strings listing the clinical scales having a positive correlation with symptoms of the disease;
+        i.e increasing when a patient gets better.
+
+    pre_post_correlation: float, default = 0.5
+        Pearson correlation of the pre-test and post-test values.
+
+    tau2_method: str, default = 'DL'
+        Estimator of the between studies variance (Tau²) of each subgroup, see ``run_meta_analysis``.
+
+    pooled_tau2: bool, default = False
+        If True, all the subgroups of a meta-analysis share the same Tau², pooled from the Q and C values of the
+        subgroups; this is only defined for the estimator of DerSimonian and Laird.
+        Otherwise, Tau² is estimated separately in each subgroup.
+
+    Returns
+    -------
+    df_results_per_subgroup: pandas.DataFrame
+        Results of each subgroup (in rows, indexed by the meta-analysis and the subgroup).
+        Columns are the ones of the global results of ``run_meta_analysis`` and the number of studies.
+
+    df_results_between_subgroups: pandas.DataFrame
+        One row per meta-analysis, with the Q statistic between the subgroups, its degrees of freedom and p-value,
+        the combined summary effect of the subgroups and its variance, the pooled Tau² if ``pooled_tau2=True`` and the
+        number of subgroups.
+
+    """
+
+    import scipy.stats as scp
+
+    if pooled_tau2 and tau2_method != 'DL':
+        raise ValueError("The pooled Tau² is only defined for tau2_method='DL'")
+
+    group_by = [] if group_by is None else list(np.atleast_1d(group_by))
+
+    # Index of the subgroup of each study, and of the meta-analysis of each subgroup
+    grouped = df.groupby(group_by + [subgroup], sort=True, dropna=False)
+    groups = grouped.ngroup().to_numpy()
+    keys = grouped.size().index
+    n_subgroups = len(keys)
+    if group_by:
+        meta_analyses = keys.droplevel(-1).unique()
+        meta_analysis_of_subgroup = meta_analyses.get_indexer(keys.droplevel(-1))
+    else:
+        meta_analyses = pd.Index(['Results'])
+        meta_analysis_of_subgroup = np.zeros(n_subgroups, dtype=int)
+    n_meta_analyses = len(meta_analyses)
+
+    # Effect sizes and their standard errors
+    n_treatment, n_control, effect_size = _effect_sizes_from_dataframe(df, scale_to_reverse)
+    variance_ES = _standard_error_effect_size(n_treatment, n_control, effect_size, pre_post_correlation)**2
+
+    # Pooling of all the subgroups at once
+    pooling = _random_effects_pooling(effect_size, variance_ES, groups, n_subgroups, tau2_method)
+    if pooled_tau2:
+        # Pooled Tau² of the subgroups of each meta-analysis, negative values are put at zero
+        def _sum_over_subgroups(values):
+            return np.bincount(meta_analysis_of_subgroup, weights=values, minlength=n_meta_analyses)
+        Tau2_within = np.maximum((_sum_over_subgroups(pooling['Q']) - _sum_over_subgroups(pooling['k'] - 1))
+                                 /_sum_over_subgroups(pooling['C']), 0)
+        pooling = _random_effects_pooling(effect_size, variance_ES, groups, n_subgroups,
+                                          Tau2=Tau2_within[meta_analysis_of_subgroup])
+
+    df_results_per_subgroup = _results_dataframe(pooling['Q'], pooling['p-value Heterogeneity'], pooling['Tau2'],
+                                                 pooling['Summary Effect'], pooling['Variance Summary Effect'],
+                                                 pooling['Heterogeneity'], keys)
+    df_results_per_subgroup['Number of studies'] = pooling['k']
+
+    # Q between the subgroups: the summary effects of the subgroups are combined with a fixed effect model
+    weight_subgroup = 1/pooling['Variance Summary Effect']
+    sum_weights = np.bincount(meta_analysis_of_subgroup, weights=weight_subgroup, minlength=n_meta_analyses)
+    combined_effect = np.bincount(meta_analysis_of_subgroup, weights=weight_subgroup*pooling['Summary Effect'],
+                                  minlength=n_meta_analyses)/sum_weights
+    Q_between = np.bincount(meta_analysis_of_subgroup,
+                            weights=weight_subgroup*(pooling['Summary Effect'] - combined_effect[meta_analysis_of_subgroup])**2,
+                            minlength=n_meta_analyses)
+    number_of_subgroups = np.bincount(meta_analysis_of_subgroup, minlength=n_meta_analyses)
+    degrees_of_freedom = number_of_subgroups - 1
+
+    df_results_between_subgroups = pd.DataFrame({'Q between': Q_between,
+                                                 'Degrees of freedom': degrees_of_freedom,
+                                                 'p-value': scp.chi2.sf(Q_between, degrees_of_freedom),
+                                                 'Summary Effect': combined_effect,
+                                                 'Variance Summary Effect': 1/sum_weights,
+                                                 'Number of subgroups': number_of_subgroups},
+                                                 index=meta_analyses)
+    if pooled_tau2:
+        df_results_between_subgroups.insert(5, 'Tau2', Tau2_within)
+
+    return df_results_per_subgroup, df_results_between_subgroups
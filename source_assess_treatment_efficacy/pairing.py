@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: pairing
+    :synopsis: module pairing the lines of each study of the csv files (groups, pre-test and post-test) by their key
+
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+"""
+
+import itertools
+import warnings
+import numpy as np
+import pandas as pd
+
+
+# Columns identifying the lines of a study, whatever their group and time
+STUDY_KEY = ['Author', 'Year', 'Score Name', 'Raters']
+
+
+def _study_lines(df, cell_columns):
+    """Identifies the study of each line of a csv file by hashing its key, and its cell (e.g. group and time).
+
+    All the lines are handled at once: the studies are numbered with a hash table, and the lines of each cell of a
+    study are counted with a segmented reduction, so that the run time is linear in the number of lines.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Lines of the csv file, the columns of ``STUDY_KEY`` and ``cell_columns`` are categories for Raters and the cells.
+
+    cell_columns: list of str
+        Categorical columns identifying the lines of a study, e.g. ['Group', 'Time'].
+
+    Returns
+    -------
+    study: numpy.ndarray of int
+        Index of the study of each line, the studies are numbered in the order of their first line.
+
+    cell: numpy.ndarray of int
+        Index of the cell of each line (in the order of the categories, e.g. Treatment pre, Treatment post, Control pre,
+        Control post), -1 for the lines whose rater or cell is missing or unknown.
+
+    occurrence: numpy.ndarray of int
+        Rank of each line among the lines of its study and cell: the k-th lines of the cells of a study are paired.
+
+    counts: numpy.ndarray of int
+        Number of lines of each study (in rows) and cell (in columns).
+
+    """
+
+    study = df.groupby(STUDY_KEY, sort=False, dropna=False, observed=True).ngroup().to_numpy()
+    n_studies = study.max() + 1 if len(study) else 0
+
+    known = df['Raters'].notna().to_numpy()
+    cell = np.zeros(len(df), dtype=np.int64)
+    n_cells = 1
+    for column in cell_columns:
+        codes = df[column].cat.codes.to_numpy()
+        known &= codes >= 0
+        cell = cell*len(df[column].cat.categories) + codes
+        n_cells *= len(df[column].cat.categories)
+    cell = np.where(known, cell, -1)
+
+    counts = np.bincount(study[known]*n_cells + cell[known], minlength=n_studies*n_cells).reshape(n_studies, n_cells)
+    line_cell = study*(n_cells + 1) + cell + 1
+    occurrence = pd.Series(line_cell).groupby(line_cell, sort=False).cumcount().to_numpy()
+
+    return study, cell, occurrence, counts
+
+
+def _pairing_report(df, cell_columns):
+    """Lists the studies whose lines cannot be paired one to one.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Lines of the csv file, see ``_study_lines``.
+
+    cell_columns: list of str
+        Categorical columns identifying the lines of a study, e.g. ['Group', 'Time'].
+
+    Returns
+    -------
+    df_report: pandas.DataFrame
+        One row per study with an issue, indexed by the columns of ``STUDY_KEY``. Columns are the number of lines of
+        each cell (e.g. 'Treatment pre'), the number of lines whose rater or cell is unknown ('Unmatched lines'),
+        'Incomplete' (a cell has fewer lines than another one, these lines are not imported) and 'Duplicate'
+        (a cell has several lines, they are paired in their order).
+
+    """
+
+    study, cell, _, counts = _study_lines(df, cell_columns)
+
+    # Lines with a name of study but without a known rater, group or time; empty lines are ignored
+    unmatched = np.bincount(study, weights=(cell < 0) & df['Author'].notna().to_numpy(), minlength=len(counts))
+    first_lines = pd.Series(study).drop_duplicates().index
+
+    cell_names = [' '.join(names) for names in itertools.product(*[df[column].cat.categories for column in cell_columns])]
+    df_report = pd.DataFrame(counts, columns=cell_names,
+                             index=pd.MultiIndex.from_frame(df[STUDY_KEY].iloc[first_lines].astype({'Raters': object})))
+    df_report['Unmatched lines'] = unmatched.astype(int)
+    df_report['Incomplete'] = counts.min(axis=1) < counts.max(axis=1)
+    df_report['Duplicate'] = counts.max(axis=1) > 1
+
+    return df_report[(df_report['Unmatched lines'] > 0) | df_report['Incomplete'] | df_report['Duplicate']]
+
+
+def _warn_pairing_issues(df, cell, counts):
+    """Raises one warning counting the studies whose lines cannot be paired one to one, if any."""
+
+    n_incomplete = np.count_nonzero(counts.min(axis=1) < counts.max(axis=1))
+    n_duplicate = np.count_nonzero(counts.max(axis=1) > 1)
+    n_unmatched = np.count_nonzero((cell < 0) & df['Author'].notna().to_numpy())
+
+    issues = []
+    if n_incomplete:
+        issues.append('%d studies have missing lines, their unpaired lines are not imported' % n_incomplete)
+    if n_duplicate:
+        issues.append('%d studies have several lines for the same group and time, they are paired in their order'
+                      % n_duplicate)
+    if n_unmatched:
+        issues.append('%d lines have an unknown rater, group or time' % n_unmatched)
+    if issues:
+        warnings.warn('; '.join(issues) + ' (see validate_csv)')
@@ -7,32 +7,59 @@
 .. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
 """
 
+import numpy as np
 import pandas as pd
 
+from ..caching import cached_import
+from ..compact import compact_dtypes
+from ..pairing import _study_lines, _pairing_report, _warn_pairing_issues
+
+
+DTYPES = {'Raters': pd.CategoricalDtype(['Parents', 'Teachers', 'Clinicians']),
+          'Time': pd.CategoricalDtype(['pre', 'post'])}
+
+# Columns of the factors in the csv file, and their names in the dataframes of the SAOB
+FACTORS = {'Probably Blind': 'pblind',
+           'Number of sessions': 'number_of_sessions',
+           'SMR': 'SMR',
+           'Theta up': 'theta_up',
+           'Theta down': 'theta_down',
+           'Beta up central': 'beta_up_central',
+           'Beta up frontal': 'beta_up_frontal',
+           'SCP': 'SCP',
+           'On drugs during treatment assessments': 'on_drugs',
+           'Age min': 'age_min',
+           'Age max': 'age_max',
+           'Randomization': 'randomization',
+           'Institutional Review Board': 'IRB',
+           'Transfer phase': 'transfer_phase',
+           'Transfer card': 'transfer_card',
+           'EOG correction or rejection': 'EOG_correction_or_rejection',
+           'Amplitude based artifact rejection': 'amplitude_based_artifact_rejection',
+           'Thresholding': 'thresholding',
+           'Session pace (per week)': 'session_pace',
+           'Session length (min)': 'session_length',
+           'Treatment length (weeks)': 'treatment_length',
+           '>1 active electrode': 'more_than_one_active_electrode',
+           'EEG quality': 'EEG_quality',
+           'Control group': 'control_group',
+           'Indivualisation (iAPF)': 'individualisation_iapf',
+           'EMG biofeedback': 'EMG_biofeedback',
+           'Engagement with treatment': 'engagement_with_treatment',
+           'Maximum on clinical scale': 'maximum_on_clinical_scale'}
+
+
+def _common_read(df, pairs, raters):
+    """Extracts the ratings and factors of a rater from the lines of a csv file, one row per study and clinical scale.
 
-def _common_read(csv_file, raters):
-    """Reads data from a csv file containing parents and sometimes teachers and clinicians severity assessments of a disease and factor values. 
-    This csv file contains all the data required to perform the SAOB. 
-   
     Parameters
     ----------
-    csv_file: str
-        Name or localisation of the csv file that contains all the values of clinical trials required to perform the SAOB.
-        The csv file must have a specific form: 
+    df: pandas.DataFrame
+        Lines of the csv file, obtained with ``_read_factors``; the form of the csv file is described in ``import_csv``.
+
+    pairs: tuple of numpy.ndarray
+        Lines at pre-test and their paired lines at post-test (-1 if missing), obtained with ``_paired_lines``.
 
-        - eight first columns: Author, Year, Score Name, Number of patients, Raters (Parents or Teachers), Time (pre and post), Mean, Std;
-        - other columns correspond to factors to analyze;
-        - each study has at least 2 lines: Author name, Year, Score Name, Number of patients, Raters (Parents or Teachers) repeated twice, 
-          Time (pre and post), Mean (at pre-test and post-test), Std (at pre-test and post-test). If Teachers assessments are available, 
-          two lines must be added;
-        - sometimes, for a study, several clinical scales are available, they are all entered in the csv file;
-        - for each author, the 2 lines of the Raters column have to be filled as follows: Parents, Parents, if teachers' assessment is available
-          2 more lines are added (Teachers, Teachers);
-        - for each author, the 2 lines of the Time column have to be filled as follows: pre, post (pattern repeated one more time if teacher or
-          assessments is available);
-        - Mean and Std correspond to the clinical score extracted from studies at pre-test and post-test;
-        - Every additionnal column corresponds to a factor.
-               
     raters: str, 'Teachers' or 'Parents'
         Person assessing the disease symptoms.
                            
@@ -45,108 +72,77 @@ def _common_read(csv_file, raters):
         n_control, std_post_test_treatment, std_post_test_control, std_pre_test_treatment, std_pre_test_control, raters for each study and factors.   
 
     """
-    
-    # Import a csv file as a dataframe   
-    df = pd.read_csv(csv_file)
-
-    # Name of studies with an evaluation and its associated score
-    indices_name_studies = df.loc[ (df['Time'] == "pre")
-                & (df['Raters'] == raters),
-                ['Mean', 'Std']
-                ].isnull().sum(axis=1).index
-    name_studies = df.loc[indices_name_studies, 'Author']
-    score_name = df.loc[indices_name_studies, 'Score Name']
-
-
-    # Extract treatment values 
-    treatment_indices_pre = df[ 
-            (df['Time'] == "pre") 
-          & (df['Raters'] == raters)
-          ].index
-    n_treatment = df.loc[treatment_indices_pre, 'Number of patients']
-    mean_pre_test_treatment = df.loc[treatment_indices_pre, 'Mean']
-    std_pre_test_treatment = df.loc[treatment_indices_pre, 'Std']
-    
-    treatment_indices_post = df[
-            (df['Time'] == "post") 
-          & (df['Raters'] == raters)
-          ].index
-    mean_post_test_treatment = df.loc[treatment_indices_post, 'Mean']
-    std_post_test_treatment = df.loc[treatment_indices_post, 'Std']
-    
 
-    # Extract factors
-    pblind = df.loc[treatment_indices_pre, 'Probably Blind']
-    number_of_sessions = df.loc[treatment_indices_pre, 'Number of sessions']
-    SMR = df.loc[treatment_indices_pre, 'SMR']
-    theta_up = df.loc[treatment_indices_pre, 'Theta up']
-    beta_up_central = df.loc[treatment_indices_pre, 'Beta up central']
-    theta_down = df.loc[treatment_indices_pre, 'Theta down']
-    beta_up_frontal = df.loc[treatment_indices_pre, 'Beta up frontal']
-    SCP = df.loc[treatment_indices_pre, 'SCP']
-    on_drugs = df.loc[treatment_indices_pre, 'On drugs during treatment assessments']
-    age_min = df.loc[treatment_indices_pre, 'Age min']
-    age_max = df.loc[treatment_indices_pre, 'Age max']
-    randomization = df.loc[treatment_indices_pre, 'Randomization']
-    IRB = df.loc[treatment_indices_pre, 'Institutional Review Board']
-    transfer_phase = df.loc[treatment_indices_pre, 'Transfer phase']
-    transfer_card = df.loc[treatment_indices_pre, 'Transfer card']
-    EOG_correction_or_rejection = df.loc[treatment_indices_pre, 'EOG correction or rejection']
-    amplitude_based_artifact_rejection = df.loc[treatment_indices_pre, 'Amplitude based artifact rejection']
-    thresholding = df.loc[treatment_indices_pre, 'Thresholding']
-    session_pace = df.loc[treatment_indices_pre, 'Session pace (per week)']
-    session_length = df.loc[treatment_indices_pre, 'Session length (min)']
-    treatment_length = df.loc[treatment_indices_pre, 'Treatment length (weeks)']
-    more_than_one_active_electrode = df.loc[treatment_indices_pre, '>1 active electrode']
-    EEG_quality = df.loc[treatment_indices_pre, 'EEG quality']
-    control_group = df.loc[treatment_indices_pre, 'Control group']
-    individualisation_iapf = df.loc[treatment_indices_pre, 'Indivualisation (iAPF)']
-    EMG_biofeedback = df.loc[treatment_indices_pre, 'EMG biofeedback']
-    engagement_with_treatment = df.loc[treatment_indices_pre, 'Engagement with treatment']
-    maximum_on_clinical_scale = df.loc[treatment_indices_pre, 'Maximum on clinical scale']
-   
-    # Creation of the data frame containing the results
-    df_values = pd.DataFrame({'n_treatment': n_treatment.tolist(),
-                            'score_name': score_name.tolist(),
-                            'mean_pre_test_treatment': mean_pre_test_treatment.tolist(),
-                            'mean_post_test_treatment': mean_post_test_treatment.tolist(),
-                            'std_pre_test_treatment': std_pre_test_treatment.tolist(),
-                            'std_post_test_treatment': std_post_test_treatment.tolist(),
-                            'raters': raters,
-                            'pblind': pblind.tolist(),
-                            'number_of_sessions': number_of_sessions.tolist(),
-                            'SMR': SMR.tolist(),
-                            'theta_up': theta_up.tolist(),
-                            'theta_down': theta_down.tolist(),
-                            'beta_up_central': beta_up_central.tolist(),
-                            'beta_up_frontal': beta_up_frontal.tolist(),
-                            'SCP': SCP.tolist(), 
-                            'on_drugs': on_drugs.tolist(),
-                            'age_min': age_min.tolist(),
-                            'age_max': age_max.tolist(),
-                            'randomization': randomization.tolist(),
-                            'IRB': IRB.tolist(),
-                            'transfer_phase': transfer_phase.tolist(),
-                            'transfer_card': transfer_card.tolist(),
-                            'EOG_correction_or_rejection': EOG_correction_or_rejection.tolist(),
-                            'amplitude_based_artifact_rejection': amplitude_based_artifact_rejection.tolist(), 
-                            'thresholding': thresholding.tolist(),
-                            'session_pace': session_pace.tolist(),
-                            'session_length': session_length.tolist(),
-                            'treatment_length': treatment_length.tolist(),
-                            'more_than_one_active_electrode': more_than_one_active_electrode.tolist(),
-                            'EEG_quality': EEG_quality.tolist(),
-                            'control_group': control_group.tolist(),
-                            'individualisation_iapf': individualisation_iapf.tolist(),
-                            'EMG_biofeedback': EMG_biofeedback.tolist(),
-                            'engagement_with_treatment': engagement_with_treatment.tolist(),
-                            'maximum_on_clinical_scale': maximum_on_clinical_scale.tolist()},
-                             index=[name_studies])
-    
+    # Lines of the rater at pre-test, in the order of the csv file, and their lines at post-test
+    pre_lines, post_lines = pairs
+    rows = df['Raters'].cat.codes.to_numpy()[pre_lines] == df['Raters'].cat.categories.get_loc(raters)
+    df_pre = df.iloc[pre_lines[rows]]
+    post_lines = post_lines[rows]
+
+    def post_test(column):
+        return np.where(post_lines >= 0, df[column].to_numpy()[post_lines], np.nan)
+
+    # Creation of the data frame containing the results, the factors are the ones of the line at pre-test
+    df_values = pd.DataFrame({'n_treatment': df_pre['Number of patients'].to_numpy(),
+                              'score_name': df_pre['Score Name'].to_numpy(),
+                              'mean_pre_test_treatment': df_pre['Mean'].to_numpy(),
+                              'mean_post_test_treatment': post_test('Mean'),
+                              'std_pre_test_treatment': df_pre['Std'].to_numpy(),
+                              'std_post_test_treatment': post_test('Std'),
+                              'raters': raters,
+                              **{name: df_pre[column].to_numpy() for column, name in FACTORS.items()}},
+                              index=pd.MultiIndex.from_arrays([df_pre['Author'].to_numpy()], names=['Author']))
+
     return df_values
 
 
-def import_csv(csv_file):
+def _read_factors(csv_file):
+    """Reads a csv file of ratings and factors in one pass, Raters and Time are parsed as categories."""
+
+    return pd.read_csv(csv_file, dtype=DTYPES)
+
+
+def _paired_lines(df):
+    """Pairs each line at pre-test with the line at post-test of the same study (Author, Year, Score Name and Raters)
+    by a hash join, whatever their order in the csv file; the k-th lines at pre-test and post-test of a study are
+    paired. A warning is raised for the studies with missing or duplicate lines, listed by ``validate_csv``.
+
+    Parameters
+    ----------
+    df: pandas.DataFrame
+        Lines of the csv file, obtained with ``_read_factors``.
+
+    Returns
+    -------
+    pre_lines: numpy.ndarray of int
+        Positions of the lines at pre-test.
+
+    post_lines: numpy.ndarray of int
+        Position of the line at post-test paired with each line at pre-test, -1 if it is missing.
+
+    """
+
+    study, cell, occurrence, counts = _study_lines(df, ['Time'])
+    _warn_pairing_issues(df, cell, counts)
+
+    pair_key = study*(occurrence.max(initial=0) + 1) + occurrence
+    pre_lines = np.flatnonzero(cell == 0)
+    post_lines = np.flatnonzero(cell == 1)
+    paired = pd.Index(pair_key[post_lines]).get_indexer(pair_key[pre_lines])
+
+    return pre_lines, np.where(paired >= 0, post_lines[paired], -1)
+
+
+def _import_factors(csv_file):
+    """Imports the ratings and factors of parents and teachers of a csv file in a single dataframe."""
+
+    df = _read_factors(csv_file)
+    pairs = _paired_lines(df)
+
+    return pd.concat([_common_read(df, pairs, raters='Parents'), _common_read(df, pairs, raters='Teachers')])
+
+
+def import_csv(csv_file, cache=False, cache_format='feather', compact=False):
     """Imports data from a csv file containing parents and sometimes teachers severity assessments of a disease and factor values. 
     This csv file contains all the data required to perform the SAOB. 
     
@@ -165,10 +161,23 @@ def import_csv(csv_file):
         - for each author, the 2 lines of the Raters column have to be filled as follows: Parents, Parents, if teachers' assessment is available
           2 more lines are added (Teachers, Teachers);
         - for each author, the 2 lines of the Time column have to be filled as follows: pre, post (pattern repeated one more time if teacher
-          assessments is available);
+          assessments is available); the lines at pre-test and post-test are paired by their Author, Year, Score Name and
+          Raters, so that they do not have to follow each other (see ``validate_csv``);
         - Mean and Std correspond to the clinical score extracted from studies at pre-test and post-test.
         - Every additionnal column corresponds to a factor.
 
+    cache: bool or str, default = False
+        If True, the parsed ratings and factors are stored in a binary file next to the csv file (or in the directory
+        given), and loaded from it as long as the csv file is unchanged (see ``caching.cached_import``).
+        It requires ``pyarrow``.
+
+    cache_format: str, default = 'feather'
+        Format of the binary file, 'feather' or 'parquet'.
+
+    compact: bool, default = False
+        If True, the dataframes have compact types (categories, nullable booleans for the yes/no factors, small integers
+        and a flat index of the names of the studies), see ``compact.compact_dtypes``.
+
     Returns
     -------
     df_values_parents: pandas.DataFrame
@@ -185,12 +194,40 @@ def import_csv(csv_file):
         
     """
         
-    # Import parents ans teachers values
-    df_values_parents = _common_read(csv_file, raters='Parents')
-    df_values_teachers = _common_read(csv_file, raters='Teachers')
+    # Import parents ans teachers values, or their binary copy
+    if cache:
+        df_values = cached_import(csv_file, _import_factors, cache, cache_format)
+    else:
+        df_values = _import_factors(csv_file)
+    if compact:
+        df_values = compact_dtypes(df_values)
+    df_values_parents = df_values[df_values['raters'] == 'Parents']
+    df_values_teachers = df_values[df_values['raters'] == 'Teachers']
         
     return df_values_parents, df_values_teachers
         
+def validate_csv(csv_file):
+    """Checks that the lines of each study of a csv file can be paired: each study (Author, Year, Score Name and
+    Raters) must have one line at pre-test and one at post-test.
+
+    Parameters
+    ----------
+    csv_file: str
+        Name or localisation of the csv file, with the form described in ``import_csv``.
+
+    Returns
+    -------
+    df_report: pandas.DataFrame
+        One row per study with an issue, indexed by Author, Year, Score Name and Raters. Columns are the number of lines
+        at pre-test and post-test ('pre', 'post'), the number of lines with an unknown rater or time ('Unmatched lines'),
+        and whether a line is missing ('Incomplete') or duplicated ('Duplicate', the lines are paired in their order).
+        The dataframe is empty if all the studies can be paired.
+
+    """
+
+    return _pairing_report(_read_factors(csv_file), ['Time'])
+
+
 if __name__ == '__main__':
     import_csv_for_factors('values_total_meta_analysis_all_factors.csv') 
     
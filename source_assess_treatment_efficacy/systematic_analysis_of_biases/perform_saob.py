@@ -7,15 +7,12 @@
 .. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
 """
 
-import warnings
 import pandas as pd
 import numpy as np
 import random
-from sklearn.linear_model import LassoCV, LassoLarsIC
-from sklearn.model_selection import LeaveOneOut
-import statsmodels.api as sm
-from sklearn import tree
-import graphviz
+
+from ..caching import cached
+from ..diagnostics import Diagnostics
 
 
 def effect_size_within_subjects(mean_post_test_treatment, mean_pre_test_treatment, std_post_test_treatment, std_pre_test_treatment):
@@ -155,6 +152,10 @@ def preprocess_factors(df):
                  'raters', 'score_name', 'std_post_test_treatment',
                  'std_pre_test_treatment', 'effect_size_treatment', 'maximum_on_clinical_scale'], axis=1)
 
+    # Factors of the compact dataframes (nullable booleans and categories) are coded as the strings of the csv file
+    for factor in X.columns[(X.dtypes == 'boolean') | (X.dtypes == 'category')]:
+        X[factor] = (X[factor].map({True: 'yes', False: 'no'}) if X[factor].dtype == 'boolean' else X[factor]).astype(object)
+
     # Remove factors with too few observations    
     X_number_of_nans = X.isnull().sum()
     columns_to_remove_nans = X_number_of_nans[(X_number_of_nans > round(len(X)*20/100) + 1)]
@@ -183,7 +184,20 @@ def preprocess_factors(df):
     return X, X_non_standardized 
 
 
-def weighted_linear_regression(df, X, y):
+def _report_moment_matrix(moment_matrix, moment_matrix_rank, condition_number, diagnostics):
+    """Records the invertibility, the rank and the condition number of the moment matrix of a regression and reports
+    them as asked by ``diagnostics``."""
+
+    recorded = Diagnostics()
+    recorded.flag('moment_matrix_not_invertible', moment_matrix_rank < moment_matrix.shape[0],
+                  'Moment matrix is not invertible, be carefull while interpreting the results')
+    recorded.measure('moment_matrix_rank', moment_matrix_rank)
+    recorded.measure('condition_number', condition_number)
+    recorded.report(diagnostics)
+
+
+@cached(added_columns=['number_of_scales', 'weight'])
+def weighted_linear_regression(df, X, y, diagnostics='warn'):
     """Performs Weighted Least Squares.
 
     Dependent variable = effect size within subjects; independent variable = factors. 
@@ -207,6 +221,15 @@ def weighted_linear_regression(df, X, y):
     y: pandas.Series
        Effect size within subjects computed for each observation (the dependent variable) obtained after the outlier rejection.
 
+    diagnostics: str or Diagnostics, default = 'warn'
+        What to do if the moment matrix is not invertible: 'warn', 'log', 'raise' or 'ignore' (see ``Diagnostics.emit``),
+        or a ``Diagnostics`` in which the invertibility, the rank and the condition number of the moment matrix are recorded.
+
+    cache: bool or ResultCache, optional
+        If given, the summary is looked up in (and stored to) this cache, keyed by a hash of the inputs; ``True`` uses
+        the default in-memory cache of the ``caching`` module. The columns added to ``df`` by the regression (number of
+        scales and weights) are not part of the key, and they are added to ``df`` on a hit too.
+
     Returns
     -------
     summary: statsmodels.iolib.summary.Summary
@@ -215,6 +238,8 @@ def weighted_linear_regression(df, X, y):
 
     """
 
+    import statsmodels.api as sm
+
     # Find the number of scales per study
     df['number_of_scales'] = df.index.value_counts()
 
@@ -232,11 +257,7 @@ def weighted_linear_regression(df, X, y):
     moment_matrix_rank = np.linalg.matrix_rank(moment_matrix)
     eigen_values_moment_matrix = np.linalg.eigvals(moment_matrix)
     condition_number = np.linalg.cond(moment_matrix)
-    
-    if moment_matrix.shape[0] == moment_matrix_rank:
-        print('Moment matrix is invertible')
-    else: 
-        warnings.warn('Moment matrix is not invertible, be carefull while interpreting the results')
+    _report_moment_matrix(moment_matrix, moment_matrix_rank, condition_number, diagnostics)
     
     # WLS
     weighted_regression = sm.WLS(y, sm.add_constant(X), weights=df['weight'])
@@ -246,7 +267,7 @@ def weighted_linear_regression(df, X, y):
     return summary
     
     
-def ordinary_linear_regression(X, y):
+def ordinary_linear_regression(X, y, diagnostics='warn'):
     """Performs Ordinary Least Squares.
 
     Dependent variable = effect size within subjects; independent variable = factors. 
@@ -266,6 +287,9 @@ def ordinary_linear_regression(X, y):
     y: pandas.Series
         Effect size within subjects computed for each observation (the dependent variable) obtained after the outlier rejection.
 
+    diagnostics: str or Diagnostics, default = 'warn'
+        What to do if the moment matrix is not invertible, see ``weighted_linear_regression``.
+
     Returns
     -------
     summary_ols: statsmodels.iolib.summary.Summary
@@ -274,6 +298,8 @@ def ordinary_linear_regression(X, y):
 
     """
 
+    import statsmodels.api as sm
+
     # Get rank of the moment matrix and its condition number: it has to be full rank,
     # to have eigen values > 0  and a high condition number to be invertible
     rank_X = np.linalg.matrix_rank(X)
@@ -282,11 +308,7 @@ def ordinary_linear_regression(X, y):
     moment_matrix_rank = np.linalg.matrix_rank(moment_matrix)
     eigen_values_moment_matrix = np.linalg.eigvals(moment_matrix)
     condition_number = np.linalg.cond(moment_matrix)
-    
-    if moment_matrix.shape[0] == moment_matrix_rank:
-        print('Moment matrix is invertible')
-    else:
-        warnings.warn('Moment matrix is not invertible, be carefull while interpreting the results')
+    _report_moment_matrix(moment_matrix, moment_matrix_rank, condition_number, diagnostics)
 
     # Run the OLS 
     regression = sm.OLS(y, sm.add_constant(X))
@@ -296,6 +318,7 @@ def ordinary_linear_regression(X, y):
     return summary_ols
 
 
+@cached
 def regularization_lassocv(X, y):
     """Performs Lasso linear model with iterative fitting along a regularization path.
     The best model is selected by cross-validation.
@@ -314,6 +337,11 @@ def regularization_lassocv(X, y):
     y: pandas.Series
         Effect size within subjects computed for each observation (the dependent variable) obtained after the outlier rejection.
 
+    cache: bool or ResultCache, optional
+        If given, the results are looked up in (and stored to) this cache, keyed by a hash of the inputs; ``True`` uses
+        the default in-memory cache of the ``caching`` module. The leave-one-out cross-validation is then only
+        performed once for the same inputs.
+
     Returns
     -------
     coeff: pandas.DataFrame
@@ -333,6 +361,9 @@ def regularization_lassocv(X, y):
 
     """
 
+    from sklearn.linear_model import LassoCV
+    from sklearn.model_selection import LeaveOneOut
+
     # Cross validation (leave one out) to choose the tuning parameter alpha 
     loo = LeaveOneOut()
     lassocv = LassoCV(alphas = None, cv = loo) # leave one out method, internal cross validation: it performs cv on the 
@@ -377,6 +408,8 @@ def regularization_lassoAIC(X, y):
         Column with coefficients obtained after regularization and the names of the associated factors.
 
     """
+
+    from sklearn.linear_model import LassoLarsIC
     
     model = LassoLarsIC(criterion='aic') 
     model.fit(X, y) 
@@ -409,6 +442,12 @@ def decision_tree(X_non_standardized, y):
 
     """  
 
+    from sklearn import tree
+    try:
+        import graphviz
+    except ImportError:
+        raise ImportError("graphviz is required to draw the decision tree, install the extra 'graphviz' of the package")
+
     # Decision tree (criterion: mean square error)
     clf = tree.DecisionTreeRegressor(criterion='mse', min_samples_leaf=8)
     clf.fit(X_non_standardized, y)
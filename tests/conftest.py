@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+"""
+.. module:: conftest
+    :synopsis: data and comparisons shared by the tests of the package
+
+.. moduleauthor:: Aurore Bussalb <aurore.bussalb@mensiatech.com>
+"""
+
+import os
+import warnings
+import numpy as np
+import pytest
+
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'examples')
+
+META_ANALYSIS_CSV = os.path.join(EXAMPLES, 'meta-analysis', 'data-update', 'values_total_meta_analysis.csv')
+
+SAOB_CSV = os.path.join(EXAMPLES, 'systematic-analysis-of-biases', 'values_total_all_factors_saob.csv')
+
+
+def assert_results_close(df_results, df_expected, rtol=1e-7, atol=1e-10):
+    """Compares two dataframes of global results column by column, the confidence intervals being tuples."""
+
+    assert list(df_results.columns) == list(df_expected.columns)
+    for column in df_expected.columns:
+        expected = np.array(df_expected[column].tolist(), dtype=float)
+        np.testing.assert_allclose(np.array(df_results[column].tolist(), dtype=float), expected, rtol=rtol, atol=atol,
+                                   err_msg=column)
+
+
+@pytest.fixture
+def df_values_parents():
+    """Parents' ratings of the example of the update of the meta-analysis."""
+
+    from source_assess_treatment_efficacy.meta_analysis.import_csv_for_meta_analysis import import_csv
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return import_csv(META_ANALYSIS_CSV, 'Parents')
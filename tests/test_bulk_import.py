@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import warnings
+import pandas as pd
+import pytest
+
+from source_assess_treatment_efficacy.bulk_import import import_directory
+from source_assess_treatment_efficacy.meta_analysis.import_csv_for_meta_analysis import import_csv
+from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import (run_meta_analysis,
+                                                                                  run_batched_meta_analysis)
+from source_assess_treatment_efficacy.systematic_analysis_of_biases import import_csv_for_factors
+
+from .conftest import EXAMPLES, SAOB_CSV, assert_results_close
+
+
+META_ANALYSIS = os.path.join(EXAMPLES, 'meta-analysis')
+
+
+@pytest.fixture(autouse=True)
+def ignore_warnings():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        yield
+
+
+def _labels(index):
+    """Labels of the files of an index, the missing subgroups (NaN in the index) being None."""
+
+    return {(dataset, outcome, None if pd.isna(subgroup) else subgroup)
+            for dataset, outcome, subgroup in index.droplevel(['raters', 'Author']).unique()}
+
+
+def _rows_of_file(index, dataset, outcome, subgroup):
+    """Rows of the studies (or of the meta-analyses) of a file, selected by its labels."""
+
+    subgroups = index.get_level_values('subgroup')
+    return ((index.get_level_values('dataset') == dataset) & (index.get_level_values('outcome') == outcome)
+            & (subgroups.isna() if subgroup is None else subgroups == subgroup))
+
+
+def test_files_are_labelled_by_their_localisation():
+    df_values = import_directory(META_ANALYSIS)
+
+    assert _labels(df_values.index) == {(dataset, outcome, subgroup)
+                                        for outcome in ['total', 'inattention', 'hyperactivity']
+                                        for dataset, subgroup in [('data-update', None), ('data-replication', None),
+                                                                  ('data-subgroup-analysis', 'low-no-medication'),
+                                                                  ('data-subgroup-analysis', 'standard-protocol')]}
+    assert list(df_values.index.names) == ['dataset', 'outcome', 'subgroup', 'raters', 'Author']
+
+
+@pytest.mark.parametrize('n_jobs, pool', [(1, 'thread'), (4, 'thread'), (2, 'process')])
+def test_studies_of_each_file_equal_their_import(n_jobs, pool):
+    df_values = import_directory(META_ANALYSIS, n_jobs=n_jobs, pool=pool)
+
+    csv_files = glob.glob(os.path.join(META_ANALYSIS, '**', '*.csv'), recursive=True)
+    assert len(csv_files) == 12
+    for csv_file in csv_files:
+        directories = os.path.relpath(os.path.dirname(csv_file), META_ANALYSIS).split(os.sep)
+        outcome = next(word for word in os.path.basename(csv_file).split('_')
+                       if word in ['total', 'inattention', 'hyperactivity'])
+        df_file = df_values[_rows_of_file(df_values.index, directories[0], outcome, '/'.join(directories[1:]) or None)]
+        df_file = df_file.droplevel(['dataset', 'outcome', 'subgroup'])
+        # The years of the files with empty lines are floats, and so are all the years once the files are put together
+        pd.testing.assert_frame_equal(df_file, import_csv(csv_file, long_format=True), check_dtype=False)
+    assert len(df_values) == sum(len(import_csv(csv_file, long_format=True)) for csv_file in csv_files)
+
+
+def test_glob_pattern_labels_below_its_fixed_directories():
+    df_values = import_directory(os.path.join(META_ANALYSIS, 'data-subgroup-analysis', '**', '*total*.csv'))
+
+    assert _labels(df_values.index) == {('low-no-medication', 'total', None), ('standard-protocol', 'total', None)}
+
+
+@pytest.mark.parametrize('dataset, outcome, subgroup, csv_file', [
+    ('data-update', 'total', None, os.path.join('data-update', 'values_total_meta_analysis.csv')),
+    ('data-subgroup-analysis', 'inattention', 'standard-protocol',
+     os.path.join('data-subgroup-analysis', 'standard-protocol', 'values_inattention_meta_analysis_sd.csv'))])
+def test_batched_meta_analysis_of_all_files_equals_separate_runs(dataset, outcome, subgroup, csv_file):
+    df_values = import_directory(META_ANALYSIS)
+    _, df_results = run_batched_meta_analysis(df_values.copy(), ['dataset', 'outcome', 'subgroup', 'raters'])
+    assert len(df_results) == 24
+
+    df_file = df_results[_rows_of_file(df_results.index, dataset, outcome, subgroup)]
+    for rater in ['Parents', 'Teachers']:
+        _, df_expected, _ = run_meta_analysis(import_csv(os.path.join(META_ANALYSIS, csv_file), rater))
+        df_rater = df_file[df_file.index.get_level_values('raters') == rater].drop(columns='Number of studies')
+        assert_results_close(df_rater, df_expected.set_axis(df_rater.index))
+
+
+def test_saob_importer_equals_import_csv_for_factors():
+    df_values = import_directory(SAOB_CSV.replace('.csv', '*.csv'), importer='saob')
+
+    df_values_parents, df_values_teachers = import_csv_for_factors.import_csv(SAOB_CSV)
+    df_expected = pd.concat([df_values_parents, df_values_teachers])
+    assert (df_values.index.get_level_values('Author') == df_expected.index.get_level_values(0)).all()
+    pd.testing.assert_frame_equal(df_values.reset_index(drop=True), df_expected.reset_index(drop=True))
+
+
+def test_wrong_arguments(tmp_path):
+    with pytest.raises(ValueError):
+        import_directory(META_ANALYSIS, importer='meta-analysis')
+    with pytest.raises(ValueError):
+        import_directory(META_ANALYSIS, pool='fork')
+    with pytest.raises(ValueError):
+        import_directory(str(tmp_path))
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import warnings
+import pandas as pd
+import pytest
+
+from source_assess_treatment_efficacy.meta_analysis import import_csv_for_meta_analysis
+
+from .conftest import META_ANALYSIS_CSV
+
+
+pytest.importorskip('pyarrow')
+
+
+@pytest.fixture(autouse=True)
+def ignore_warnings():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        yield
+
+
+@pytest.mark.parametrize('cache_format', ['feather', 'parquet'])
+def test_cached_import_round_trip(tmp_path, cache_format):
+    csv_file = str(tmp_path / 'values_total_meta_analysis.csv')
+    shutil.copy(META_ANALYSIS_CSV, csv_file)
+    df_expected = import_csv_for_meta_analysis.import_csv(csv_file, long_format=True)
+
+    for _ in range(2):
+        df_values = import_csv_for_meta_analysis.import_csv(csv_file, long_format=True, cache=True,
+                                                            cache_format=cache_format)
+        pd.testing.assert_frame_equal(df_values, df_expected)
+    assert len([file for file in os.listdir(str(tmp_path)) if file.endswith(cache_format)]) == 1
+
+
+def test_files_of_the_same_name_do_not_share_their_cache(tmp_path):
+    # Two csv files of the same name, size and modification time but different contents, cached in the same directory
+    with open(META_ANALYSIS_CSV) as file:
+        content = file.read()
+    csv_files = []
+    for directory, text in [('a', content), ('b', content.replace('Bink', 'Bonk'))]:
+        os.makedirs(str(tmp_path / directory))
+        csv_files.append(str(tmp_path / directory / 'values_total_meta_analysis.csv'))
+        with open(csv_files[-1], 'w') as file:
+            file.write(text)
+        os.utime(csv_files[-1], ns=(10**18, 10**18))
+    assert os.path.getsize(csv_files[0]) == os.path.getsize(csv_files[1])
+
+    cache_directory = str(tmp_path / 'cache')
+    for _ in range(2):
+        for csv_file in csv_files:
+            df_values = import_csv_for_meta_analysis.import_csv(csv_file, long_format=True, cache=cache_directory)
+            pd.testing.assert_frame_equal(df_values, import_csv_for_meta_analysis.import_csv(csv_file, long_format=True))
+
+
+def test_modified_file_is_parsed_again(tmp_path):
+    csv_file = str(tmp_path / 'values_total_meta_analysis.csv')
+    shutil.copy(META_ANALYSIS_CSV, csv_file)
+    import_csv_for_meta_analysis.import_csv(csv_file, long_format=True, cache=True)
+
+    with open(csv_file) as file:
+        content = file.read()
+    with open(csv_file, 'w') as file:
+        file.write(content.replace('Bink', 'Bonk'))
+    df_values = import_csv_for_meta_analysis.import_csv(csv_file, long_format=True, cache=True)
+
+    assert 'Bonk' in df_values.index.get_level_values('Author')
+    assert 'Bink' not in df_values.index.get_level_values('Author')
+
+
+def test_run_meta_analysis_again_on_the_same_dataframe_is_a_hit(df_values_parents):
+    from source_assess_treatment_efficacy.caching import ResultCache
+    from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import run_meta_analysis
+
+    cache = ResultCache()
+    df_results_per_study, df_results, effect_size = run_meta_analysis(df_values_parents, cache=cache)
+    df_after_miss = df_values_parents.copy()
+    cached_results_per_study, cached_results, cached_effect_size = run_meta_analysis(df_values_parents, cache=cache)
+
+    assert cache.statistics['misses'] == 1 and cache.statistics['memory_hits'] == 1
+    pd.testing.assert_frame_equal(cached_results_per_study, df_results_per_study)
+    pd.testing.assert_frame_equal(cached_results, df_results)
+    pd.testing.assert_series_equal(cached_effect_size, effect_size)
+    pd.testing.assert_frame_equal(df_values_parents, df_after_miss)
+
+
+def test_cached_results_keep_the_state_of_the_dataframe(df_values_parents):
+    from source_assess_treatment_efficacy.caching import ResultCache
+    from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import run_meta_analysis
+
+    cache = ResultCache()
+    df_values = df_values_parents.copy()
+    run_meta_analysis(df_values, cache=cache)
+    df_fresh = df_values_parents.copy()
+    run_meta_analysis(df_fresh, cache=cache)
+
+    assert cache.statistics['memory_hits'] == 1
+    pd.testing.assert_frame_equal(df_fresh, df_values)
+
+
+def test_result_cache_on_disk_round_trip(df_values_parents, tmp_path):
+    from source_assess_treatment_efficacy.caching import ResultCache
+    from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import run_meta_analysis
+
+    _, df_results, _ = run_meta_analysis(df_values_parents.copy(), cache=ResultCache(directory=str(tmp_path)))
+    cache = ResultCache(directory=str(tmp_path))
+    _, cached_results, _ = run_meta_analysis(df_values_parents.copy(), cache=cache)
+
+    assert cache.statistics['disk_hits'] == 1
+    pd.testing.assert_frame_equal(cached_results, df_results)
+
+
+def test_miss_on_a_dataframe_with_the_added_columns_caches_them(df_values_parents):
+    from source_assess_treatment_efficacy.caching import ResultCache
+    from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import run_meta_analysis
+
+    df_values = df_values_parents.copy()
+    run_meta_analysis(df_values)
+    cache = ResultCache()
+    run_meta_analysis(df_values, cache=cache)
+    df_fresh = df_values_parents.copy()
+    run_meta_analysis(df_fresh, cache=cache)
+
+    assert cache.statistics['misses'] == 1 and cache.statistics['memory_hits'] == 1
+    pd.testing.assert_frame_equal(df_fresh, df_values)
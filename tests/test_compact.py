@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+
+import os
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+
+from source_assess_treatment_efficacy.compact import compact_dtypes, YES_NO, INTEGER_COLUMNS
+from source_assess_treatment_efficacy.bulk_import import import_directory
+from source_assess_treatment_efficacy.meta_analysis.import_csv_for_meta_analysis import import_csv
+from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import (run_meta_analysis,
+                                                                                  run_batched_meta_analysis)
+from source_assess_treatment_efficacy.systematic_analysis_of_biases import import_csv_for_factors, perform_saob
+
+from .conftest import EXAMPLES, META_ANALYSIS_CSV, SAOB_CSV
+
+
+@pytest.fixture(autouse=True)
+def ignore_warnings():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        yield
+
+
+def _imported_dataframes():
+    """Dataframes of each importer, with their standard types."""
+
+    df_values_parents, df_values_teachers = import_csv_for_factors.import_csv(SAOB_CSV)
+    return {'meta-analysis, parents': import_csv(META_ANALYSIS_CSV, 'Parents'),
+            'meta-analysis, long format': import_csv(META_ANALYSIS_CSV, long_format=True),
+            'saob': pd.concat([df_values_parents, df_values_teachers]),
+            'directory': import_directory(os.path.join(EXAMPLES, 'meta-analysis'))}
+
+
+def _as_csv_values(values):
+    """Values of a column as they are in the csv file: the nullable booleans are the yes/no strings."""
+
+    if values.dtype == 'boolean':
+        values = values.map({value: string for string, value in YES_NO.items()})
+    return [None if pd.isna(value) else value for value in values.astype(object)]
+
+
+@pytest.mark.parametrize('name', ['meta-analysis, parents', 'meta-analysis, long format', 'saob', 'directory'])
+def test_compact_types_keep_the_values_and_reduce_the_memory(name):
+    df = _imported_dataframes()[name]
+    df_compact = compact_dtypes(df)
+
+    assert list(df_compact.columns) == list(df.columns)
+    assert df_compact.index.to_frame(index=False).astype(object).equals(df.index.to_frame(index=False).astype(object))
+    for column in df.columns:
+        assert _as_csv_values(df_compact[column]) == _as_csv_values(df[column]), column
+    # Means, standard deviations and other floats are unchanged
+    for column in df.columns[(df.dtypes == float) & ~df.columns.isin(INTEGER_COLUMNS)]:
+        assert df_compact[column].dtype == float
+
+    # The example files are repeated to give a size where the index and the columns outweigh the fixed overheads
+    df = pd.concat([df]*1000)
+    assert compact_dtypes(df).memory_usage(deep=True).sum() < 0.7*df.memory_usage(deep=True).sum()
+
+
+def test_meta_analysis_of_compact_ratings_is_identical():
+    df_values = import_csv(META_ANALYSIS_CSV, 'Parents')
+    df_compact = import_csv(META_ANALYSIS_CSV, 'Parents', compact=True)
+    assert isinstance(df_compact.index, pd.CategoricalIndex)
+
+    for tau2_method in ['DL', 'REML']:
+        df_results_per_study, df_results, _ = run_meta_analysis(df_values.copy(), tau2_method=tau2_method)
+        df_compact_per_study, df_compact_results, _ = run_meta_analysis(df_compact.copy(), tau2_method=tau2_method)
+        pd.testing.assert_frame_equal(df_compact_results, df_results, check_exact=True)
+        pd.testing.assert_frame_equal(df_compact_per_study.reset_index(drop=True),
+                                      df_results_per_study.reset_index(drop=True), check_exact=True,
+                                      check_dtype=False)
+
+    _, df_results = run_batched_meta_analysis(import_csv(META_ANALYSIS_CSV, long_format=True), 'raters')
+    _, df_compact_results = run_batched_meta_analysis(import_csv(META_ANALYSIS_CSV, long_format=True, compact=True),
+                                                      'raters')
+    pd.testing.assert_frame_equal(df_compact_results, df_results, check_exact=True)
+
+
+def test_saob_factors_of_compact_ratings_are_identical():
+    factors = []
+    for compact in [False, True]:
+        df_values_parents, df_values_teachers = import_csv_for_factors.import_csv(SAOB_CSV, compact=compact)
+        df = pd.concat([df_values_parents, df_values_teachers])
+        df['effect_size_treatment'] = perform_saob.effect_size_within_subjects(df['mean_post_test_treatment'],
+                                                                              df['mean_pre_test_treatment'],
+                                                                              df['std_post_test_treatment'],
+                                                                              df['std_pre_test_treatment'])
+        df, df['effect_size_treatment'] = perform_saob.detect_and_reject_outliers(df, df['effect_size_treatment'])
+        factors.append(perform_saob.preprocess_factors(df))
+
+    (X, X_non_standardized), (X_compact, X_non_standardized_compact) = factors
+    pd.testing.assert_frame_equal(X_compact.reset_index(drop=True), X.reset_index(drop=True), check_exact=True)
+    # The numbers of sessions keep their small integer type
+    pd.testing.assert_frame_equal(X_non_standardized_compact.reset_index(drop=True),
+                                  X_non_standardized.reset_index(drop=True), check_exact=True, check_dtype=False)
+
+
+def test_integer_columns_stored_as_floats_are_compacted_without_missing_values():
+    df = pd.DataFrame({'year': [2011., 2016.], 'n_treatment': [18., np.nan], 'mean_pre_test_treatment': [1., 2.],
+                       'blind': ['yes', None], 'score_name': ['SNAP-IV', 'SNAP-IV']})
+    df_compact = compact_dtypes(df)
+
+    assert df_compact['year'].dtype == np.int16
+    assert df_compact['n_treatment'].dtype == float
+    assert df_compact['mean_pre_test_treatment'].dtype == float
+    assert df_compact['blind'].dtype == 'boolean' and df_compact['blind'].isna().tolist() == [False, True]
+    assert df_compact['score_name'].dtype == 'category'
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+
+from source_assess_treatment_efficacy.diagnostics import Diagnostics, DiagnosticsError
+from source_assess_treatment_efficacy.meta_analysis.import_csv_for_meta_analysis import import_csv
+from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import (run_meta_analysis,
+                                                                                  run_batched_meta_analysis)
+
+from .conftest import META_ANALYSIS_CSV
+
+
+SMALL_SAMPLE_MESSAGES = ['Since the sample size is too small, a correction factor is applied to the effect size',
+                         'Since the sample size is too small, a correction factor is applied to the variance of the '
+                         'effect size']
+
+
+def _with_small_samples(df_values, studies):
+    """Ratings in which some studies have less than 10 degrees of freedom, and thus a small sample correction."""
+
+    df_values = df_values.copy()
+    df_values.loc[df_values.index[studies], ['n_treatment', 'n_control']] = [5, 4]
+    return df_values
+
+
+@pytest.fixture
+def df_small_samples(df_values_parents):
+    return _with_small_samples(df_values_parents, [1, 4, 7])
+
+
+def test_small_sample_corrections_are_recorded(df_small_samples):
+    diagnostics = Diagnostics()
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        run_meta_analysis(df_small_samples.copy(), diagnostics=diagnostics)
+
+    expected = np.isin(np.arange(len(df_small_samples)), [1, 4, 7])
+    np.testing.assert_array_equal(diagnostics.mask('small_sample_correction'), expected)
+    np.testing.assert_array_equal(diagnostics.mask('small_sample_correction_of_the_variance'), expected)
+    assert diagnostics.counts == {'small_sample_correction': 3, 'small_sample_correction_of_the_variance': 3}
+    assert diagnostics.summary()['Total'].tolist() == [len(df_small_samples)]*2
+
+    # The result stores the same diagnostics
+    result = run_meta_analysis(df_small_samples.copy(), return_result=True, diagnostics='ignore')
+    np.testing.assert_array_equal(result.diagnostics.mask('small_sample_correction'), expected)
+
+
+def test_batched_meta_analyses_record_the_studies_in_their_order():
+    df_values = import_csv(META_ANALYSIS_CSV, long_format=True)
+    studies = [0, 5, len(df_values) - 1]
+    df_values = _with_small_samples(df_values, studies)
+
+    diagnostics = Diagnostics()
+    run_batched_meta_analysis(df_values, 'raters', diagnostics=diagnostics)
+
+    np.testing.assert_array_equal(np.flatnonzero(diagnostics.mask('small_sample_correction')), studies)
+    assert diagnostics.counts['small_sample_correction'] == 3
+
+
+def test_raise_gives_one_error_for_all_the_issues(df_small_samples):
+    with pytest.raises(DiagnosticsError, match=r'effect size \(3 of 16\); .* variance of the effect size \(3 of 16\)'):
+        run_meta_analysis(df_small_samples.copy(), diagnostics='raise')
+
+    diagnostics = Diagnostics()
+    diagnostics.flag('issue', np.array([False, False]), 'Issue')
+    diagnostics.emit('raise')
+    diagnostics.flag('issue', np.array([True, False]), 'Issue')
+    with pytest.raises(DiagnosticsError, match=r'^Issue \(1 of 4\)$'):
+        diagnostics.emit('raise')
+
+
+def test_warn_emits_one_summary_per_kind_of_issue(df_small_samples):
+    with warnings.catch_warnings(record=True) as recorded:
+        warnings.simplefilter('always')
+        run_meta_analysis(df_small_samples.copy())
+
+    assert [str(warning.message) for warning in recorded] == ['%s (3 of 16)' % message
+                                                              for message in SMALL_SAMPLE_MESSAGES]
+
+
+def test_log_emits_one_summary_per_kind_of_issue(df_small_samples, caplog):
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        with caplog.at_level(logging.WARNING, logger='source_assess_treatment_efficacy.diagnostics'):
+            run_meta_analysis(df_small_samples.copy(), diagnostics='log')
+
+    assert [record.getMessage() for record in caplog.records] == ['%s (3 of 16)' % message
+                                                                   for message in SMALL_SAMPLE_MESSAGES]
+
+
+def test_analyses_are_merged_into_the_given_diagnostics(df_small_samples, df_values_parents):
+    diagnostics = Diagnostics()
+    diagnostics.flag('tau2_not_converged', np.array([False]), 'Tau2 has not converged')
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        run_meta_analysis(df_small_samples.copy(), diagnostics=diagnostics)
+        run_meta_analysis(df_values_parents.copy(), diagnostics=diagnostics)
+        run_meta_analysis(df_small_samples.copy(), tau2_method='REML', diagnostics=diagnostics)
+
+    mask = diagnostics.mask('small_sample_correction')
+    assert mask.size == 3*len(df_small_samples)
+    np.testing.assert_array_equal(np.flatnonzero(mask), [1, 4, 7, 33, 36, 39])
+    assert diagnostics.mask('tau2_not_converged').tolist() == [False, False]
+    assert diagnostics.counts == {'tau2_not_converged': 0, 'small_sample_correction': 6,
+                                  'small_sample_correction_of_the_variance': 6}
+
+    # Merging a diagnostics into itself does not duplicate the issues
+    diagnostics.merge(diagnostics)
+    assert diagnostics.mask('small_sample_correction').size == 3*len(df_small_samples)
+
+
+def test_saob_regressions_record_the_conditioning_of_the_moment_matrix(capsys):
+    pytest.importorskip('statsmodels')
+    from source_assess_treatment_efficacy.systematic_analysis_of_biases import perform_saob
+
+    random_generator = np.random.default_rng(0)
+    index = ['Study %d' % (observation//2) for observation in range(30)]
+    X = pd.DataFrame(random_generator.normal(size=(30, 3)), columns=['a', 'b', 'c'], index=index)
+    y = pd.Series(random_generator.normal(size=30), index=index)
+    df = pd.DataFrame({'n_treatment': random_generator.integers(10, 40, 30)}, index=index)
+
+    diagnostics = Diagnostics()
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        perform_saob.weighted_linear_regression(df, X, y, diagnostics=diagnostics)
+        perform_saob.ordinary_linear_regression(X, y, diagnostics=diagnostics)
+
+    assert capsys.readouterr().out == ''
+    values, weight = X.to_numpy(), df['weight'].to_numpy()
+    np.testing.assert_allclose(diagnostics.values('condition_number'),
+                               [np.linalg.cond(values.T.dot((weight**2)[:, np.newaxis]*values)),
+                                np.linalg.cond(values.T.dot(values))])
+    assert diagnostics.values('moment_matrix_rank').tolist() == [3, 3]
+    assert diagnostics.counts == {'moment_matrix_not_invertible': 0}
+
+    # A collinear factor makes the moment matrix singular, reported by one warning
+    X['d'] = X['a'] + X['b']
+    with pytest.warns(UserWarning, match=r'Moment matrix is not invertible.*\(1 of 1\)') as recorded:
+        perform_saob.ordinary_linear_regression(X, y)
+    assert len([warning for warning in recorded if 'Moment matrix' in str(warning.message)]) == 1
+    assert capsys.readouterr().out == ''
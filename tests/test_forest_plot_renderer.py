@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import warnings
+from pathlib import Path
+import numpy as np
+import pytest
+
+matplotlib = pytest.importorskip('matplotlib')
+matplotlib.use('Agg')
+
+from source_assess_treatment_efficacy.meta_analysis.import_csv_for_meta_analysis import import_csv
+from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import (run_meta_analysis,
+                                                                                  run_batched_meta_analysis)
+from source_assess_treatment_efficacy.meta_analysis.forest_plot_renderer import (render_forest_plot,
+                                                                                 render_forest_plots)
+
+from .conftest import META_ANALYSIS_CSV
+
+
+@pytest.fixture(autouse=True)
+def ignore_warnings():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        yield
+
+
+def _page_labels(figure):
+    """Names of the studies of a page, from the top to the bottom, without the summary effect."""
+
+    return [label.get_text() for label in figure.axes[0].get_yticklabels()][1:]
+
+
+def test_pages_split_the_sorted_studies(df_values_parents):
+    df_results_per_study, df_results, _ = run_meta_analysis(df_values_parents)
+
+    figures = render_forest_plot(df_results_per_study, df_results, studies_per_page=5)
+
+    assert [len(_page_labels(figure)) for figure in figures] == [5, 5, 5, 1]
+    names = df_results_per_study.index.get_level_values(0).to_numpy()
+    order = np.argsort(df_results_per_study['Effect size'].to_numpy(), kind='stable')
+    assert sum([_page_labels(figure) for figure in figures], []) == list(names[order])
+    assert [figure.axes[0].get_title() for figure in figures] == ['Standard Mean Difference, 95%% Confidence Interval '
+                                                                  '(%d/4)' % page for page in range(1, 5)]
+
+
+@pytest.mark.parametrize('format', ['png', 'svg'])
+def test_pages_after_the_first_one_have_their_own_files(df_values_parents, tmp_path, format):
+    result = run_meta_analysis(df_values_parents, return_result=True)
+
+    files = render_forest_plot(result, studies_per_page=5, file=str(tmp_path / ('forest_plot.%s' % format)))
+
+    assert files == [str(tmp_path / ('forest_plot%s.%s' % (suffix, format)))
+                     for suffix in ['', '_page2', '_page3', '_page4']]
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(file) for file in files)
+    assert all(os.path.getsize(file) > 0 for file in files)
+
+
+def test_pdf_contains_all_the_pages(df_values_parents, tmp_path):
+    df_results_per_study, df_results, _ = run_meta_analysis(df_values_parents)
+
+    files = render_forest_plot(df_results_per_study, df_results, studies_per_page=3, file=str(tmp_path / 'plot.pdf'))
+
+    assert files == [str(tmp_path / 'plot.pdf')] and os.listdir(tmp_path) == ['plot.pdf']
+    with open(files[0], 'rb') as pdf:
+        content = pdf.read()
+    # One page object per page, 16 studies on pages of 3 studies
+    assert len(re.findall(rb'/Type\s*/Page\b', content)) == 6
+
+
+def test_no_figure_is_registered_with_pyplot(df_values_parents, tmp_path):
+    import matplotlib.pyplot as plt
+
+    plt.close('all')
+    result = run_meta_analysis(df_values_parents, return_result=True)
+    render_forest_plot(result, studies_per_page=5)
+    render_forest_plot(result, studies_per_page=5, file=str(tmp_path / 'forest_plot.png'))
+    render_forest_plot(result, studies_per_page=5, file=str(tmp_path / 'forest_plot.pdf'))
+
+    assert plt.get_fignums() == []
+
+
+def test_processes_write_the_same_files_as_the_current_process(tmp_path):
+    result = run_batched_meta_analysis(import_csv(META_ANALYSIS_CSV, long_format=True), 'raters', return_result=True)
+
+    contents = []
+    for n_jobs in [1, 2]:
+        directory = tmp_path / ('n_jobs_%d' % n_jobs)
+        directory.mkdir()
+        files = render_forest_plots(result, [str(directory / ('%s.png' % raters)) for raters in result.results_index],
+                                    n_jobs=n_jobs, studies_per_page=10)
+        assert [[os.path.relpath(file, directory) for file in rater_files] for rater_files in files] == [
+            ['Parents.png', 'Parents_page2.png'], ['Teachers.png']]
+        contents.append({os.path.relpath(file, directory): Path(file).read_bytes() for rater_files in files
+                         for file in rater_files})
+
+    assert contents[0] == contents[1]
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+
+import os
+import glob
+import warnings
+import pandas as pd
+import pytest
+
+from source_assess_treatment_efficacy.meta_analysis.import_csv_for_meta_analysis import (import_csv, import_csv_in_chunks,
+                                                                                         validate_csv)
+from source_assess_treatment_efficacy.meta_analysis.incremental_meta_analysis import MetaAnalysisAccumulator
+from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import run_meta_analysis
+
+from .conftest import EXAMPLES, META_ANALYSIS_CSV, assert_results_close
+
+
+# The examples have no clinicians' ratings
+RATERS = ['Parents', 'Teachers']
+
+
+@pytest.fixture(autouse=True)
+def ignore_warnings():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        yield
+
+
+@pytest.mark.parametrize('chunksize', [5, 13, 1000])
+def test_chunks_of_a_rater_in_accumulator_equal_run_meta_analysis(chunksize):
+    for rater in RATERS:
+        accumulator = MetaAnalysisAccumulator()
+        for df_values in import_csv_in_chunks(META_ANALYSIS_CSV, rater, chunksize=chunksize):
+            accumulator.add_studies(df_values)
+        _, df_expected, _ = run_meta_analysis(import_csv(META_ANALYSIS_CSV, rater))
+
+        assert_results_close(accumulator.results(), df_expected)
+
+
+@pytest.mark.parametrize('chunksize', [5, 13, 1000])
+def test_chunks_of_all_raters_in_accumulators_equal_run_meta_analysis(chunksize):
+    accumulators = {rater: MetaAnalysisAccumulator() for rater in RATERS}
+    for df_values in import_csv_in_chunks(META_ANALYSIS_CSV, chunksize=chunksize):
+        assert list(df_values.index.names) == ['Author', 'raters']
+        for rater, df_values_rater in df_values.groupby(level='raters'):
+            accumulators[rater].add_studies(df_values_rater)
+
+    for rater in RATERS:
+        _, df_expected, _ = run_meta_analysis(import_csv(META_ANALYSIS_CSV, rater))
+        assert_results_close(accumulators[rater].results(), df_expected)
+
+
+def test_chunks_contain_the_studies_of_import_csv():
+    df_expected = import_csv(META_ANALYSIS_CSV, long_format=True)
+    chunks = list(import_csv_in_chunks(META_ANALYSIS_CSV, chunksize=7))
+
+    studies = [study for df_values in chunks for study in df_values.index.swaplevel().tolist()]
+    assert sorted(studies) == sorted(df_expected.index.tolist())
+
+
+def _paired_studies(csv_file, rater):
+    """Ratings of a rater, paired study by study: the lines of a study share its Author, Year, Score Name and Raters."""
+
+    df = pd.read_csv(csv_file)
+    df = df[df['Raters'] == rater]
+    rows = []
+    for (author, year, score_name), df_study in df.groupby(['Author', 'Year', 'Score Name'], sort=False):
+        line = {(group, time): df_line.iloc[0] for (group, time), df_line in df_study.groupby(['Group', 'Time'])}
+        rows.append({'Author': author, 'year': year, 'score_name': score_name,
+                     'n_control': line[('Control', 'pre')]['Number of patients'],
+                     'n_treatment': line[('Treatment', 'pre')]['Number of patients'],
+                     **{'%s_%s_test_%s' % (statistic.lower(), time, group.lower()): line[(group, time)][statistic]
+                        for group in ['Treatment', 'Control'] for time in ['pre', 'post']
+                        for statistic in ['Mean', 'Std']}})
+
+    return pd.DataFrame(rows).set_index('Author')
+
+
+@pytest.mark.parametrize('csv_file', sorted(glob.glob(os.path.join(EXAMPLES, 'meta-analysis', '**', '*.csv'),
+                                                      recursive=True)))
+def test_one_pass_import_equals_study_by_study_pairing(csv_file):
+    assert len(validate_csv(csv_file)) == 0
+
+    df_ratings = import_csv(csv_file, long_format=True)
+    for rater in RATERS:
+        df_values = import_csv(csv_file, rater)
+        df_expected = _paired_studies(csv_file, rater)
+
+        assert df_values.index.get_level_values(0).tolist() == df_expected.index.tolist()
+        pd.testing.assert_frame_equal(df_values.reset_index(drop=True),
+                                      df_expected[df_values.columns].reset_index(drop=True), check_dtype=False)
+        pd.testing.assert_frame_equal(df_ratings.xs(rater, level='raters').reset_index(drop=True),
+                                      df_values.reset_index(drop=True))
+
+
+def test_lines_are_paired_by_study_whatever_their_order(tmp_path):
+    df = pd.read_csv(META_ANALYSIS_CSV)
+    shuffled_csv = tmp_path / 'shuffled.csv'
+    df.sample(frac=1, random_state=0).to_csv(shuffled_csv, index=False)
+
+    for rater in RATERS:
+        columns = ['Author', 'score_name']
+        df_values = import_csv(META_ANALYSIS_CSV, rater).reset_index().sort_values(columns, ignore_index=True)
+        df_shuffled = import_csv(str(shuffled_csv), rater).reset_index().sort_values(columns, ignore_index=True)
+        pd.testing.assert_frame_equal(df_shuffled, df_values)
+
+
+def test_validate_csv_lists_the_studies_that_cannot_be_paired(tmp_path):
+    df = pd.read_csv(META_ANALYSIS_CSV)
+    incomplete, duplicate = df['Author'].iloc[0], df['Author'].iloc[8]
+    lines = df.index.tolist()
+    lines.remove(1)
+    lines.insert(12, 10)
+    invalid_csv = tmp_path / 'invalid.csv'
+    df.loc[lines].to_csv(invalid_csv, index=False)
+
+    df_report = validate_csv(str(invalid_csv))
+    assert df_report.index.get_level_values('Author').tolist() == [incomplete, duplicate]
+    assert df_report['Incomplete'].tolist() == [True, True]
+    assert df_report['Duplicate'].tolist() == [False, True]
+    assert df_report.loc[incomplete, 'Treatment post'].tolist() == [0]
+
+    with pytest.warns(UserWarning, match='validate_csv'):
+        warnings.simplefilter('always')
+        df_values = import_csv(str(invalid_csv), 'Parents')
+    assert incomplete not in df_values.index.get_level_values(0)
+    assert duplicate in df_values.index.get_level_values(0)
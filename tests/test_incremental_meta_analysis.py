@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+
+import copy
+import pytest
+
+from source_assess_treatment_efficacy.meta_analysis.incremental_meta_analysis import MetaAnalysisAccumulator
+from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import run_meta_analysis
+
+from .conftest import assert_results_close
+
+
+def test_accumulator_equals_run_meta_analysis(df_values_parents):
+    accumulator = MetaAnalysisAccumulator()
+    accumulator.add_studies(df_values_parents)
+    _, df_expected, _ = run_meta_analysis(df_values_parents.copy())
+
+    assert_results_close(accumulator.results(), df_expected)
+
+
+def test_removed_studies_equal_run_meta_analysis_without_them(df_values_parents):
+    accumulator = MetaAnalysisAccumulator()
+    accumulator.add_studies(df_values_parents)
+    for name in df_values_parents.index.get_level_values(0)[:3]:
+        accumulator.remove_study(name)
+    _, df_expected, _ = run_meta_analysis(df_values_parents.iloc[3:].copy())
+
+    assert_results_close(accumulator.results(), df_expected)
+
+
+def test_add_studies_with_a_known_name_adds_nothing(df_values_parents):
+    accumulator = MetaAnalysisAccumulator()
+    accumulator.add_studies(df_values_parents.iloc[5:6])
+    state = copy.deepcopy(accumulator.__dict__)
+
+    with pytest.raises(ValueError, match='already in the meta-analysis'):
+        accumulator.add_studies(df_values_parents)
+    assert list(accumulator.studies) == list(state['studies'])
+    assert (accumulator._sums_fixed_model == state['_sums_fixed_model']).all()
+
+
+def test_add_studies_with_a_repeated_name_adds_nothing(df_values_parents):
+    accumulator = MetaAnalysisAccumulator()
+
+    with pytest.raises(ValueError, match='added several times'):
+        accumulator.add_studies(df_values_parents.iloc[[0, 1, 0]])
+    assert accumulator.studies == {}
+    assert (accumulator._sums_fixed_model == 0).all()
+
+
+def test_names_are_strings():
+    accumulator = MetaAnalysisAccumulator()
+
+    with pytest.raises(ValueError, match='must be a string'):
+        accumulator.add_study(3, 0.5, 0.2)
+    assert accumulator.studies == {}
+
+
+def test_save_and_load_keep_the_names(df_values_parents, tmp_path):
+    accumulator = MetaAnalysisAccumulator()
+    accumulator.add_studies(df_values_parents)
+    accumulator.save(str(tmp_path / 'living_review.npz'))
+
+    loaded = MetaAnalysisAccumulator.load(str(tmp_path / 'living_review.npz'))
+    assert loaded.studies == accumulator.studies
+    assert all(type(name) is str for name in loaded.studies)
+
+    loaded.remove_study(df_values_parents.index.get_level_values(0)[0])
+    _, df_expected, _ = run_meta_analysis(df_values_parents.iloc[1:].copy())
+    assert_results_close(loaded.results(), df_expected)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+import glob
+import os
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+
+from source_assess_treatment_efficacy.meta_analysis.import_csv_for_meta_analysis import import_csv
+from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import (run_meta_analysis,
+                                                                                  run_batched_meta_analysis)
+
+from .conftest import EXAMPLES
+
+
+CSV_FILES = sorted(glob.glob(os.path.join(EXAMPLES, 'meta-analysis', '**', '*.csv'), recursive=True))
+
+
+@pytest.fixture(autouse=True)
+def ignore_warnings():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        yield
+
+
+def test_dataframes_are_views_of_the_results(df_values_parents):
+    result = run_meta_analysis(df_values_parents, return_result=True)
+
+    df_results_per_study = result.per_study_dataframe()
+    df_results = result.results_dataframe()
+    for i, column in enumerate(result.PER_STUDY_COLUMNS):
+        assert np.shares_memory(df_results_per_study[column].to_numpy(), result.per_study[:, i]), column
+    for i, column in enumerate(result.RESULTS_COLUMNS):
+        assert np.shares_memory(df_results[column].to_numpy(), result.results[:, i]), column
+
+    # The legacy dataframes are copies
+    assert not np.shares_memory(result.per_study_dataframe(legacy=True)['Effect size'].to_numpy(), result.per_study)
+    assert not np.shares_memory(result.results_dataframe(legacy=True)['Tau2'].to_numpy(), result.results)
+
+
+@pytest.mark.parametrize('csv_file', CSV_FILES, ids=[os.path.basename(csv_file) for csv_file in CSV_FILES])
+@pytest.mark.parametrize('raters', ['Parents', 'Teachers'])
+def test_legacy_dataframes_equal_run_meta_analysis(csv_file, raters):
+    df_values = import_csv(csv_file, raters)
+    df_results_per_study, df_results, _ = run_meta_analysis(df_values.copy())
+    result = run_meta_analysis(df_values.copy(), return_result=True)
+
+    # The years keep their type, floats for the files with empty lines
+    pd.testing.assert_frame_equal(result.per_study_dataframe(legacy=True), df_results_per_study)
+    # Tau² is the integer 0 in the dataframe of ``run_meta_analysis`` when it is truncated
+    pd.testing.assert_frame_equal(result.results_dataframe(legacy=True), df_results, check_dtype=False)
+
+
+def test_legacy_dataframes_of_batched_meta_analyses_keep_the_types_of_the_years():
+    df_values = import_csv(CSV_FILES[0], long_format=True)
+    df_values['year'] = df_values['year'].astype(float)
+    df_values.loc[df_values.index[0], 'year'] = np.nan
+    result = run_batched_meta_analysis(df_values.copy(), 'raters', return_result=True)
+
+    df_results_per_study = result.per_study_dataframe(legacy=True)
+    assert df_results_per_study['Year'].dtype == float
+    np.testing.assert_array_equal(df_results_per_study['Year'], df_values['year'])
+
+    result = run_batched_meta_analysis(import_csv(CSV_FILES[0], long_format=True, compact=True), 'raters',
+                                       return_result=True)
+    assert result.per_study_dataframe(legacy=True)['Year'].dtype == np.int16
+
+
+def test_exports_share_the_memory_of_the_results(df_values_parents):
+    result = run_meta_analysis(df_values_parents, return_result=True)
+
+    assert result.to_numpy() is result.per_study
+    assert result.to_numpy(results=True) is result.results
+
+    pytest.importorskip('pyarrow')
+    for results, values in [(False, result.per_study), (True, result.results)]:
+        table = result.to_arrow(results=results)
+        assert table.column_names == (result.RESULTS_COLUMNS if results else result.PER_STUDY_COLUMNS)
+        for i in range(values.shape[1]):
+            chunks = table.column(i).chunks
+            assert len(chunks) == 1
+            # Buffer of the values of the Arrow column, at the address of the column of the block
+            assert chunks[0].buffers()[1].address == values[:, i].ctypes.data
+            np.testing.assert_array_equal(chunks[0].to_numpy(), values[:, i])
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+import scipy.stats as scp
+
+from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import run_meta_analysis
+from source_assess_treatment_efficacy.meta_analysis.meta_regression import (run_meta_regression,
+                                                                          _estimate_residual_tau2)
+
+
+def _refit(X, effect_size, variance_ES):
+    """Meta-regression refitted by normal equations: method of moments residual Tau² and Knapp and Hartung covariance."""
+
+    k, p = X.shape
+    weight = 1/variance_ES
+    projection = np.linalg.inv(X.T.dot(weight[:, np.newaxis]*X))
+    residual = effect_size - X.dot(projection.dot(X.T.dot(weight*effect_size)))
+    Q_residual = np.sum(weight*residual**2)
+    trace = np.sum(weight) - np.trace(projection.dot(X.T.dot((weight**2)[:, np.newaxis]*X)))
+    Tau2 = max((Q_residual - (k - p))/trace, 0)
+
+    weight = 1/(variance_ES + Tau2)
+    projection = np.linalg.inv(X.T.dot(weight[:, np.newaxis]*X))
+    coefficients = projection.dot(X.T.dot(weight*effect_size))
+    scale = np.sum(weight*(effect_size - X.dot(coefficients))**2)/(k - p)
+
+    return coefficients, np.sqrt(np.diagonal(scale*projection)), Tau2, Q_residual
+
+
+def _effect_sizes(df_values):
+    df_results_per_study, _, _ = run_meta_analysis(df_values.copy())
+    return (df_results_per_study['Effect size'].to_numpy(),
+            df_results_per_study['Standard Error of the ES'].to_numpy()**2)
+
+
+def test_year_moderator_equals_refit(df_values_parents):
+    effect_size, variance_ES = _effect_sizes(df_values_parents)
+    df_coefficients, df_models = run_meta_regression(df_values_parents, 'year')
+
+    X = np.column_stack([np.ones(len(effect_size)), df_values_parents['year'].to_numpy(dtype=float)])
+    coefficients, standard_error, Tau2, Q_residual = _refit(X, effect_size, variance_ES)
+
+    np.testing.assert_allclose(df_coefficients.loc['year', 'Coefficient'], coefficients, rtol=1e-8)
+    np.testing.assert_allclose(df_coefficients.loc['year', 'Standard Error'], standard_error, rtol=1e-8)
+    np.testing.assert_allclose(df_models.loc['year', 'Tau2'], Tau2, rtol=1e-8, atol=1e-12)
+    np.testing.assert_allclose(df_models.loc['year', 'Q residual'], Q_residual, rtol=1e-8)
+    np.testing.assert_allclose(df_models.loc['year', 'p-value Residual Heterogeneity'],
+                               scp.chi2.sf(Q_residual, len(effect_size) - 2), rtol=1e-8)
+
+
+def test_categorical_moderator_equals_refit(df_values_parents):
+    effect_size, variance_ES = _effect_sizes(df_values_parents)
+    df_coefficients, df_models = run_meta_regression(df_values_parents, [['score_name'], ['year', 'score_name']])
+
+    levels = np.unique(df_values_parents['score_name'])
+    indicators = (df_values_parents['score_name'].to_numpy()[:, np.newaxis] == levels[1:]).astype(float)
+    assert (df_coefficients.loc['score_name'].index[1:] == ['score_name[%s]' % level for level in levels[1:]]).all()
+
+    X = np.column_stack([np.ones(len(effect_size)), indicators])
+    coefficients, standard_error, Tau2, _ = _refit(X, effect_size, variance_ES)
+    np.testing.assert_allclose(df_coefficients.loc['score_name', 'Coefficient'], coefficients, rtol=1e-7)
+    np.testing.assert_allclose(df_coefficients.loc['score_name', 'Standard Error'], standard_error, rtol=1e-7)
+    np.testing.assert_allclose(df_models.loc['score_name', 'Tau2'], Tau2, rtol=1e-7, atol=1e-12)
+
+    X = np.column_stack([np.ones(len(effect_size)), df_values_parents['year'].to_numpy(dtype=float), indicators])
+    coefficients, standard_error, _, _ = _refit(X, effect_size, variance_ES)
+    np.testing.assert_allclose(df_coefficients.loc['year + score_name', 'Coefficient'], coefficients, rtol=1e-6)
+    np.testing.assert_allclose(df_coefficients.loc['year + score_name', 'Standard Error'], standard_error, rtol=1e-6)
+
+
+@pytest.mark.parametrize('tau2_method', ['DL', 'REML'])
+def test_intercept_only_model_equals_meta_analysis(df_values_parents, tau2_method):
+    df_coefficients, df_models = run_meta_regression(df_values_parents, [[]], tau2_method=tau2_method)
+    _, df_results, _ = run_meta_analysis(df_values_parents.copy(), tau2_method=tau2_method)
+
+    np.testing.assert_allclose(df_models['Tau2'], df_results['Tau2'], rtol=1e-6, atol=1e-10)
+    np.testing.assert_allclose(df_coefficients['Coefficient'], df_results['Summary Effect'], rtol=1e-6)
+
+
+def test_models_fitted_together_equal_separate_fits(df_values_parents):
+    df_values = df_values_parents.copy()
+    df_values['size'] = df_values['n_treatment'] + df_values['n_control']
+    df_values.loc[df_values.index[0], 'size'] = np.nan
+    moderators = [['year'], ['size'], ['score_name']]
+    df_coefficients, df_models = run_meta_regression(df_values, moderators)
+
+    for moderators_set in moderators:
+        df_expected_coefficients, df_expected_models = run_meta_regression(df_values, moderators_set)
+        pd.testing.assert_frame_equal(df_coefficients.loc[moderators_set], df_expected_coefficients, rtol=1e-10)
+        pd.testing.assert_frame_equal(df_models.loc[moderators_set], df_expected_models, rtol=1e-10)
+    assert df_models.loc['size', 'Number of studies'] == len(df_values) - 1
+
+
+def _negative_restricted_log_likelihood(Tau2, X, effect_size, variance_ES):
+    """Negative restricted log-likelihood of a meta-regression, up to a constant."""
+
+    weight = 1/(variance_ES + Tau2)
+    information = X.T.dot(weight[:, np.newaxis]*X)
+    residual = effect_size - X.dot(np.linalg.solve(information, X.T.dot(weight*effect_size)))
+    return (np.sum(np.log(variance_ES + Tau2)) + np.linalg.slogdet(information)[1] + np.sum(weight*residual**2))/2
+
+
+def _restricted_maximum_likelihood_tau2(X, effect_size, variance_ES):
+    """Residual Tau² maximizing the restricted likelihood, by a grid search refined by a bounded 1-D minimisation."""
+
+    from scipy.optimize import minimize_scalar
+
+    grid = np.linspace(0, 4*max(np.var(effect_size), np.max(variance_ES)), 101)
+    values = [_negative_restricted_log_likelihood(Tau2, X, effect_size, variance_ES) for Tau2 in grid]
+    best = np.argmin(values)
+    result = minimize_scalar(_negative_restricted_log_likelihood, bounds=(grid[max(best - 1, 0)], grid[best + 1]),
+                             args=(X, effect_size, variance_ES), method='bounded', options={'xatol': 1e-12})
+    return result.x if result.fun < values[0] else 0.
+
+
+@pytest.mark.parametrize('n_coefficients', [2, 3])
+def test_reml_residual_tau2_equals_direct_maximisation(n_coefficients):
+    # Simulated sets of 12 studies, each fitted with random moderators, among which some make the Fisher scoring
+    # oscillate or have a second maximum of the restricted likelihood at Tau² = 0
+    random_generator = np.random.default_rng(0)
+    n_sets, n_models, n_studies = 10, 100, 12
+    for _ in range(n_sets):
+        variance_ES = random_generator.uniform(0.01, 0.3, n_studies)
+        effect_size = random_generator.normal(0, np.sqrt(variance_ES + random_generator.uniform(0, 0.3)))
+        X = np.concatenate([np.ones((n_models, n_studies, 1)),
+                            random_generator.normal(size=(n_models, n_studies, n_coefficients - 1))], axis=2)
+        with warnings.catch_warnings():
+            warnings.simplefilter('error')
+            Tau2, _ = _estimate_residual_tau2(X, effect_size, variance_ES, np.ones((n_models, n_studies), bool),
+                                              'REML')
+
+        Tau2_expected = [_restricted_maximum_likelihood_tau2(X[model], effect_size, variance_ES)
+                         for model in range(n_models)]
+        np.testing.assert_allclose(Tau2, Tau2_expected, atol=1e-6)
@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+
+import os
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+
+from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import (run_meta_analysis,
+                                                                                  run_batched_meta_analysis)
+
+from .conftest import EXAMPLES, assert_results_close
+
+
+TAU2_METHODS = ['DL', 'REML', 'ML', 'PM', 'SJ', 'HE']
+
+# Results of the row-wise run_meta_analysis (before the computations on arrays) on the example files, and on the
+# parents' and teachers' ratings of data-update/values_total_meta_analysis.csv in which the studies SMALL_SAMPLES have
+# samples small enough to be corrected
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+BASELINE_RESULTS = pd.read_csv(os.path.join(BASELINE, 'baseline_meta_analysis_results.csv'))
+SMALL_SAMPLES = [1, 4, 7]
+
+
+@pytest.mark.parametrize('csv_file, raters, small_samples',
+                         list(BASELINE_RESULTS[['file', 'raters', 'small_samples']].itertuples(index=False, name=None)))
+def test_results_equal_the_row_wise_baseline(csv_file, raters, small_samples):
+    from source_assess_treatment_efficacy.meta_analysis.import_csv_for_meta_analysis import import_csv
+
+    df_values = import_csv(os.path.join(EXAMPLES, 'meta-analysis', *csv_file.split('/')), raters)
+    if small_samples:
+        df_values.loc[df_values.index[SMALL_SAMPLES], ['n_treatment', 'n_control']] = [5, 4]
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        df_results_per_study, df_results, _ = run_meta_analysis(df_values)
+
+    df_expected_per_study = pd.read_csv(os.path.join(BASELINE, 'baseline_meta_analysis_per_study.csv'))
+    df_expected_per_study = df_expected_per_study[(df_expected_per_study['file'] == csv_file)
+                                                  & (df_expected_per_study['raters'] == raters)
+                                                  & (df_expected_per_study['small_samples'] == small_samples)]
+    assert list(df_results_per_study.index.get_level_values(0)) == df_expected_per_study['Author'].tolist()
+    for column in ['Effect size', 'Standard Error of the ES']:
+        np.testing.assert_allclose(df_results_per_study[column], df_expected_per_study[column], rtol=1e-12,
+                                   err_msg=column)
+
+    expected = BASELINE_RESULTS[(BASELINE_RESULTS['file'] == csv_file) & (BASELINE_RESULTS['raters'] == raters)
+                                & (BASELINE_RESULTS['small_samples'] == small_samples)].iloc[0]
+    df_expected = pd.DataFrame({column: [(expected[column.replace('95% Confidence Interval', 'Lower limit')],
+                                          expected[column.replace('95% Confidence Interval', 'Upper limit')])]
+                                if column.startswith('95%') else [expected[column]] for column in df_results.columns},
+                               index=df_results.index)
+    assert_results_close(df_results, df_expected, rtol=1e-12, atol=1e-14)
+
+
+@pytest.mark.parametrize('tau2_method', TAU2_METHODS)
+def test_batch_with_a_single_study_group(df_values_parents, tau2_method):
+    df_values = df_values_parents.copy()
+    df_values['subset'] = np.where(np.arange(len(df_values)) == 0, 'single', 'many')
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error', RuntimeWarning)
+        df_results_per_study, df_results = run_batched_meta_analysis(df_values, 'subset', tau2_method=tau2_method,
+                                                                     diagnostics='ignore')
+
+    assert df_results.loc['single', 'Tau2'] == 0
+    np.testing.assert_allclose(df_results.loc['single', 'Summary Effect'], df_results_per_study['Effect size'].iloc[0])
+    assert np.isfinite(df_results[['Tau2', 'Summary Effect', 'Variance Summary Effect']].to_numpy(dtype=float)).all()
+
+    _, df_expected, _ = run_meta_analysis(df_values_parents.iloc[1:].copy(), tau2_method=tau2_method)
+    df_many = df_results.loc[['many']].drop(columns='Number of studies')
+    assert_results_close(df_many, df_expected.set_axis(['many']))
+
+
+@pytest.mark.parametrize('tau2_method', TAU2_METHODS)
+def test_batch_by_rater_equals_separate_runs(tau2_method):
+    from source_assess_treatment_efficacy.meta_analysis.import_csv_for_meta_analysis import import_csv
+    from .conftest import META_ANALYSIS_CSV
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        df_values = import_csv(META_ANALYSIS_CSV, long_format=True)
+        _, df_results = run_batched_meta_analysis(df_values.copy(), 'raters', tau2_method=tau2_method)
+        for rater in ['Parents', 'Teachers']:
+            _, df_expected, _ = run_meta_analysis(import_csv(META_ANALYSIS_CSV, rater), tau2_method=tau2_method)
+            assert_results_close(df_results.loc[[rater]].drop(columns='Number of studies'),
+                                 df_expected.set_axis([rater]))
+
+
+def _negative_log_likelihood(Tau2, effect_size, variance_ES, tau2_method):
+    """Negative (restricted) log-likelihood of a meta-analysis, up to a constant."""
+
+    weight = 1/(variance_ES + Tau2)
+    summary_effect = np.sum(weight*effect_size)/np.sum(weight)
+    value = (np.sum(np.log(variance_ES + Tau2)) + np.sum(weight*(effect_size - summary_effect)**2))/2
+    return value + np.log(np.sum(weight))/2 if tau2_method == 'REML' else value
+
+
+def _maximum_likelihood_tau2(effect_size, variance_ES, tau2_method):
+    """Tau² maximizing the (restricted) likelihood, by a grid search refined by a bounded 1-D minimisation."""
+
+    from scipy.optimize import minimize_scalar
+
+    grid = np.linspace(0, 4*max(np.var(effect_size), np.max(variance_ES)), 101)
+    values = [_negative_log_likelihood(Tau2, effect_size, variance_ES, tau2_method) for Tau2 in grid]
+    best = np.argmin(values)
+    result = minimize_scalar(_negative_log_likelihood, bounds=(grid[max(best - 1, 0)], grid[best + 1]),
+                             args=(effect_size, variance_ES, tau2_method), method='bounded',
+                             options={'xatol': 1e-12})
+    return result.x if result.fun < values[0] else 0.
+
+
+@pytest.mark.parametrize('tau2_method', ['REML', 'ML'])
+def test_likelihood_estimators_equal_direct_maximisation(tau2_method):
+    from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import _estimate_tau2
+
+    # Simulated meta-analyses of 15 studies, among which some make the Fisher scoring oscillate or have a second
+    # maximum of the likelihood at Tau² = 0
+    random_generator = np.random.default_rng(0)
+    n_groups, n_studies = 1500, 15
+    variance_ES = random_generator.uniform(0.01, 0.3, (n_groups, n_studies))
+    Tau2 = random_generator.uniform(0, 0.3, n_groups)
+    effect_size = random_generator.normal(0, np.sqrt(variance_ES + Tau2[:, np.newaxis]))
+
+    weight = 1/variance_ES
+    fixed_effect = np.sum(weight*effect_size, axis=1)/np.sum(weight, axis=1)
+    Q = np.sum(weight*(effect_size - fixed_effect[:, np.newaxis])**2, axis=1)
+    C = np.sum(weight, axis=1) - np.sum(weight**2, axis=1)/np.sum(weight, axis=1)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        Tau2_estimated = _estimate_tau2(effect_size.ravel(), variance_ES.ravel(),
+                                        np.repeat(np.arange(n_groups), n_studies), n_groups, tau2_method,
+                                        np.maximum((Q - (n_studies - 1))/C, 0))
+
+    Tau2_expected = np.array([_maximum_likelihood_tau2(effect_size[group], variance_ES[group], tau2_method)
+                              for group in range(n_groups)])
+    np.testing.assert_allclose(Tau2_estimated, Tau2_expected, atol=1e-6)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+from source_assess_treatment_efficacy.meta_analysis.power_simulation import run_power_simulation
+
+
+def test_power_is_the_significance_level_without_effect():
+    df_power = run_power_simulation(n_studies=20, n_treatment=100, effect_size=0., n_simulations=4000, random_state=0)
+    power = df_power['Power'].iloc[0]
+
+    # Within 4 Monte Carlo standard errors of alpha, and of the nominal coverage
+    assert abs(power - 0.05) < 4*np.sqrt(0.05*0.95/4000)
+    assert abs(df_power['Coverage'].iloc[0] - 0.95) < 4*np.sqrt(0.05*0.95/4000)
+    assert abs(df_power['Mean Summary Effect'].iloc[0]) < 0.01
+
+
+def test_power_increases_with_the_number_of_studies():
+    df_power = run_power_simulation(n_studies=[3, 10, 30], n_treatment=30, effect_size=-0.3, Tau2=0.02,
+                                    n_simulations=1000, random_state=1)
+    power = df_power['Power'].to_numpy()
+
+    assert np.all(np.diff(power) > 0)
+    assert list(df_power.index.names) == ['n_studies', 'n_treatment', 'n_control', 'effect_size', 'Tau2',
+                                          'pre_post_correlation']
+
+
+def test_simulations_are_reproducible_whatever_the_number_of_processes():
+    kwargs = dict(n_studies=[5, 10], n_treatment=20, effect_size=-0.2, Tau2=[0, 0.05], n_simulations=500,
+                  random_state=2, shard_size=200)
+
+    pd.testing.assert_frame_equal(run_power_simulation(**kwargs), run_power_simulation(n_jobs=2, **kwargs))
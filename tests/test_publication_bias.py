@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+
+from source_assess_treatment_efficacy.meta_analysis.import_csv_for_meta_analysis import import_csv
+from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import (run_meta_analysis,
+                                                                                  run_batched_meta_analysis)
+from source_assess_treatment_efficacy.meta_analysis.publication_bias import (run_egger_test, run_begg_test,
+                                                                             run_trim_and_fill, funnel_plot)
+
+from .conftest import META_ANALYSIS_CSV
+
+
+def _arrays(df_results_per_study):
+    return (df_results_per_study['Effect size'].to_numpy(dtype=float),
+            df_results_per_study['Standard Error of the ES'].to_numpy(dtype=float))
+
+
+def test_egger_test_equals_least_squares(df_values_parents):
+    df_results_per_study, _, _ = run_meta_analysis(df_values_parents.copy())
+    df_egger = run_egger_test(df_results_per_study)
+
+    effect_size, standard_error_ES = _arrays(df_results_per_study)
+    X = np.column_stack([np.ones(len(effect_size)), 1/standard_error_ES])
+    coefficients, residuals, _, _ = np.linalg.lstsq(X, effect_size/standard_error_ES, rcond=None)
+    covariance = residuals[0]/(len(effect_size) - 2)*np.linalg.inv(X.T.dot(X))
+
+    np.testing.assert_allclose(df_egger['Intercept'], coefficients[0])
+    np.testing.assert_allclose(df_egger['Slope'], coefficients[1])
+    np.testing.assert_allclose(df_egger['Standard Error of the Intercept'], np.sqrt(covariance[0, 0]))
+
+
+def test_begg_test_equals_pairwise_comparisons(df_values_parents):
+    df_results_per_study, _, _ = run_meta_analysis(df_values_parents.copy())
+    df_begg = run_begg_test(df_results_per_study)
+
+    effect_size, standard_error_ES = _arrays(df_results_per_study)
+    variance_ES = standard_error_ES**2
+    summary_effect = (effect_size/variance_ES).sum()/(1/variance_ES).sum()
+    deviation = (effect_size - summary_effect)/np.sqrt(variance_ES - 1/(1/variance_ES).sum())
+    k = len(effect_size)
+    score = sum(np.sign(deviation[i] - deviation[j])*np.sign(variance_ES[i] - variance_ES[j])
+                for i in range(k) for j in range(i + 1, k))
+
+    np.testing.assert_allclose(df_begg["Kendall's tau"], score/(k*(k - 1)/2))
+
+
+def test_batched_tests_equal_separate_runs():
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        df_values = import_csv(META_ANALYSIS_CSV, long_format=True)
+        df_results_per_study, _ = run_batched_meta_analysis(df_values, 'raters')
+        for rater in ['Parents', 'Teachers']:
+            df_rater, _, _ = run_meta_analysis(import_csv(META_ANALYSIS_CSV, rater))
+            for test in [run_egger_test, run_begg_test]:
+                np.testing.assert_allclose(test(df_results_per_study, group_by='raters').loc[rater].to_numpy(dtype=float),
+                                           test(df_rater).iloc[0].to_numpy(dtype=float))
+
+
+def test_trim_and_fill_pools_the_filled_studies(df_values_parents):
+    df_results_per_study, _, _ = run_meta_analysis(df_values_parents.copy())
+    df_results, df_filled_studies = run_trim_and_fill(df_results_per_study, side='right')
+    assert len(df_filled_studies) == df_results['Number of missing studies'].iloc[0] > 0
+
+    # DerSimonian and Laird on the observed and filled studies
+    effect_size, standard_error_ES = _arrays(pd.concat([df_results_per_study, df_filled_studies]))
+    weight = 1/standard_error_ES**2
+    Q = (weight*effect_size**2).sum() - (weight*effect_size).sum()**2/weight.sum()
+    Tau2 = max((Q - (len(weight) - 1))/(weight.sum() - (weight**2).sum()/weight.sum()), 0)
+    weight_random = 1/(standard_error_ES**2 + Tau2)
+
+    np.testing.assert_allclose(df_results['Tau2'].iloc[0], Tau2)
+    np.testing.assert_allclose(df_results['Summary Effect'].iloc[0], (weight_random*effect_size).sum()/weight_random.sum())
+
+
+def test_funnel_plot_does_not_use_pyplot(df_values_parents, tmp_path):
+    pytest.importorskip('matplotlib')
+    from matplotlib.figure import Figure
+
+    df_results_per_study, _, _ = run_meta_analysis(df_values_parents.copy())
+    df_results, df_filled_studies = run_trim_and_fill(df_results_per_study, side='right')
+    figure = funnel_plot(df_results_per_study, df_results, df_filled_studies)
+    figure.savefig(str(tmp_path / 'funnel_plot.png'))
+
+    assert isinstance(figure, Figure)
+    assert len(figure.axes[0].collections) == 2
+    assert 'matplotlib.pyplot' not in sys.modules or not sys.modules['matplotlib.pyplot'].get_fignums()
@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pd
+
+from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import run_meta_analysis
+from source_assess_treatment_efficacy.meta_analysis.resampling import run_bootstrap, run_heterogeneity_test
+
+
+def test_heterogeneity_test_does_not_need_the_columns_added_by_run_meta_analysis(df_values_parents):
+    df_values = df_values_parents.copy()
+    _, df_results, _ = run_meta_analysis(df_values, pre_post_correlation=0.3)
+    df_values_result = df_values_parents.copy()
+    run_meta_analysis(df_values_result, pre_post_correlation=0.3, return_result=True)
+
+    Q_simulations = {}
+    for name, df in [('modified', df_values), ('result', df_values_result), ('imported', df_values_parents)]:
+        p_value, Q_simulations[name] = run_heterogeneity_test(df, df_results, pre_post_correlation=0.3,
+                                                              n_simulations=2000, random_state=0)
+        assert 0 < p_value <= 1
+
+    assert 'effect_size' not in df_values_parents.columns
+    np.testing.assert_array_equal(Q_simulations['imported'], Q_simulations['modified'])
+    np.testing.assert_array_equal(Q_simulations['result'], Q_simulations['modified'])
+
+
+def test_heterogeneity_test_uses_the_reversed_scales(df_values_parents):
+    scale = df_values_parents['score_name'].iloc[0]
+    _, df_results, _ = run_meta_analysis(df_values_parents.copy(), scale_to_reverse=[scale])
+
+    _, Q_simulations = run_heterogeneity_test(df_values_parents, df_results, n_simulations=500, random_state=0,
+                                              scale_to_reverse=[scale])
+    # Under the null hypothesis, the simulated Q follow approximately a chi-squared with k - 1 degrees of freedom
+    assert abs(np.mean(Q_simulations) - (len(df_values_parents) - 1)) < 3
+
+
+def test_heterogeneity_test_is_reproducible_whatever_the_number_of_processes(df_values_parents):
+    _, df_results, _ = run_meta_analysis(df_values_parents.copy())
+
+    _, Q_serial = run_heterogeneity_test(df_values_parents, df_results, n_simulations=1000, random_state=1,
+                                         shard_size=300)
+    _, Q_parallel = run_heterogeneity_test(df_values_parents, df_results, n_simulations=1000, random_state=1,
+                                           shard_size=300, n_jobs=2)
+
+    np.testing.assert_array_equal(Q_serial, Q_parallel)
+
+
+def test_bootstrap_is_reproducible_whatever_the_number_of_processes(df_values_parents):
+    df_results_per_study, df_results, _ = run_meta_analysis(df_values_parents.copy())
+
+    df_bootstrap, df_replicates = run_bootstrap(df_results_per_study, df_results, n_bootstrap=500, random_state=3,
+                                                shard_size=200)
+    _, df_replicates_parallel = run_bootstrap(df_results_per_study, df_results, n_bootstrap=500, random_state=3,
+                                              shard_size=200, n_jobs=2)
+
+    pd.testing.assert_frame_equal(df_replicates, df_replicates_parallel)
+    assert (df_bootstrap['Lower limit'] <= df_bootstrap['Upper limit']).all()
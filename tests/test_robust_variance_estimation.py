@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import warnings
+import numpy as np
+import pandas as pd
+import pytest
+
+from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import run_meta_analysis
+from source_assess_treatment_efficacy.meta_analysis.meta_regression import run_meta_regression
+from source_assess_treatment_efficacy.meta_analysis.robust_variance_estimation import run_robust_meta_analysis
+
+
+def _refit(X, effect_size, variance_ES, clusters, rho):
+    """Correlated effects model refitted study by study with dense matrices."""
+
+    n_clusters, n_coefficients = clusters.max() + 1, X.shape[1]
+    studies = [np.flatnonzero(clusters == study) for study in range(n_clusters)]
+    weight = np.array([1/(len(rows)*np.mean(variance_ES[rows])) for rows in studies])
+
+    def weighted_least_squares(weight):
+        M = sum(weight[study]*X[rows].T.dot(X[rows]) for study, rows in enumerate(studies))
+        coefficients = np.linalg.solve(M, sum(weight[study]*X[rows].T.dot(effect_size[rows])
+                                              for study, rows in enumerate(studies)))
+        return np.linalg.inv(M), coefficients, effect_size - X.dot(coefficients)
+
+    inverse_M, _, residuals = weighted_least_squares(weight)
+    Q_E = sum(weight[study]*residuals[rows].dot(residuals[rows]) for study, rows in enumerate(studies))
+    trace_sampling, trace_random_effect = 0, 0
+    for study, rows in enumerate(studies):
+        ones = np.ones((len(rows), len(rows)))
+        sampling_covariance = np.mean(variance_ES[rows])*((1 - rho)*np.eye(len(rows)) + rho*ones)
+        trace_sampling += weight[study]**2*np.trace(inverse_M.dot(X[rows].T.dot(sampling_covariance).dot(X[rows])))
+        trace_random_effect += weight[study]**2*np.trace(inverse_M.dot(X[rows].T.dot(ones).dot(X[rows])))
+    sum_weights = sum(len(rows)*weight[study] for study, rows in enumerate(studies))
+    Tau2 = max((Q_E - n_clusters + trace_sampling)/(sum_weights - trace_random_effect), 0)
+
+    weight = np.array([1/(len(rows)*(np.mean(variance_ES[rows]) + Tau2)) for rows in studies])
+    inverse_M, coefficients, residuals = weighted_least_squares(weight)
+    meat = sum(np.outer(X[rows].T.dot(weight[study]*residuals[rows]), X[rows].T.dot(weight[study]*residuals[rows]))
+               for study, rows in enumerate(studies))
+    covariance = n_clusters/(n_clusters - n_coefficients)*inverse_M.dot(meat).dot(inverse_M)
+
+    return coefficients, np.sqrt(np.diag(covariance)), Tau2
+
+
+@pytest.mark.parametrize('rho', [0, 0.8])
+def test_one_effect_per_study_equals_dersimonian_laird(df_values_parents, rho):
+    df_coefficients, df_results = run_robust_meta_analysis(df_values_parents, rho=rho)
+    df_results_per_study, df_expected, _ = run_meta_analysis(df_values_parents.copy())
+
+    np.testing.assert_allclose(df_results.loc['Results', 'Tau2'], df_expected['Tau2'].iloc[0], rtol=1e-8, atol=1e-12)
+    np.testing.assert_allclose(df_coefficients.loc['Intercept', 'Coefficient'],
+                               df_expected['Summary Effect'].iloc[0], rtol=1e-8)
+
+    # Sandwich estimator of the variance of the summary effect, with the small-sample correction m/(m - 1)
+    weight = 1/(df_results_per_study['Standard Error of the ES'].to_numpy()**2 + df_expected['Tau2'].iloc[0])
+    residuals = df_results_per_study['Effect size'].to_numpy() - df_expected['Summary Effect'].iloc[0]
+    n_studies = len(weight)
+    np.testing.assert_allclose(df_coefficients.loc['Intercept', 'Standard Error'],
+                               np.sqrt(n_studies/(n_studies - 1)*np.sum((weight*residuals)**2))/np.sum(weight),
+                               rtol=1e-8)
+    assert df_results.loc['Results', 'Number of studies'] == df_results.loc['Results', 'Number of effect sizes']
+
+
+def test_one_effect_per_study_with_moderator_equals_meta_regression(df_values_parents):
+    df_coefficients, df_results = run_robust_meta_analysis(df_values_parents, moderators=['year'])
+    df_expected_coefficients, df_expected_models = run_meta_regression(df_values_parents, 'year')
+
+    np.testing.assert_allclose(df_coefficients['Coefficient'],
+                               df_expected_coefficients.loc['year', 'Coefficient'], rtol=1e-8)
+    np.testing.assert_allclose(df_results.loc['Results', 'Tau2'], df_expected_models.loc['year', 'Tau2'], rtol=1e-8,
+                               atol=1e-12)
+
+
+@pytest.mark.parametrize('moderators', [[], ['year']])
+@pytest.mark.parametrize('rho', [0.5, 0.8])
+def test_correlated_effects_equal_dense_refit(moderators, rho):
+    from source_assess_treatment_efficacy.meta_analysis.import_csv_for_meta_analysis import import_csv
+    from .conftest import META_ANALYSIS_CSV
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        df_values = import_csv(META_ANALYSIS_CSV, long_format=True)
+        df_coefficients, df_results = run_robust_meta_analysis(df_values, cluster='Author', moderators=moderators,
+                                                               rho=rho)
+        df_results_per_study, _, _ = run_meta_analysis(df_values.copy())
+
+    clusters, _ = pd.factorize(df_values.index.get_level_values('Author'))
+    X = np.column_stack([np.ones(len(df_values))] + [df_values[moderator].to_numpy(dtype=float)
+                                                     for moderator in moderators])
+    coefficients, standard_error, Tau2 = _refit(X, df_results_per_study['Effect size'].to_numpy(),
+                                                df_results_per_study['Standard Error of the ES'].to_numpy()**2,
+                                                clusters, rho)
+
+    assert clusters.max() + 1 < len(df_values)
+    assert df_results.loc['Results', 'Number of studies'] == clusters.max() + 1
+    np.testing.assert_allclose(df_results.loc['Results', 'Tau2'], Tau2, rtol=1e-8, atol=1e-12)
+    np.testing.assert_allclose(df_coefficients['Coefficient'], coefficients, rtol=1e-8)
+    np.testing.assert_allclose(df_coefficients['Standard Error'], standard_error, rtol=1e-8)
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+import sys
+import numpy as np
+import pandas as pd
+import pytest
+
+from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import run_meta_analysis
+from source_assess_treatment_efficacy.meta_analysis.sensitivity_analysis import (run_leave_one_out_analysis,
+                                                                                 run_cumulative_meta_analysis,
+                                                                                 run_pre_post_correlation_sensitivity,
+                                                                                 cumulative_forest_plot)
+
+from .conftest import assert_results_close
+
+
+def _studies(effect_size, standard_error_ES):
+    """Results per study of a simulated meta-analysis, in the order of their publication."""
+
+    return pd.DataFrame({'Year': np.arange(len(effect_size)), 'Effect size': effect_size,
+                         'Standard Error of the ES': standard_error_ES},
+                        index=['Study %d' % study for study in range(len(effect_size))])
+
+
+def test_cumulative_meta_analysis_equals_refits(df_values_parents):
+    df_results_per_study, _, _ = run_meta_analysis(df_values_parents.copy())
+    df_cumulative = run_cumulative_meta_analysis(df_results_per_study)
+
+    df_sorted = df_values_parents.iloc[np.argsort(df_values_parents['year'].to_numpy(), kind='stable')]
+    for n_studies in range(2, len(df_sorted) + 1):
+        _, df_expected, _ = run_meta_analysis(df_sorted.iloc[:n_studies].copy())
+        df_prefix = df_cumulative.iloc[[n_studies - 1]][df_expected.columns]
+        assert_results_close(df_prefix, df_expected.set_axis(df_prefix.index))
+
+
+def test_leave_one_out_analysis_equals_refits(df_values_parents):
+    df_results_per_study, df_results, _ = run_meta_analysis(df_values_parents.copy())
+    df_leave_one_out = run_leave_one_out_analysis(df_results_per_study, df_results)
+
+    for study in range(len(df_values_parents)):
+        _, df_expected, _ = run_meta_analysis(df_values_parents.drop(df_values_parents.index[study]).copy())
+        df_study = df_leave_one_out.iloc[[study]][df_expected.columns]
+        assert_results_close(df_study, df_expected.set_axis(df_study.index))
+
+
+@pytest.mark.parametrize('drift', [0, 3])
+def test_cumulative_summary_effects_equal_direct_sums(drift):
+    random_generator = np.random.default_rng(0)
+    n_studies = 3000
+    effect_size = random_generator.normal(0, 0.3, n_studies) + np.linspace(0, drift, n_studies)
+    standard_error_ES = np.geomspace(1, 1e-2, n_studies)*random_generator.uniform(0.5, 1.5, n_studies)
+    df_cumulative = run_cumulative_meta_analysis(_studies(effect_size, standard_error_ES))
+
+    Tau2 = df_cumulative['Tau2'].to_numpy()
+    weight = np.tril(1/(standard_error_ES[np.newaxis, :]**2 + Tau2[:, np.newaxis]))
+    np.testing.assert_allclose(df_cumulative['Summary Effect'], weight.dot(effect_size)/weight.sum(axis=1), rtol=1e-12,
+                               atol=1e-14)
+    np.testing.assert_allclose(df_cumulative['Variance Summary Effect'], 1/weight.sum(axis=1), rtol=1e-12)
+
+
+def test_pre_post_correlation_sensitivity_equals_separate_runs(df_values_parents):
+    correlations = [0.2, 0.5, 0.8]
+    _, df_results = run_pre_post_correlation_sensitivity(df_values_parents, correlations)
+
+    for correlation in correlations:
+        _, df_expected, _ = run_meta_analysis(df_values_parents.copy(), pre_post_correlation=correlation)
+        assert_results_close(df_results.loc[[correlation]], df_expected.set_axis(pd.Index([correlation],
+                                                                                           name='pre_post_correlation')))
+
+
+def test_cumulative_forest_plot_does_not_use_pyplot(df_values_parents, tmp_path):
+    pytest.importorskip('matplotlib')
+    from matplotlib.figure import Figure
+
+    df_results_per_study, _, _ = run_meta_analysis(df_values_parents.copy())
+    figure = cumulative_forest_plot(run_cumulative_meta_analysis(df_results_per_study))
+    figure.savefig(str(tmp_path / 'cumulative_forest_plot.png'))
+
+    assert isinstance(figure, Figure)
+    assert len(figure.axes[0].get_yticklabels()) == len(df_values_parents)
+    assert 'matplotlib.pyplot' not in sys.modules or not sys.modules['matplotlib.pyplot'].get_fignums()
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+import warnings
+import numpy as np
+import pytest
+import scipy.stats as scp
+
+from source_assess_treatment_efficacy.meta_analysis.perform_meta_analysis import run_meta_analysis
+from source_assess_treatment_efficacy.meta_analysis.subgroup_analysis import run_subgroup_analysis
+
+from .conftest import assert_results_close
+
+
+def _with_period(df_values):
+    """Splits the studies in two subgroups according to their year of publication."""
+
+    df_values = df_values.copy()
+    df_values['period'] = np.where(df_values['year'] < np.median(df_values['year']), 'before', 'after')
+    return df_values
+
+
+@pytest.mark.parametrize('tau2_method', ['DL', 'REML', 'PM'])
+def test_subgroups_equal_separate_runs(df_values_parents, tau2_method):
+    df_values = _with_period(df_values_parents)
+    df_results_per_subgroup, df_results_between_subgroups = run_subgroup_analysis(df_values, 'period',
+                                                                                  tau2_method=tau2_method)
+
+    summary_effect, variance_summary_effect = [], []
+    for period in ['after', 'before']:
+        df_subgroup = df_values[df_values['period'] == period]
+        _, df_expected, _ = run_meta_analysis(df_subgroup.drop(columns='period'), tau2_method=tau2_method)
+        assert_results_close(df_results_per_subgroup.loc[[period]].drop(columns='Number of studies'),
+                             df_expected.set_axis([period]))
+        assert df_results_per_subgroup.loc[period, 'Number of studies'] == len(df_subgroup)
+        summary_effect.append(df_expected['Summary Effect'].iloc[0])
+        variance_summary_effect.append(df_expected['Variance Summary Effect'].iloc[0])
+
+    # Q between the subgroups, from a fixed effect model of their summary effects
+    weight = 1/np.array(variance_summary_effect)
+    combined_effect = np.sum(weight*summary_effect)/np.sum(weight)
+    Q_between = np.sum(weight*(np.array(summary_effect) - combined_effect)**2)
+    np.testing.assert_allclose(df_results_between_subgroups.loc['Results', 'Q between'], Q_between, rtol=1e-8)
+    np.testing.assert_allclose(df_results_between_subgroups.loc['Results', 'Summary Effect'], combined_effect,
+                               rtol=1e-8)
+    np.testing.assert_allclose(df_results_between_subgroups.loc['Results', 'p-value'], scp.chi2.sf(Q_between, 1),
+                               rtol=1e-8)
+    assert df_results_between_subgroups.loc['Results', 'Number of subgroups'] == 2
+
+
+def test_pooled_tau2_equals_sums_over_subgroups(df_values_parents):
+    df_values = _with_period(df_values_parents)
+    df_results_per_subgroup, df_results_between_subgroups = run_subgroup_analysis(df_values, 'period',
+                                                                                  pooled_tau2=True)
+
+    df_results_per_study, _, _ = run_meta_analysis(df_values_parents.copy())
+    effect_size = df_results_per_study['Effect size'].to_numpy()
+    variance_ES = df_results_per_study['Standard Error of the ES'].to_numpy()**2
+    Q, C, degrees_of_freedom = 0, 0, 0
+    for period in ['after', 'before']:
+        in_subgroup = (df_values['period'] == period).to_numpy()
+        weight = 1/variance_ES[in_subgroup]
+        fixed_effect = np.sum(weight*effect_size[in_subgroup])/np.sum(weight)
+        Q += np.sum(weight*(effect_size[in_subgroup] - fixed_effect)**2)
+        C += np.sum(weight) - np.sum(weight**2)/np.sum(weight)
+        degrees_of_freedom += in_subgroup.sum() - 1
+    Tau2 = max((Q - degrees_of_freedom)/C, 0)
+
+    np.testing.assert_allclose(df_results_between_subgroups.loc['Results', 'Tau2'], Tau2, rtol=1e-8, atol=1e-12)
+    np.testing.assert_allclose(df_results_per_subgroup['Tau2'], Tau2, rtol=1e-8, atol=1e-12)
+    for period in ['after', 'before']:
+        in_subgroup = (df_values['period'] == period).to_numpy()
+        weight = 1/(variance_ES[in_subgroup] + Tau2)
+        np.testing.assert_allclose(df_results_per_subgroup.loc[period, 'Summary Effect'],
+                                   np.sum(weight*effect_size[in_subgroup])/np.sum(weight), rtol=1e-8)
+
+
+def test_subgroups_of_each_rater_equal_separate_analyses():
+    from source_assess_treatment_efficacy.meta_analysis.import_csv_for_meta_analysis import import_csv
+    from .conftest import META_ANALYSIS_CSV
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        df_values = _with_period(import_csv(META_ANALYSIS_CSV, long_format=True))
+        df_results_per_subgroup, df_results_between_subgroups = run_subgroup_analysis(df_values, 'period',
+                                                                                      group_by='raters')
+        for rater in ['Parents', 'Teachers']:
+            df_rater = df_values.xs(rater, level='raters', drop_level=False)
+            df_expected_per_subgroup, df_expected_between = run_subgroup_analysis(df_rater, 'period')
+            assert_results_close(df_results_per_subgroup.loc[rater],
+                                 df_expected_per_subgroup.loc[df_results_per_subgroup.loc[rater].index])
+            assert_results_close(df_results_between_subgroups.loc[[rater]], df_expected_between.set_axis([rater]))
+
+
+def test_pooled_tau2_requires_dersimonian_laird(df_values_parents):
+    with pytest.raises(ValueError):
+        run_subgroup_analysis(_with_period(df_values_parents), 'period', tau2_method='REML', pooled_tau2=True)